@@ -0,0 +1,121 @@
+"""
+Itinerary analytics
+Per-day distance, estimated travel time, bounding boxes and outlier stops.
+Everything is computed over whole coordinate columns with NumPy, so a full
+tenant's stops are summarised in a handful of array operations rather than
+a Python loop per stop.
+"""
+
+import numpy as np
+
+from geo import EARTH_RADIUS_M
+from routing import PROFILE_SPEEDS
+
+# A stop is an outlier when it lies further from its day's centre than
+# OUTLIER_FACTOR times the day's median distance from that centre, and at
+# least OUTLIER_MIN_M away
+OUTLIER_FACTOR = 3.0
+OUTLIER_MIN_M = 2000.0
+OUTLIER_MIN_STOPS = 3
+
+# Column order of the rows passed to summarize()
+COLUMNS = ('id', 'itinerary_id', 'day_number', 'order_in_day', 'latitude', 'longitude')
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Vectorized great-circle distance in metres between arrays of degrees"""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def group_median(values, group, starts, counts):
+    """Median of values within each contiguous group"""
+    # One sort on the group number plus the value scaled into [0, 0.5]
+    # orders values within each group
+    low = values.min()
+    span = values.max() - low
+    key = group + 0.5 * (values - low) / span if span else group
+    ranked = values[np.argsort(key)]
+    return (ranked[starts + (counts - 1) // 2] + ranked[starts + counts // 2]) / 2
+
+def empty_summary():
+    return {
+        'stops': 0,
+        'days': [],
+        'distance_m': 0.0,
+        'duration_s': {profile: 0.0 for profile in PROFILE_SPEEDS},
+        'outliers': 0,
+    }
+
+def summarize(rows):
+    """Summarise stops per itinerary and day
+
+    rows are (id, itinerary_id, day_number, order_in_day, latitude,
+    longitude) tuples. Returns {itinerary_id: summary} where each summary
+    has per-day 'distance_m' along the stop order, straight-line
+    'duration_s' per routing profile, a [min_lng, min_lat, max_lng, max_lat]
+    'bbox' and the ids of 'outliers', plus itinerary totals.
+    """
+    data = np.array(rows, dtype=np.float64).reshape(-1, len(COLUMNS))
+    if not len(data):
+        return {}
+    # Group stops by (itinerary, day) in visiting order
+    data = data[np.lexsort((data[:, 3], data[:, 2], data[:, 1]))]
+    ids = data[:, 0].astype(np.int64)
+    itinerary = data[:, 1].astype(np.int64)
+    day = data[:, 2].astype(np.int64)
+    lat = data[:, 4]
+    lng = data[:, 5]
+
+    new_group = np.empty(len(data), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = (itinerary[1:] != itinerary[:-1]) | (day[1:] != day[:-1])
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, len(data)))
+    group = np.cumsum(new_group) - 1
+
+    # Legs between consecutive stops of the same day
+    legs = np.zeros(len(data))
+    legs[1:] = np.where(new_group[1:], 0.0, haversine_m(lat[:-1], lng[:-1], lat[1:], lng[1:]))
+    distance = np.add.reduceat(legs, starts)
+
+    bbox = np.column_stack([
+        np.minimum.reduceat(lng, starts), np.minimum.reduceat(lat, starts),
+        np.maximum.reduceat(lng, starts), np.maximum.reduceat(lat, starts),
+    ])
+
+    # Distance of each stop from its day's centre, compared with the day's
+    # median distance. Medians keep a single far-off stop from dragging the
+    # centre towards itself.
+    centre_lat = group_median(lat, group, starts, counts)
+    centre_lng = group_median(lng, group, starts, counts)
+    spread = haversine_m(lat, lng, centre_lat[group], centre_lng[group])
+    limit = np.maximum(group_median(spread, group, starts, counts) * OUTLIER_FACTOR, OUTLIER_MIN_M)
+    is_outlier = (spread > limit[group]) & (counts[group] >= OUTLIER_MIN_STOPS)
+
+    outliers = [[] for _ in starts]
+    for index in np.flatnonzero(is_outlier):
+        outliers[group[index]].append(int(ids[index]))
+
+    durations = {profile: distance / speed for profile, speed in PROFILE_SPEEDS.items()}
+    summaries = {}
+    for g, start in enumerate(starts):
+        itinerary_id = int(itinerary[start])
+        if itinerary_id not in summaries:
+            summaries[itinerary_id] = empty_summary()
+        summary = summaries[itinerary_id]
+        summary['stops'] += int(counts[g])
+        summary['distance_m'] += float(distance[g])
+        summary['outliers'] += len(outliers[g])
+        for profile in PROFILE_SPEEDS:
+            summary['duration_s'][profile] += float(durations[profile][g])
+        summary['days'].append({
+            'day': int(day[start]),
+            'stops': int(counts[g]),
+            'distance_m': float(distance[g]),
+            'duration_s': {profile: float(durations[profile][g]) for profile in PROFILE_SPEEDS},
+            'bbox': [float(value) for value in bbox[g]],
+            'outliers': outliers[g],
+        })
+    return summaries
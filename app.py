@@ -1,23 +1,311 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g, has_request_context, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from markupsafe import escape
+from sqlalchemy import and_, case, delete, event, func, insert, or_, tuple_, update
+from sqlalchemy.orm import make_transient_to_detached
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import os
+import base64
+import click
+import gzip
 import json
+import mimetypes
+import multiprocessing
+import secrets
+import sqlite3
+import hashlib
+import hmac
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
+import analytics
+import assets
+import bundles
+import day_planner
+import geo
+import images
+import jobs
+import live
+import metrics
+import passwords
+import routing
+import search
+import server
+import spatial
+import stop_io
+import tiles
+
 app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-change-this'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///tourism_app.db'
+# Sessions are signed with this; `flask serve` refuses to start on the default
+DEV_SECRET_KEY = 'dev-secret-key-change-this'
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', DEV_SECRET_KEY)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///tourism_app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['ROUTER_BACKEND'] = os.environ.get('ROUTER_BACKEND', 'straight')  # straight, osrm
+app.config['OSRM_URL'] = os.environ.get('OSRM_URL', 'https://router.project-osrm.org')
+app.config['ROUTER_RETRY_AFTER'] = float(os.environ.get('ROUTER_RETRY_AFTER', 60))  # Seconds to skip a failing router
+app.config['ROUTE_CACHE_PATH'] = os.path.join(app.instance_path, 'route_cache.db')
+app.config['BUNDLE_FOLDER'] = os.path.join(app.instance_path, 'bundles')
+app.config['JOB_DATABASE_PATH'] = os.path.join(app.instance_path, 'jobs.db')
+app.config['IMPORT_FOLDER'] = os.path.join(app.instance_path, 'imports')
+# Background job threads per process (imports, image file deletion)
+app.config['JOB_WORKERS'] = max(int(os.environ.get('JOB_WORKERS', 2)), 1)
+app.config['TILE_CACHE_PATH'] = os.path.join(app.instance_path, 'tile_cache.db')
+app.config['TILE_CACHE_MAX_MB'] = int(os.environ.get('TILE_CACHE_MAX_MB', 512))
+# Memory per process for serialized /api/stops payloads, least recently used evicted first
+app.config['STOPS_CACHE_MAX_MB'] = int(os.environ.get('STOPS_CACHE_MAX_MB', 64))
+# <layer>.mbtiles files in this folder are served before the cache and upstream
+app.config['TILE_MBTILES_FOLDER'] = os.environ.get('TILE_MBTILES_FOLDER', os.path.join(app.instance_path, 'mbtiles'))
+app.config['TILE_OFFLINE'] = os.environ.get('TILE_OFFLINE', '').lower() in ('1', 'true', 'yes')
+app.config['TILE_USER_AGENT'] = os.environ.get('TILE_USER_AGENT', 'TourismItineraryApp/1.0 tile cache')
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', 2))
+app.config['IMPORT_BATCH_SIZE'] = 1000
+app.config['PAGE_SIZE'] = 50  # Rows per page of admin listings
+app.config['IMPORT_MAX_REPORTED_ERRORS'] = 200
+# Seconds to reuse a logged-in user's identity across requests (0 disables)
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 0))
+# Seconds to reuse the platform-wide totals on the super admin dashboard
+app.config['PLATFORM_STATS_TTL'] = float(os.environ.get('PLATFORM_STATS_TTL', 60))
+app.config['LIVE_BROKER'] = os.environ.get('LIVE_BROKER', 'sqlite')  # sqlite, local
+app.config['LIVE_DATABASE_PATH'] = os.path.join(app.instance_path, 'live.db')
+# SQL statements slower than this are logged with the view that ran them
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 250))
+# Bearer token required by /metrics when set
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+# Lets admins turn on a per-page timing and SQL toolbar with ?debug_toolbar=1
+app.config['DEBUG_TOOLBAR'] = os.environ.get('DEBUG_TOOLBAR', '').lower() in ('1', 'true', 'yes')
+# Open live update streams per process; further clients get a 503 and keep the page as loaded
+app.config['LIVE_MAX_CONNECTIONS'] = int(os.environ.get('LIVE_MAX_CONNECTIONS', 1000))
+app.config['LIVE_HEARTBEAT'] = 15.0
+app.config['LIVE_STREAM_LIFETIME'] = 300.0
+# Werkzeug hash method for new passwords, e.g. 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000';
+# existing hashes are upgraded to it when their owner logs in
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+# Login and registration attempts per minute (0 disables)
+app.config['LOGIN_RATE_PER_IP'] = float(os.environ.get('LOGIN_RATE_PER_IP', 20))
+app.config['LOGIN_RATE_PER_EMAIL'] = float(os.environ.get('LOGIN_RATE_PER_EMAIL', 5))
+# Reverse proxies in front of the app whose X-Forwarded-* headers are trusted.
+# Leave at 0 unless one is; otherwise clients could pick their own address
+# and dodge the per-IP login limit.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+# Database profile: 'production' tunes SQLite for concurrent map readers and
+# admin writers (WAL lets readers proceed while a write is in progress)
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,       # ms to wait on a lock instead of failing
+    'cache_size': -64000,       # KiB
+    'mmap_size': 268435456,     # bytes
+    'temp_store': 'MEMORY',
+}
+app.config['DATABASE_PROFILE'] = os.environ.get('DATABASE_PROFILE', 'development')
+app.config['SQLITE_PRAGMAS'] = SQLITE_PRODUCTION_PRAGMAS if app.config['DATABASE_PROFILE'] == 'production' else {}
+
+engine_options = {}
+if 'DB_POOL_SIZE' in os.environ:
+    engine_options['pool_size'] = int(os.environ['DB_POOL_SIZE'])
+    engine_options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    engine_options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+if app.config['TRUSTED_PROXIES']:
+    proxies = app.config['TRUSTED_PROXIES']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
 
 # Create upload directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 db = SQLAlchemy(app)
 
+def apply_sqlite_pragmas(dbapi_connection, pragmas):
+    """Run PRAGMA statements on a new SQLite connection"""
+    if not pragmas or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+with app.app_context():
+    @event.listens_for(db.engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, app.config['SQLITE_PRAGMAS'])
+
+# Request and SQL metrics (see metrics.py)
+app_metrics = metrics.Metrics()
+
+def current_endpoint():
+    return (request.endpoint or 'none') if has_request_context() else 'none'
+
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+    
+    @event.listens_for(db.engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_start'].pop()
+        stats = g.get('request_stats') if has_request_context() else None
+        if stats is not None:
+            stats.add_query(statement, seconds)
+        if seconds * 1000 >= app.config['SLOW_QUERY_MS']:
+            app.logger.warning('Slow query (%.0f ms) in %s: %s', seconds * 1000, current_endpoint(), statement)
+            app_metrics.record_slow_query(current_endpoint())
+    
+    @event.listens_for(db.engine, 'handle_error')
+    def discard_query_timer(exception_context):
+        if exception_context.connection is not None:
+            timers = exception_context.connection.info.get('query_start')
+            if timers:
+                timers.pop()
+
+@app.before_request
+def start_request_stats():
+    g.request_stats = metrics.RequestStats()
+    toggle = request.args.get('debug_toolbar')
+    if toggle is not None and app.config['DEBUG_TOOLBAR'] and debug_toolbar_allowed():
+        session['debug_toolbar'] = toggle == '1'
+
+@app.after_request
+def record_request_metrics(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    app_metrics.record_request(current_endpoint(), request.method, response.status_code, stats)
+    
+    # Config and content type first: reading the session adds Vary: Cookie,
+    # which would stop caches from sharing static files and tiles
+    if (app.config['DEBUG_TOOLBAR'] and response.mimetype == 'text/html' and not response.direct_passthrough
+            and not response.is_streamed and session.get('debug_toolbar') and debug_toolbar_allowed()):
+        body = response.get_data(as_text=True)
+        at = body.rfind('</body>')
+        if at != -1:
+            toolbar = metrics.toolbar_html(stats, current_endpoint(), app.config['SLOW_QUERY_MS'] / 1000)
+            response.set_data(body[:at] + toolbar + body[at:])
+    return response
+
+@app.teardown_request
+def record_failed_request(exception):
+    # Still set when the request ended in an error that skipped after_request
+    stats = g.pop('request_stats', None)
+    if stats is not None:
+        app_metrics.record_request(current_endpoint(), request.method, 500, stats)
+
+def debug_toolbar_allowed():
+    user = get_current_user()
+    return user is not None and user.role in ('admin', 'super_admin')
+
+# Route geometry service (see routing.py)
+router_options = {'base_url': app.config['OSRM_URL']} if app.config['ROUTER_BACKEND'] == 'osrm' else {}
+route_service = routing.RouteService(
+    routing.create_router(app.config['ROUTER_BACKEND'], **router_options),
+    routing.SegmentCache(app.config['ROUTE_CACHE_PATH']),
+    retry_after=app.config['ROUTER_RETRY_AFTER']
+)
+
+# Fingerprinted static URLs and long-lived caching (see assets.py)
+static_assets = assets.StaticAssets(app.static_folder)
+app.url_defaults(static_assets.add_fingerprint)
+app.view_functions['static'] = static_assets.serve
+
+@app.cli.command('compress-assets')
+def compress_assets():
+    """Write precompressed .gz/.br copies of static CSS and JS"""
+    print(f"✅ Wrote {static_assets.precompress()} compressed files")
+
+# Map tiles through a local cache (see tiles.py)
+tile_service = tiles.TileService(
+    tiles.TileCache(app.config['TILE_CACHE_PATH'], app.config['TILE_CACHE_MAX_MB'] * 1024 * 1024),
+    tiles.MBTilesSource(app.config['TILE_MBTILES_FOLDER']),
+    app.config['TILE_USER_AGENT'],
+    offline=app.config['TILE_OFFLINE']
+)
+
+@app.cli.command('prefetch-tiles')
+@click.option('--layer', 'layers', multiple=True, type=click.Choice(sorted(tiles.LAYERS)), default=['street'],
+              help='Tile layer to warm; repeat for several')
+@click.option('--zoom', 'zoom_range', default='10-15', help='Zoom levels as a single level or a range, e.g. 10-15')
+@click.option('--max-tiles', default=5000, help='Refuse to start if more tiles than this are needed')
+def prefetch_tiles(layers, zoom_range, max_tiles):
+    """Warm the tile cache for every active itinerary's bounding box
+
+    Keep bulk downloads modest: the public tile servers' usage policies
+    forbid heavy scraping. For large areas, use an MBTiles file instead.
+    """
+    low, _, high = zoom_range.partition('-')
+    zooms = range(int(low), int(high or low) + 1)
+    boxes = db.session.query(
+        func.min(Stop.latitude), func.min(Stop.longitude), func.max(Stop.latitude), func.max(Stop.longitude)
+    ).join(Itinerary, Stop.itinerary_id == Itinerary.id).join(Company, Itinerary.company_id == Company.id).filter(
+        Itinerary.is_active == True, Company.is_active == True
+    ).group_by(Stop.itinerary_id).all()
+    
+    for layer in layers:
+        try:
+            fetched, skipped, failed = tile_service.prefetch(layer, boxes, zooms, max_tiles)
+        except ValueError as e:
+            raise click.ClickException(f'{layer}: {e}')
+        print(f"✅ {layer}: {fetched} tiles fetched, {skipped} already cached, {failed} failed")
+
+@app.cli.command('prune-bundles')
+def prune_bundles():
+    """Delete offline bundle files no current bundle refers to"""
+    print(f"✅ Removed {bundle_store.prune()} unused bundle files")
+
+# Background generation of resized stop images (see images.py)
+image_worker = images.VariantWorker(app.config['UPLOAD_FOLDER'], max_workers=app.config['IMAGE_WORKERS'])
+
+# Password hashing and login throttling (see passwords.py)
+password_hasher = passwords.PasswordHasher(app.config['PASSWORD_HASH_METHOD'],
+                                           max_workers=app.config['PASSWORD_HASH_WORKERS'])
+login_ip_limiter = passwords.RateLimiter(app.config['LOGIN_RATE_PER_IP'])
+login_email_limiter = passwords.RateLimiter(app.config['LOGIN_RATE_PER_EMAIL'], burst=10)
+
+def throttle_auth(email=None):
+    """Seconds the client must wait before another login/registration attempt, or 0
+
+    Clients are told apart by request.remote_addr, which is the address the
+    trusted proxies saw when TRUSTED_PROXIES is set.
+    """
+    wait = login_ip_limiter.take(request.remote_addr)
+    if not wait and email:
+        wait = login_email_limiter.take(email.strip().lower())
+    return wait
+
+def too_many_attempts(template, wait):
+    flash(f'Too many attempts. Please try again in {int(wait) + 1} seconds.', 'error')
+    return render_template(template), 429, {'Retry-After': str(int(wait) + 1)}
+
+# Background jobs (see jobs.py)
+job_queue = jobs.JobQueue(app.config['JOB_DATABASE_PATH'], workers=app.config['JOB_WORKERS'],
+                          context=app.app_context, logger=app.logger)
+
+@app.cli.command('prune-jobs')
+@click.option('--days', default=7, show_default=True, help='Keep finished jobs this recent')
+def prune_jobs(days):
+    """Delete finished and failed background jobs"""
+    print(f"✅ Removed {job_queue.prune(days * 86400)} old jobs")
+
+# Live updates to open maps (see live.py)
+# The SQLite broker relays events between the worker processes of `flask serve`
+broker_options = ({'path': app.config['LIVE_DATABASE_PATH'], 'logger': app.logger}
+                  if app.config['LIVE_BROKER'] == 'sqlite' else {})
+live_broker = live.create_broker(app.config['LIVE_BROKER'], **broker_options)
+live_fanout = live.Fanout(app.config['LIVE_HEARTBEAT'], app.config['LIVE_STREAM_LIFETIME'])
+app_metrics.add_gauge('live_connections', 'Open live update streams', live_broker.connection_count)
+
+def publish_itinerary_event(itinerary_id, event, data):
+    """Push a change to maps showing an itinerary; call after the change is committed"""
+    live_broker.publish(f'itinerary:{itinerary_id}', event, data)
+
 # Database Models
 class Company(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -37,11 +325,16 @@ class Company(db.Model):
     # Relationships
     users = db.relationship('User', backref='company', lazy=True, cascade='all, delete-orphan')
     itineraries = db.relationship('Itinerary', backref='company', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Keyset pagination order of the company listings
+        db.Index('ix_company_created', 'created_at', 'id'),
+    )
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), nullable=False)
-    email = db.Column(db.String(120), nullable=False)
+    email = db.Column(db.String(120), nullable=False, index=True)  # Looked up on every login
     password_hash = db.Column(db.String(255), nullable=False)
     first_name = db.Column(db.String(50))
     last_name = db.Column(db.String(50))
@@ -51,7 +344,12 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Foreign key
-    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)  # Nullable for super_admin
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True, index=True)  # Nullable for super_admin
+    
+    __table_args__ = (
+        # Keyset pagination order of the user listing
+        db.Index('ix_user_created', 'created_at', 'id'),
+    )
 
 class Itinerary(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -65,6 +363,18 @@ class Itinerary(db.Model):
     
     # Relationships
     stops = db.relationship('Stop', backref='itinerary', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Company dashboards and the public listing filter on these together
+        db.Index('ix_itinerary_company_active', 'company_id', 'is_active'),
+        # Keyset pagination order of the public and per-company listings
+        db.Index('ix_itinerary_active_created', 'is_active', 'created_at', 'id'),
+        db.Index('ix_itinerary_company_created', 'company_id', 'created_at', 'id'),
+    )
+
+def stop_geohash_default(context):
+    params = context.get_current_parameters()
+    return geo.geohash_encode(params['latitude'], params['longitude'])
 
 class Stop(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -78,8 +388,82 @@ class Stop(db.Model):
     order_in_day = db.Column(db.Integer, default=1)
     itinerary_id = db.Column(db.Integer, db.ForeignKey('itinerary.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Spatial index key, kept in sync with latitude/longitude
+    geohash = db.Column(db.String(12), default=stop_geohash_default, index=True)
+    # Id of the import job that created the stop, so a failed import can be undone
+    import_job = db.Column(db.String(32))
+    
+    __table_args__ = (
+        # Matches the filter and ORDER BY of the stops API and admin views
+        db.Index('ix_stop_itinerary_day_order', 'itinerary_id', 'day_number', 'order_in_day'),
+    )
+
+# Full-text index and its sync triggers (see search.py)
+search.register(db.metadata)
+# Spatial index and its sync triggers (see spatial.py)
+spatial.register(db.metadata)
+
+@event.listens_for(Stop, 'before_update')
+def update_stop_geohash(mapper, connection, stop):
+    stop.geohash = geo.geohash_encode(stop.latitude, stop.longitude)
 
 # Authentication helpers
+# Snapshots of (user, company) column values keyed by user id, so authenticated
+# requests can skip the identity queries while IDENTITY_CACHE_TTL is enabled.
+# Invalidation is rare (a company being switched on or off), so it bumps one
+# shared counter and every worker process of `flask serve` drops all of its
+# snapshots taken before.
+identity_cache = {}
+identity_cache_lock = threading.Lock()
+identity_cache_version = multiprocessing.Value('Q', 0)
+
+def snapshot_row(obj):
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+def restore_row(model, values):
+    """Attach a cached snapshot to the current session without querying"""
+    obj = model(**values)
+    make_transient_to_detached(obj)
+    return db.session.merge(obj, load=False)
+
+def load_identity(user_id):
+    """Return (user, company) for a user id, from the identity cache when possible"""
+    ttl = app.config['IDENTITY_CACHE_TTL']
+    if ttl:
+        with identity_cache_lock:
+            entry = identity_cache.get(user_id)
+        if entry and entry[0] > time.monotonic() and entry[3] == identity_cache_version.value:
+            user = restore_row(User, entry[1])
+            company = restore_row(Company, entry[2]) if entry[2] else None
+            return user, company
+    
+    # Read before the rows, so a change made meanwhile leaves the snapshot stale
+    version = identity_cache_version.value
+    user = db.session.get(User, user_id)
+    company = db.session.get(Company, user.company_id) if user and user.company_id else None
+    
+    if ttl and user:
+        with identity_cache_lock:
+            identity_cache[user_id] = (
+                time.monotonic() + ttl,
+                snapshot_row(user),
+                snapshot_row(company) if company else None,
+                version
+            )
+    return user, company
+
+def invalidate_identity(user_id=None, company_id=None):
+    """Drop cached identities for a user, or for every user of a company
+
+    Other worker processes drop every identity they cached before the call.
+    """
+    with identity_cache_version.get_lock():
+        identity_cache_version.value += 1
+    with identity_cache_lock:
+        for cached_user_id, entry in list(identity_cache.items()):
+            if cached_user_id == user_id or (company_id is not None and entry[1]['company_id'] == company_id):
+                del identity_cache[cached_user_id]
+
 def login_required(role=None):
     def decorator(f):
         @wraps(f)
@@ -88,7 +472,7 @@ def login_required(role=None):
                 flash('Please log in to access this page.', 'warning')
                 return redirect(url_for('login'))
             
-            user = User.query.get(session['user_id'])
+            user = get_current_user()
             if not user or not user.is_active:
                 session.clear()
                 flash('Your account is not active.', 'error')
@@ -103,46 +487,921 @@ def login_required(role=None):
     return decorator
 
 def get_current_user():
-    if 'user_id' in session:
-        return User.query.get(session['user_id'])
-    return None
+    if 'user_id' not in session:
+        return None
+    # Resolve the identity once per request
+    if 'current_user' not in g:
+        g.current_user, g.current_company = load_identity(session['user_id'])
+    return g.current_user
 
 def get_current_company():
     user = get_current_user()
     if user and user.company_id:
-        return Company.query.get(user.company_id)
+        return g.current_company
+    return None
+
+# Stops API cache
+# Serialized /api/stops payloads keyed by itinerary id. Each entry carries the
+# version it was built at; admin writes bump the version so the next request
+# rebuilds the payload instead of serving stale data. Versions live in shared
+# memory, one counter per slot of itinerary ids, so a write handled by one
+# worker process of `flask serve` also invalidates the other workers' copies.
+# Each process keeps at most STOPS_CACHE_MAX_MB of payloads.
+STOPS_CACHE_SLOTS = 65536
+stops_cache_versions = multiprocessing.Array('Q', STOPS_CACHE_SLOTS)
+
+class StopsCache:
+    """Payload bodies per itinerary, least recently used evicted past max_bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # itinerary id -> (version, {(variant, encoding): (etag, body)})
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(bodies):
+        return sum(len(body) for _, body in bodies.values())
+
+    def get(self, itinerary_id, version):
+        """The bodies built at version, or None"""
+        with self.lock:
+            entry = self.entries.get(itinerary_id)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(itinerary_id)
+            return entry[1]
+
+    def put(self, itinerary_id, version, bodies):
+        """Store bodies unless the itinerary was written to since version was read"""
+        with self.lock:
+            if stops_cache_versions[itinerary_id % STOPS_CACHE_SLOTS] != version:
+                return
+            self._remove(itinerary_id)
+            self.entries[itinerary_id] = (version, bodies)
+            self.size += self.entry_size(bodies)
+            self._evict()
+
+    def add(self, itinerary_id, bodies, key, value):
+        """Add an encoded variant to bodies, counting it if they are still cached"""
+        with self.lock:
+            if key in bodies:
+                return
+            bodies[key] = value
+            entry = self.entries.get(itinerary_id)
+            if entry is not None and entry[1] is bodies:
+                self.size += len(value[1])
+                self._evict()
+
+    def pop(self, itinerary_id):
+        with self.lock:
+            self._remove(itinerary_id)
+
+    def _remove(self, itinerary_id):
+        entry = self.entries.pop(itinerary_id, None)
+        if entry is not None:
+            self.size -= self.entry_size(entry[1])
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, (_, bodies) = self.entries.popitem(last=False)
+            self.size -= self.entry_size(bodies)
+
+stops_cache = StopsCache(app.config['STOPS_CACHE_MAX_MB'] * 1024 * 1024)
+
+def bump_itinerary_version(itinerary_id):
+    """Invalidate the cached stops payload for an itinerary"""
+    with stops_cache_versions.get_lock():
+        stops_cache_versions[itinerary_id % STOPS_CACHE_SLOTS] += 1
+    stops_cache.pop(itinerary_id)
+
+def serialize_stop(stop):
+    return {
+        'id': stop.id,
+        'name': stop.name,
+        'description': stop.description,
+        'latitude': stop.latitude,
+        'longitude': stop.longitude,
+        'day_number': stop.day_number,
+        'is_day_active': stop.is_day_active,
+        'image_filename': stop.image_filename,
+        'image_srcset': images.variant_srcsets(
+            app.config['UPLOAD_FOLDER'], stop.image_filename, '/static/uploads/'
+        ) if stop.image_filename else {},
+        'order_in_day': stop.order_in_day
+    }
+
+# Media types of the /api/stops variants. The columnar one carries only what
+# the map draws, as parallel arrays; descriptions and images come from
+# /api/stop/<id> when a stop is opened.
+STOPS_FORMATS = {
+    'full': 'application/json',
+    'columnar': 'application/vnd.tourism.stops+json',
+}
+
+def serialize_stops_columnar(stops):
+    return {
+        'format': 'columnar',
+        'id': [stop.id for stop in stops],
+        'name': [stop.name for stop in stops],
+        # Six decimals is about 10 cm
+        'latitude': [round(stop.latitude, 6) for stop in stops],
+        'longitude': [round(stop.longitude, 6) for stop in stops],
+        'day_number': [stop.day_number for stop in stops],
+        'order_in_day': [stop.order_in_day for stop in stops],
+        'is_day_active': [1 if stop.is_day_active else 0 for stop in stops],
+    }
+
+def get_cached_stops_payload(itinerary_id, variant='full', encoding=None):
+    """Return (etag, body) for an itinerary's stops, building it on a cache miss
+
+    variant is a key of STOPS_FORMATS; encoding='gzip' returns the body
+    compressed, with its own ETag.
+    """
+    version = stops_cache_versions[itinerary_id % STOPS_CACHE_SLOTS]
+    bodies = stops_cache.get(itinerary_id, version)
+    
+    if bodies is None:
+        stops = Stop.query.filter_by(itinerary_id=itinerary_id).order_by(Stop.day_number, Stop.order_in_day).all()
+        full = app.json.dumps([serialize_stop(stop) for stop in stops]).encode('utf-8')
+        columnar = json.dumps(serialize_stops_columnar(stops), separators=(',', ':')).encode('utf-8')
+        bodies = {
+            ('full', None): (hashlib.sha1(full).hexdigest(), full),
+            ('columnar', None): (hashlib.sha1(columnar).hexdigest(), columnar),
+        }
+        # Ids without an itinerary are answered but not kept, so walking
+        # /api/stops/<n> cannot fill the cache
+        if stops or db.session.query(Itinerary.id).filter_by(id=itinerary_id).first():
+            stops_cache.put(itinerary_id, version, bodies)
+    
+    key = (variant, encoding)
+    if key not in bodies:
+        # Compressed once per version, on first request
+        etag, body = bodies[(variant, None)]
+        stops_cache.add(itinerary_id, bodies, key, (f'{etag}-gz', gzip.compress(body, compresslevel=6, mtime=0)))
+    return bodies[key]
+
+# Offline bundles (see bundles.py)
+bundle_store = bundles.BundleStore(app.config['BUNDLE_FOLDER'])
+
+def read_thumbnail(filename):
+    """(name, bytes) of a stop image's thumbnail variant, or None if none was generated"""
+    for fmt in images.VARIANT_FORMATS:
+        name = images.variant_filename(filename, 'thumb', fmt)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                return name, f.read()
     return None
 
+def build_bundle_files(itinerary, company_name, stops_body, progress=None):
+    """Files of an itinerary's offline bundle as {path: bytes}, and whether any
+    route segment is a straight-line stand-in for a failing router
+
+    progress(done, total, message) is called per routed segment and thumbnail.
+    """
+    stops = json.loads(stops_body)
+    files = {'stops.json': stops_body}
+    degraded = False
+    progress = progress or (lambda done, total, message: None)
+    routed = 0
+    total = max(len(stops) - 1, 0) * len(routing.PROFILES) + len(stops)
+    
+    def segment_routed(done, pairs):
+        progress(routed + done, total, 'Routing')
+    
+    # Every profile with all zoom tiers, so the map can route offline at any zoom
+    points = [(stop['latitude'], stop['longitude']) for stop in stops]
+    for profile in routing.PROFILES:
+        segments = route_service.segments(profile, points, progress=segment_routed)
+        routed += len(segments)
+        if route_service.router.name != routing.StraightLineRouter.name:
+            degraded = degraded or any(segment['fallback'] for segment in segments)
+        files[f'routes/{profile}.json'] = app.json.dumps({
+            'profile': profile,
+            'tiers': [routing.tier_zoom_range(tier) for tier in range(len(routing.ZOOM_TIERS))],
+            'segments': segments
+        }).encode('utf-8')
+    
+    thumbnails = {}
+    for index, stop in enumerate(stops, 1):
+        thumbnail = read_thumbnail(stop['image_filename']) if stop['image_filename'] else None
+        if thumbnail:
+            thumbnails[stop['id']] = f'images/{thumbnail[0]}'
+            files[thumbnails[stop['id']]] = thumbnail[1]
+        progress(routed + index, total, 'Adding images')
+    
+    files['itinerary.json'] = app.json.dumps({
+        'id': itinerary.id,
+        'name': itinerary.name,
+        'description': itinerary.description or '',
+        'company_name': company_name,
+        'thumbnails': thumbnails
+    }).encode('utf-8')
+    return files, degraded
+
+def bundle_source_key(itinerary, company_name, etag):
+    # Everything a bundle is built from, short of reading the thumbnails;
+    # new image variants change the stops payload's srcsets, and so its ETag
+    return hashlib.sha1(json.dumps([
+        etag, itinerary.name, itinerary.description, company_name,
+        route_service.router.name, routing.ZOOM_TIERS
+    ]).encode('utf-8')).hexdigest()
+
+def get_itinerary_bundle(itinerary_id):
+    """Manifest of a public itinerary's bundle, or None while it is being built
+
+    A bundle whose data changed is rebuilt by a background job. One built
+    while the router was failing is kept under a degraded source key: it is
+    served, and rebuilt once the router may be back.
+    """
+    itinerary, company_name = public_itinerary_query().filter(Itinerary.id == itinerary_id).first_or_404()
+    etag, _ = get_cached_stops_payload(itinerary.id)
+    source_key = bundle_source_key(itinerary, company_name, etag)
+    manifest = bundle_store.current(itinerary.id, source_key, f'{source_key}-degraded')
+    if manifest and manifest['source'] == source_key:
+        return manifest
+    if manifest is None or (route_service.router_available()
+                            and bundle_store.age(itinerary.id) >= app.config['ROUTER_RETRY_AFTER']):
+        job_queue.enqueue('build_bundle', {'itinerary_id': itinerary.id}, unique=True)
+    return manifest
+
+@job_queue.handler('build_bundle')
+def build_bundle_job(job):
+    row = public_itinerary_query().filter(Itinerary.id == job.payload['itinerary_id']).first()
+    if row is None:
+        raise jobs.JobError('The itinerary is not public')
+    itinerary, company_name = row
+    etag, stops_body = get_cached_stops_payload(itinerary.id)
+    source_key = bundle_source_key(itinerary, company_name, etag)
+    manifest = bundle_store.current(itinerary.id, source_key)
+    if manifest is None:
+        files, degraded = build_bundle_files(itinerary, company_name, stops_body, progress=job.progress)
+        manifest = bundle_store.build(itinerary.id, f'{source_key}-degraded' if degraded else source_key, files)
+    return {'version': manifest['version'], 'degraded': manifest['source'] != source_key}
+
+def bundle_building():
+    return (jsonify({'status': 'building', 'message': 'The offline bundle is being prepared'}), 202,
+            {'Retry-After': '2', 'Cache-Control': 'no-store'})
+
+# Stop images
+def save_stop_image(file, itinerary_id):
+    """Store an uploaded stop image and queue its resized variants"""
+    filename, created = images.save_upload(file, app.config['UPLOAD_FOLDER'])
+    # Variants of an already-stored image may still be missing (e.g. a failed
+    # earlier run); generation skips whatever exists
+    image_worker.submit(filename, on_complete=lambda: bump_itinerary_version(itinerary_id))
+    return filename
+
+def release_stop_image(filename, stop_id):
+    """Queue deleting an image unless another stop still uses it"""
+    if filename:
+        job_queue.enqueue('release_image', {'filename': filename, 'stop_id': stop_id})
+
+@job_queue.handler('release_image')
+def release_image_job(job):
+    filename = job.payload['filename']
+    still_used = db.session.query(Stop.id).filter(
+        Stop.image_filename == filename, Stop.id != job.payload['stop_id']
+    ).first()
+    if not still_used:
+        images.remove_image(app.config['UPLOAD_FOLDER'], filename)
+    return {'removed': not still_used}
+
+# Aggregate queries
+# Dashboards show counts over relationships; computing them with GROUP BY keeps
+# each page at a fixed number of statements instead of lazy-loading per row.
+def get_itinerary_stats(company_id, itinerary_ids=None):
+    """Map itinerary id -> {'stops', 'max_day'} for one company, optionally limited to some itineraries"""
+    query = db.session.query(
+        Stop.itinerary_id, func.count(Stop.id), func.max(Stop.day_number)
+    ).join(Itinerary).filter(Itinerary.company_id == company_id)
+    if itinerary_ids is not None:
+        query = query.filter(Stop.itinerary_id.in_(itinerary_ids))
+    rows = query.group_by(Stop.itinerary_id).all()
+    return {itinerary_id: {'stops': stops, 'max_day': max_day} for itinerary_id, stops, max_day in rows}
+
+def get_company_stats(company_ids):
+    """Map company id -> {'users', 'itineraries', 'stops'} for the given companies"""
+    stats = {}
+    
+    def add(rows, key):
+        for company_id, count in rows:
+            stats.setdefault(company_id, {'users': 0, 'itineraries': 0, 'stops': 0})[key] = count
+    
+    add(db.session.query(User.company_id, func.count(User.id)).filter(
+        User.company_id.in_(company_ids)).group_by(User.company_id), 'users')
+    add(db.session.query(Itinerary.company_id, func.count(Itinerary.id)).filter(
+        Itinerary.company_id.in_(company_ids)).group_by(Itinerary.company_id), 'itineraries')
+    add(db.session.query(Itinerary.company_id, func.count(Stop.id)).join(Stop).filter(
+        Itinerary.company_id.in_(company_ids)).group_by(Itinerary.company_id), 'stops')
+    return stats
+
+def count_active(model, *criteria):
+    """(total, active) row counts of a model in one statement"""
+    total, active = db.session.query(
+        func.count(model.id), func.coalesce(func.sum(case((model.is_active == True, 1), else_=0)), 0)
+    ).filter(*criteria).one()
+    return total, active
+
+def get_itinerary_analytics(company_id=None, itinerary_id=None, itinerary_ids=None):
+    """Per-day distance/time/outlier summaries (see analytics.py) keyed by itinerary id
+
+    Covers one itinerary, a list of itineraries, one company's itineraries,
+    or the whole platform.
+    """
+    query = db.session.query(
+        Stop.id, Stop.itinerary_id, Stop.day_number, Stop.order_in_day, Stop.latitude, Stop.longitude
+    )
+    if itinerary_id is not None:
+        query = query.filter(Stop.itinerary_id == itinerary_id)
+    elif itinerary_ids is not None:
+        query = query.filter(Stop.itinerary_id.in_(itinerary_ids))
+    elif company_id is not None:
+        query = query.join(Itinerary).filter(Itinerary.company_id == company_id)
+    return analytics.summarize(query.all())
+
+@app.template_filter('duration')
+def format_duration(seconds):
+    """Render a number of seconds as e.g. '2 h 05 min' or '12 min'"""
+    minutes = int(round(seconds / 60))
+    if minutes < 60:
+        return f'{minutes} min'
+    return f'{minutes // 60} h {minutes % 60:02d} min'
+
+# Platform-wide totals for the super admin dashboard. They walk every stop,
+# so a background job builds them, at most once per PLATFORM_STATS_TTL
+# seconds across all workers, and the dashboard shows its latest result.
+# Per-itinerary distance summaries are kept with the stops cache version they
+# were built at, so a worker that built them before only recomputes the
+# itineraries written to since.
+PLATFORM_STATS_BATCH = 1000  # Itineraries summarised per query
+itinerary_summaries = {}  # itinerary id -> (version, distance_m, has_outliers)
+itinerary_summaries_lock = threading.Lock()
+
+def empty_platform_stats():
+    return dict.fromkeys((
+        'total_companies', 'active_companies', 'total_users', 'admin_users', 'total_itineraries',
+        'total_stops', 'companies_with_content', 'total_distance', 'itineraries_with_outliers'
+    ), 0)
+
+def compute_platform_stats(job=None):
+    """Platform totals, summarising only itineraries changed since this process last did"""
+    ids = [itinerary_id for (itinerary_id,) in db.session.query(Itinerary.id)]
+    # Read before the stops, so a write during the query leaves the summary stale
+    versions = {itinerary_id: stops_cache_versions[itinerary_id % STOPS_CACHE_SLOTS] for itinerary_id in ids}
+    with itinerary_summaries_lock:
+        stale = [itinerary_id for itinerary_id in ids
+                 if itinerary_summaries.get(itinerary_id, (None,))[0] != versions[itinerary_id]]
+    
+    for start in range(0, len(stale), PLATFORM_STATS_BATCH):
+        batch = stale[start:start + PLATFORM_STATS_BATCH]
+        summaries = get_itinerary_analytics(itinerary_ids=batch)
+        with itinerary_summaries_lock:
+            for itinerary_id in batch:
+                summary = summaries.get(itinerary_id) or analytics.empty_summary()
+                itinerary_summaries[itinerary_id] = (versions[itinerary_id], summary['distance_m'],
+                                                     bool(summary['outliers']))
+        if job:
+            job.progress(start + len(batch), len(stale), 'Summarising itineraries')
+    
+    with itinerary_summaries_lock:
+        for itinerary_id in set(itinerary_summaries) - set(versions):
+            del itinerary_summaries[itinerary_id]
+        summaries = [itinerary_summaries[itinerary_id] for itinerary_id in ids]
+    
+    total_companies, active_companies = count_active(Company)
+    return {
+        'total_companies': total_companies,
+        'active_companies': active_companies,
+        'total_users': User.query.count(),
+        'admin_users': User.query.filter_by(role='admin').count(),
+        'total_itineraries': len(ids),
+        'total_stops': Stop.query.count(),
+        'companies_with_content': db.session.query(func.count(func.distinct(Itinerary.company_id))).scalar(),
+        'total_distance': sum(distance for _, distance, _ in summaries),
+        'itineraries_with_outliers': sum(1 for _, _, outliers in summaries if outliers),
+    }
+
+@job_queue.handler('platform_stats')
+def platform_stats_job(job):
+    return compute_platform_stats(job)
+
+def get_platform_stats():
+    """The latest platform totals, or None before they were first built
+
+    Queues a rebuild when they are older than PLATFORM_STATS_TTL.
+    """
+    latest = job_queue.latest('platform_stats')
+    if latest is None or time.time() - latest['finished_at'] >= app.config['PLATFORM_STATS_TTL']:
+        job_queue.enqueue('platform_stats', {}, unique=True)
+    return latest['result'] if latest else None
+
+# Keyset pagination
+# Listings are ordered newest first by (created_at, id) and continue after
+# the last row of the previous page, carried in an opaque cursor. Each page
+# is an index range scan, however deep the reader pages.
+def encode_cursor(row):
+    key = f'{row.created_at.isoformat()}|{row.id}'
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor; raises ValueError if it is malformed"""
+    key = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, row_id = key.split('|')
+    return datetime.fromisoformat(created_at), int(row_id)
+
+def keyset_page(query, model, cursor, limit, key=lambda row: row):
+    """One page of a query newest first, and the cursor for the next page (None on the last)
+
+    key picks the model instance out of each row for queries with extra columns.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # A row-value comparison lets SQLite seek the (created_at, id) index
+        # straight to the cursor instead of filtering from the newest row
+        query = query.filter(tuple_(model.created_at, model.id) < (created_at, row_id))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(key(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def page_limit(default=20, maximum=100):
+    return min(max(request.args.get('limit', default, type=int), 1), maximum)
+
+# Day activation
+MAX_DAY_CHANGES = 500
+
+def parse_day_changes(changes):
+    """Validate a batch of {itinerary_id, day_number, is_active} changes
+
+    Returns (itinerary_id, day_number, is_active) tuples; day_number is None
+    for changes that apply to every day of the itinerary.
+    """
+    if not isinstance(changes, list) or not changes:
+        raise ValueError('changes must be a non-empty list')
+    if len(changes) > MAX_DAY_CHANGES:
+        raise ValueError(f'At most {MAX_DAY_CHANGES} changes per request')
+    
+    parsed = {}
+    for change in changes:
+        if not isinstance(change, dict) or not isinstance(change.get('is_active'), bool):
+            raise ValueError('Each change needs itinerary_id, an optional day_number and a boolean is_active')
+        try:
+            itinerary_id = int(change['itinerary_id'])
+            day_number = int(change['day_number']) if change.get('day_number') is not None else None
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Each change needs itinerary_id, an optional day_number and a boolean is_active')
+        key = (itinerary_id, day_number)
+        if parsed.get(key, change['is_active']) != change['is_active']:
+            raise ValueError(f'Conflicting changes for itinerary {itinerary_id}'
+                             + (f' day {day_number}' if day_number is not None else ''))
+        parsed[key] = change['is_active']
+    return [(itinerary_id, day_number, is_active) for (itinerary_id, day_number), is_active in parsed.items()]
+
+def set_day_activation(company_id, changes):
+    """Apply (itinerary_id, day_number, is_active) changes to a company's stops
+
+    Runs at most one UPDATE per kind of change (whole itinerary or single
+    day, activate or deactivate) in a single transaction, so changes for a
+    specific day override a whole-itinerary change in the same batch.
+    Raises LookupError when an itinerary does not belong to the company.
+    Returns the resulting state of every day of the affected itineraries.
+    """
+    itinerary_ids = {itinerary_id for itinerary_id, _, _ in changes}
+    owned = {itinerary_id for (itinerary_id,) in db.session.query(Itinerary.id).filter(
+        Itinerary.id.in_(itinerary_ids), Itinerary.company_id == company_id)}
+    if owned != itinerary_ids:
+        raise LookupError(f'Itinerary {min(itinerary_ids - owned)} not found')
+    
+    for is_active in (True, False):
+        whole = [itinerary_id for itinerary_id, day_number, active in changes
+                 if day_number is None and active == is_active]
+        if whole:
+            db.session.execute(update(Stop).where(Stop.itinerary_id.in_(whole)).values(is_day_active=is_active))
+    for is_active in (True, False):
+        days = [(itinerary_id, day_number) for itinerary_id, day_number, active in changes
+                if day_number is not None and active == is_active]
+        if days:
+            db.session.execute(update(Stop).where(
+                tuple_(Stop.itinerary_id, Stop.day_number).in_(days)).values(is_day_active=is_active))
+    
+    # New state of every day, read back inside the same transaction
+    rows = db.session.query(
+        Stop.itinerary_id, Stop.day_number, func.count(Stop.id),
+        func.sum(case((Stop.is_day_active == True, 1), else_=0))
+    ).filter(Stop.itinerary_id.in_(itinerary_ids)).group_by(Stop.itinerary_id, Stop.day_number).order_by(
+        Stop.itinerary_id, Stop.day_number
+    ).all()
+    db.session.commit()
+    for itinerary_id in itinerary_ids:
+        bump_itinerary_version(itinerary_id)
+        publish_itinerary_event(itinerary_id, 'days', {'days': [
+            {'day_number': day_number, 'is_active': active_stops == stops}
+            for row_itinerary_id, day_number, stops, active_stops in rows if row_itinerary_id == itinerary_id
+        ]})
+    
+    return [{
+        'itinerary_id': itinerary_id,
+        'day_number': day_number,
+        'stops': stops,
+        'active_stops': int(active_stops or 0),
+        'is_active': active_stops == stops
+    } for itinerary_id, day_number, stops, active_stops in rows]
+
+# Spatial queries
+def public_stop_columns():
+    """Stops of active itineraries of active companies, with their itinerary/company names"""
+    return db.session.query(
+        Stop.id, Stop.name, Stop.latitude, Stop.longitude, Stop.day_number,
+        Stop.order_in_day, Stop.is_day_active, Stop.itinerary_id,
+        Itinerary.name.label('itinerary_name'), Company.name.label('company_name')
+    ).join(
+        # Unary + keeps SQLite from driving the join through the itinerary
+        # index, so spatial filters on stop pick the geohash index instead
+        Itinerary, Stop.itinerary_id.op('+')(0) == Itinerary.id
+    ).join(Company, Itinerary.company_id == Company.id).filter(
+        Itinerary.is_active == True,
+        Company.is_active == True
+    )
+
+def filter_geohash_cells(query, cells):
+    """Restrict a stops query to geohash prefixes using the spatial index"""
+    return query.filter(
+        or_(*[and_(Stop.geohash >= low, Stop.geohash < high) for low, high in map(geo.prefix_range, cells)])
+    )
+
+def box_filter(min_lat, min_lng, max_lat, max_lng):
+    lng_filter = (Stop.longitude.between(min_lng, max_lng) if min_lng <= max_lng
+                  else or_(Stop.longitude >= min_lng, Stop.longitude <= max_lng))
+    return and_(Stop.latitude.between(min_lat, max_lat), lng_filter)
+
+def find_stops_near(lat, lng, radius_m, limit):
+    """Public stops within radius_m of a point, nearest first"""
+    connection = db.session.connection()
+    if spatial.enabled(connection):
+        rows = spatial.public_stops_in_box(connection, *geo.radius_box(lat, lng, radius_m))
+    else:
+        cells, box = geo.cover_radius(lat, lng, radius_m)
+        rows = public_stop_columns().filter(box_filter(*box))
+        if cells:
+            rows = filter_geohash_cells(rows, cells)
+    
+    results = []
+    for row in rows:
+        distance = geo.haversine_m(lat, lng, row.latitude, row.longitude)
+        if distance <= radius_m:
+            results.append((distance, row))
+    results.sort(key=lambda item: item[0])
+    return results[:limit]
+
+def find_stops_in_box(min_lat, min_lng, max_lat, max_lng, limit):
+    """Public stops inside a bounding box"""
+    connection = db.session.connection()
+    if spatial.enabled(connection):
+        return spatial.public_stops_in_box(connection, min_lat, min_lng, max_lat, max_lng, limit)
+    cells = geo.cover_box(min_lat, min_lng, max_lat, max_lng)
+    query = public_stop_columns().filter(box_filter(min_lat, min_lng, max_lat, max_lng))
+    if cells:
+        query = filter_geohash_cells(query, cells)
+    return query.limit(limit).all()
+
+def serialize_public_stop(row):
+    return {
+        'id': row.id,
+        'name': row.name,
+        'latitude': row.latitude,
+        'longitude': row.longitude,
+        'day_number': row.day_number,
+        'order_in_day': row.order_in_day,
+        'is_day_active': row.is_day_active,
+        'itinerary_id': row.itinerary_id,
+        'itinerary_name': row.itinerary_name,
+        'company_name': row.company_name
+    }
+
+# Search
+def serialize_search_result(row):
+    """JSON-ready search hit for an itinerary or one of its stops"""
+    result = {
+        'type': 'stop' if row.kind == search.STOP else 'itinerary',
+        'itinerary_id': row.itinerary_id,
+        'itinerary_name': row.itinerary_name,
+        'description': row.itinerary_description or '',
+        'company_name': row.company_name,
+        'snippet': search.highlight(row.snippet),
+    }
+    if row.kind == search.STOP:
+        result.update({
+            'stop_id': row.ref,
+            'name': row.stop_name,
+            'latitude': row.latitude,
+            'longitude': row.longitude,
+            'day_number': row.day_number,
+        })
+    return result
+
+def public_itinerary_query():
+    """(Itinerary, company name) rows of active itineraries from active companies"""
+    return db.session.query(Itinerary, Company.name).join(Company).filter(
+        Itinerary.is_active == True, Company.is_active == True
+    )
+
+def serialize_public_itinerary(itinerary, company_name):
+    return {
+        'type': 'itinerary',
+        'itinerary_id': itinerary.id,
+        'itinerary_name': itinerary.name,
+        'description': itinerary.description or '',
+        'company_name': company_name,
+        'snippet': str(escape((itinerary.description or '')[:120])),
+    }
+
 # Routes
 
 @app.route('/')
 def index():
     """Main user interface - displays the map and itinerary"""
-    # Get all active itineraries with company information
-    itineraries = db.session.query(Itinerary, Company).join(Company).filter(
-        Itinerary.is_active == True,
-        Company.is_active == True
-    ).all()
-    return render_template('index.html', itineraries=itineraries)
+    # Itineraries are listed and searched through /api/search
+    return render_template('index.html')
+
+@app.route('/api/itineraries')
+def list_itineraries():
+    """API endpoint listing active itineraries newest first (?cursor= for the next page)"""
+    try:
+        rows, next_cursor = keyset_page(public_itinerary_query(), Itinerary, request.args.get('cursor'),
+                                        page_limit(), key=lambda row: row[0])
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({
+        'results': [serialize_public_itinerary(itinerary, company_name) for itinerary, company_name in rows],
+        'next_cursor': next_cursor,
+    })
+
+@app.route('/api/search')
+def search_itineraries():
+    """API endpoint for ranked search over active itineraries and their stops (?q=&page=&per_page=)"""
+    text_query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    offset = (page - 1) * per_page
+    
+    expression = search.match_expression(text_query)
+    connection = db.session.connection()
+    if not expression:
+        results = []
+    elif search.enabled(connection):
+        rows = search.search_public(connection, expression, per_page + 1, offset)
+        results = [serialize_search_result(row) for row in rows]
+    else:
+        # No FTS5 outside SQLite; fall back to matching itinerary text
+        pattern = f'%{text_query}%'
+        rows = public_itinerary_query().filter(or_(
+            Itinerary.name.ilike(pattern), Itinerary.description.ilike(pattern), Company.name.ilike(pattern)
+        )).order_by(Itinerary.created_at.desc(), Itinerary.id.desc()).offset(offset).limit(per_page + 1)
+        results = [serialize_public_itinerary(itinerary, company_name) for itinerary, company_name in rows]
+    
+    return jsonify({
+        'results': results[:per_page],
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(results) > per_page,
+    })
 
 @app.route('/api/stops/<int:itinerary_id>')
 def get_stops(itinerary_id):
-    """API endpoint to get all stops for an itinerary"""
-    stops = Stop.query.filter_by(itinerary_id=itinerary_id).order_by(Stop.day_number, Stop.order_in_day).all()
-    stops_data = []
-    for stop in stops:
-        stops_data.append({
-            'id': stop.id,
-            'name': stop.name,
-            'description': stop.description,
-            'latitude': stop.latitude,
-            'longitude': stop.longitude,
-            'day_number': stop.day_number,
-            'is_day_active': stop.is_day_active,
-            'image_filename': stop.image_filename,
-            'order_in_day': stop.order_in_day
-        })
-    return jsonify(stops_data)
+    """API endpoint to get all stops for an itinerary
+
+    Sends the compact columnar variant to clients that ask for it in Accept
+    (see STOPS_FORMATS), gzip-compressed when they accept that.
+    """
+    mimetype = request.accept_mimetypes.best_match(list(STOPS_FORMATS.values()), STOPS_FORMATS['full'])
+    variant = next(name for name, value in STOPS_FORMATS.items() if value == mimetype)
+    encoding = 'gzip' if request.accept_encodings['gzip'] else None
+    etag, body = get_cached_stops_payload(itinerary_id, variant, encoding)
+    
+    response = app.response_class(body, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    response.set_etag(etag)
+    # Clients may keep a copy but must revalidate so day activation shows up
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/stop/<int:stop_id>')
+def get_stop(stop_id):
+    """API endpoint to get one stop with its description and images"""
+    stop = Stop.query.get_or_404(stop_id)
+    body = app.json.dumps(serialize_stop(stop)).encode('utf-8')
+    
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/live/itinerary/<int:itinerary_id>')
+def live_itinerary(itinerary_id):
+    """Server-Sent Events stream of stop and day changes for an itinerary
+
+    Events: 'days' with the new activation state of each day, 'stop' with a
+    saved stop or a deleted stop id, and 'reset' when the client should
+    refetch /api/stops (bulk changes, or events it missed).
+    """
+    Itinerary.query.get_or_404(itinerary_id)
+    if live_broker.connection_count() >= app.config['LIVE_MAX_CONNECTIONS']:
+        response = jsonify({'error': 'Too many live connections'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+    
+    subscription = live_broker.subscribe(f'itinerary:{itinerary_id}', request.headers.get('Last-Event-ID'))
+    detach = request.environ.get(server.DETACH)
+    if detach is not None:
+        # Under `flask serve` the fan-out thread takes the connection over, so
+        # an open stream holds no request thread; this response is discarded
+        live_fanout.add(detach(), subscription)
+        return '', 200
+    
+    # Other servers stream from the request thread. The stream holds no app
+    # context, so the request's database connection goes back to the pool
+    # before streaming starts
+    response = app.response_class(
+        live.stream(subscription, app.config['LIVE_HEARTBEAT'], app.config['LIVE_STREAM_LIFETIME']),
+        mimetype='text/event-stream'
+    )
+    # Also covers clients that disconnect before the first chunk is sent
+    response.call_on_close(subscription.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: don't buffer the stream
+    return response
+
+@app.route('/api/bundle/<int:itinerary_id>')
+def get_bundle_manifest(itinerary_id):
+    """Manifest of an itinerary's offline bundle
+
+    Lists every file with its SHA-256 and a URL to fetch it on its own, so a
+    client with an older bundle downloads only the files that changed.
+    Answers 202 while the bundle is being built.
+    """
+    manifest = get_itinerary_bundle(itinerary_id)
+    if manifest is None:
+        return bundle_building()
+    manifest = bundles.BundleStore.public_manifest(manifest)
+    manifest['archive_url'] = url_for('get_bundle_archive', itinerary_id=itinerary_id)
+    for entry in manifest['files']:
+        entry['url'] = url_for('get_bundle_part', name=entry['part'])
+    
+    response = jsonify(manifest)
+    response.set_etag(manifest['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/bundle/<int:itinerary_id>.zip')
+def get_bundle_archive(itinerary_id):
+    """The whole offline bundle as one zip archive, or 202 while it is being built"""
+    manifest = get_itinerary_bundle(itinerary_id)
+    if manifest is None:
+        return bundle_building()
+    response = send_file(bundle_store.archive_path(itinerary_id), mimetype='application/zip', as_attachment=True,
+                         download_name=f'itinerary-{itinerary_id}.zip', etag=manifest['version'], conditional=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/bundle/parts/<name>')
+def get_bundle_part(name):
+    """One bundle file by content hash; never changes, so clients may cache it forever"""
+    path = bundle_store.part_path(name)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'Unknown bundle part'}), 404
+    response = send_file(path, mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                         conditional=True)
+    response.headers['Cache-Control'] = assets.IMMUTABLE
+    return response
+
+def local_request():
+    """Whether the client is on this host
+
+    A forwarded request is only local if the trusted proxies resolved it so;
+    otherwise a proxy on this host would make every client look local.
+    """
+    try:
+        loopback = ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+    return loopback and (app.config['TRUSTED_PROXIES'] > 0 or 'X-Forwarded-For' not in request.headers)
+
+@app.route('/metrics')
+def get_metrics():
+    """Request latency and SQL metrics for this process in the Prometheus text format
+
+    Without METRICS_TOKEN only local scrapers are served.
+    """
+    token = app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                         f'Bearer {token}'.encode('utf-8')):
+        return jsonify({'error': 'A valid metrics token is required'}), 401
+    if not token and not local_request():
+        return jsonify({'error': 'Set METRICS_TOKEN to read metrics from another host'}), 403
+    return app.response_class(app_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>')
+def get_tile(layer, z, x, y):
+    """Map tile from an MBTiles file, the local cache or the upstream tile server"""
+    if not tiles.valid_tile(layer, z, x, y):
+        return jsonify({'error': 'Unknown tile'}), 404
+    try:
+        data, etag, max_age = tile_service.get(layer, z, x, y)
+    except tiles.TileError as e:
+        return jsonify({'error': str(e)}), 404 if app.config['TILE_OFFLINE'] else 502
+    
+    response = app.response_class(data, mimetype=tiles.content_type(data))
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response.make_conditional(request)
+
+@app.route('/api/stops/near')
+def get_stops_near():
+    """API endpoint to find public stops around a point (?lat=&lng=&radius=metres)"""
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius = request.args.get('radius', 1000, type=float)
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    
+    if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return jsonify({'error': 'lat and lng are required and must be valid coordinates'}), 400
+    if not 0 < radius <= 100000:
+        return jsonify({'error': 'radius must be between 0 and 100000 metres'}), 400
+    
+    results = []
+    for distance, row in find_stops_near(lat, lng, radius, max(limit, 1)):
+        stop_data = serialize_public_stop(row)
+        stop_data['distance'] = round(distance, 1)
+        results.append(stop_data)
+    return jsonify(results)
+
+@app.route('/api/stops/bbox')
+def get_stops_in_box():
+    """API endpoint to list public stops in a bounding box (?bbox=min_lng,min_lat,max_lng,max_lat)"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = [float(v) for v in request.args.get('bbox', '').split(',')]
+    except ValueError:
+        return jsonify({'error': 'bbox must be min_lng,min_lat,max_lng,max_lat'}), 400
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= 180 and -180 <= max_lng <= 180):
+        return jsonify({'error': 'bbox is out of range'}), 400
+    limit = min(request.args.get('limit', 500, type=int), 2000)
+    
+    rows = find_stops_in_box(min_lat, min_lng, max_lat, max_lng, max(limit, 1))
+    return jsonify([serialize_public_stop(row) for row in rows])
+
+@app.route('/api/route/<int:itinerary_id>')
+def get_route(itinerary_id):
+    """API endpoint to get the route geometry for an itinerary
+
+    Returns GeoJSON by default. With ?zoom=<level> the segments come back as
+    encoded polylines simplified for that zoom level's tier.
+    """
+    profile = request.args.get('profile', 'driving')
+    if profile not in routing.PROFILES:
+        return jsonify({'error': f'Unknown profile: {profile}'}), 400
+    zoom = request.args.get('zoom', type=int)
+    
+    points = db.session.query(Stop.latitude, Stop.longitude).filter_by(
+        itinerary_id=itinerary_id
+    ).order_by(Stop.day_number, Stop.order_in_day).all()
+    points = [tuple(p) for p in points]
+    
+    if zoom is not None:
+        return jsonify(route_service.build_encoded_route(profile, points, routing.tier_for_zoom(zoom)))
+    return jsonify(route_service.build_route(profile, points))
+
+@app.route('/api/analytics')
+@login_required()
+def get_analytics():
+    """API endpoint with per-day analytics for the current company's itineraries
+
+    Super admins get every itinerary on the platform, or one company's with ?company_id=
+    """
+    user = get_current_user()
+    if user.role == 'super_admin':
+        summaries = get_itinerary_analytics(company_id=request.args.get('company_id', type=int))
+    else:
+        company = get_current_company()
+        if not company:
+            return jsonify({'error': 'No company associated with your account'}), 403
+        summaries = get_itinerary_analytics(company_id=company.id)
+    return jsonify(summaries)
+
+@app.route('/api/analytics/<int:itinerary_id>')
+@login_required()
+def get_itinerary_analytics_api(itinerary_id):
+    """API endpoint with per-day analytics for one itinerary"""
+    query = Itinerary.query.filter_by(id=itinerary_id)
+    if get_current_user().role != 'super_admin':
+        company = get_current_company()
+        query = query.filter_by(company_id=company.id if company else None)
+    itinerary = query.first_or_404()
+    return jsonify(get_itinerary_analytics(itinerary_id=itinerary.id).get(itinerary.id, analytics.empty_summary()))
 
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -152,9 +1411,22 @@ def login():
         email = request.form['email']
         password = request.form['password']
         
+        # Turn bursts away before doing any hashing work
+        wait = throttle_auth(email)
+        if wait:
+            return too_many_attempts('auth/login.html', wait)
+        
         user = User.query.filter_by(email=email, is_active=True).first()
         
-        if user and check_password_hash(user.password_hash, password):
+        try:
+            valid = user is not None and password_hasher.verify(user.password_hash, password)
+            if valid and password_hasher.needs_rehash(user.password_hash):
+                user.password_hash = password_hasher.hash(password)
+        except passwords.HasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'error')
+            return render_template('auth/login.html'), 503, {'Retry-After': '5'}
+        
+        if valid:
             session['user_id'] = user.id
             session['user_role'] = user.role
             session['company_id'] = user.company_id
@@ -191,6 +1463,10 @@ def register():
         user_email = request.form['user_email']
         password = request.form['password']
         
+        wait = throttle_auth()
+        if wait:
+            return too_many_attempts('auth/register.html', wait)
+        
         # Check if company email already exists
         if Company.query.filter_by(email=company_email).first():
             flash('A company with this email already exists.', 'error')
@@ -220,7 +1496,7 @@ def register():
             user = User(
                 username=user_email,
                 email=user_email,
-                password_hash=generate_password_hash(password),
+                password_hash=password_hasher.hash(password),
                 first_name=first_name,
                 last_name=last_name,
                 role='admin',
@@ -250,23 +1526,109 @@ def logout():
 @login_required('super_admin')
 def super_admin_dashboard():
     """Super admin dashboard"""
-    companies = Company.query.order_by(Company.created_at.desc()).all()
-    users = User.query.order_by(User.created_at.desc()).all()
-    total_itineraries = Itinerary.query.count()
-    total_stops = Stop.query.count()
-    
+    recent_companies = Company.query.order_by(Company.created_at.desc(), Company.id.desc()).limit(5).all()
+    stats = get_platform_stats()
     return render_template('super_admin/dashboard.html', 
-                         companies=companies, 
-                         users=users,
-                         total_itineraries=total_itineraries,
-                         total_stops=total_stops)
+                         recent_companies=recent_companies,
+                         stats=stats or empty_platform_stats(),
+                         stats_pending=stats is None)
 
 @app.route('/super-admin/companies')
 @login_required('super_admin')
 def manage_companies():
     """Manage all companies"""
-    companies = Company.query.order_by(Company.created_at.desc()).all()
-    return render_template('super_admin/companies.html', companies=companies)
+    text_query = request.args.get('q', '').strip()
+    status = request.args.get('status', '')
+    plan = request.args.get('plan', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    cursor = request.args.get('cursor')
+    page_size = app.config['PAGE_SIZE']
+    
+    query = filter_companies(Company.query, status, plan)
+    has_more = False
+    next_cursor = None
+    expression = search.match_expression(text_query)
+    if expression and search.enabled(db.session.connection()):
+        # Ranked matches, a page at a time, filtered before paging
+        ids = search.search_companies(db.session.connection(), expression, page_size + 1, (page - 1) * page_size,
+                                      is_active=(status == 'active') if status in ('active', 'inactive') else None,
+                                      plan=plan)
+        has_more = len(ids) > page_size
+        ids = ids[:page_size]
+        by_id = {company.id: company for company in Company.query.filter(Company.id.in_(ids))}
+        companies = [by_id[company_id] for company_id in ids if company_id in by_id]
+    else:
+        if text_query:
+            pattern = f'%{text_query}%'
+            query = query.filter(or_(Company.name.ilike(pattern), Company.email.ilike(pattern)))
+        try:
+            companies, next_cursor = keyset_page(query, Company, cursor, page_size)
+        except ValueError:
+            flash('That page link is no longer valid; showing the first page.', 'warning')
+            cursor = None
+            companies, next_cursor = keyset_page(query, Company, None, page_size)
+    
+    total_companies, active_companies = count_active(Company)
+    return render_template('super_admin/companies.html', companies=companies,
+                           company_stats=get_company_stats([company.id for company in companies]),
+                           total_companies=total_companies, active_companies=active_companies,
+                           q=text_query, status=status, plan=plan, page=page, has_more=has_more,
+                           cursor=cursor, next_cursor=next_cursor)
+
+def filter_companies(query, status, plan):
+    """Apply the status and plan filters of the company listings"""
+    if status in ('active', 'inactive'):
+        query = query.filter(Company.is_active == (status == 'active'))
+    if plan:
+        query = query.filter(Company.subscription_plan == plan)
+    return query
+
+@app.route('/api/super-admin/companies')
+@login_required('super_admin')
+def list_companies():
+    """API endpoint listing companies newest first (?status=&plan=&cursor=&limit=)"""
+    query = filter_companies(Company.query, request.args.get('status', ''), request.args.get('plan', ''))
+    try:
+        companies, next_cursor = keyset_page(query, Company, request.args.get('cursor'), page_limit())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({
+        'results': [{
+            'id': company.id,
+            'name': company.name,
+            'email': company.email,
+            'city': company.city,
+            'subscription_plan': company.subscription_plan,
+            'is_active': company.is_active,
+            'created_at': company.created_at.isoformat(),
+        } for company in companies],
+        'next_cursor': next_cursor,
+    })
+
+@app.route('/api/super-admin/users')
+@login_required('super_admin')
+def list_users():
+    """API endpoint listing users newest first (?role=&cursor=&limit=)"""
+    query = User.query
+    if request.args.get('role'):
+        query = query.filter(User.role == request.args['role'])
+    try:
+        users, next_cursor = keyset_page(query, User, request.args.get('cursor'), page_limit())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    return jsonify({
+        'results': [{
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'role': user.role,
+            'company_id': user.company_id,
+            'is_active': user.is_active,
+            'last_login': user.last_login.isoformat() if user.last_login else None,
+            'created_at': user.created_at.isoformat(),
+        } for user in users],
+        'next_cursor': next_cursor,
+    })
 
 @app.route('/super-admin/company/<int:company_id>/toggle', methods=['POST'])
 @login_required('super_admin')
@@ -275,6 +1637,7 @@ def toggle_company_status(company_id):
     company = Company.query.get_or_404(company_id)
     company.is_active = not company.is_active
     db.session.commit()
+    invalidate_identity(company_id=company.id)
     
     status = "activated" if company.is_active else "deactivated"
     flash(f'Company {company.name} has been {status}.', 'success')
@@ -292,13 +1655,57 @@ def admin_dashboard():
         flash('No company associated with your account.', 'error')
         return redirect(url_for('logout'))
     
-    # Get company-specific data
-    itineraries = Itinerary.query.filter_by(company_id=company.id).all()
+    # Get company-specific data, a page of itineraries at a time
+    cursor = request.args.get('cursor')
+    query = Itinerary.query.filter_by(company_id=company.id)
+    try:
+        itineraries, next_cursor = keyset_page(query, Itinerary, cursor, app.config['PAGE_SIZE'])
+    except ValueError:
+        cursor = None
+        itineraries, next_cursor = keyset_page(query, Itinerary, None, app.config['PAGE_SIZE'])
+    itinerary_stats = get_itinerary_stats(company.id)
+    total_itineraries, active_itineraries = count_active(Itinerary, Itinerary.company_id == company.id)
     return render_template('admin/dashboard.html', 
                          itineraries=itineraries, 
+                         itinerary_stats=itinerary_stats,
+                         total_itineraries=total_itineraries,
+                         active_itineraries=active_itineraries,
+                         total_stops=sum(stats['stops'] for stats in itinerary_stats.values()),
+                         max_days=max((stats['max_day'] for stats in itinerary_stats.values()), default=0),
+                         itinerary_analytics=get_itinerary_analytics(
+                             itinerary_ids=[itinerary.id for itinerary in itineraries]),
+                         cursor=cursor,
+                         next_cursor=next_cursor,
                          company=company, 
                          user=user)
 
+@app.route('/api/admin/itineraries')
+@login_required()
+def list_company_itineraries():
+    """API endpoint listing the current company's itineraries newest first (?cursor=&limit=)"""
+    company = get_current_company()
+    if not company:
+        return jsonify({'error': 'No company associated with your account'}), 403
+    
+    try:
+        itineraries, next_cursor = keyset_page(Itinerary.query.filter_by(company_id=company.id), Itinerary,
+                                               request.args.get('cursor'), page_limit())
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    stats = get_itinerary_stats(company.id, [itinerary.id for itinerary in itineraries])
+    return jsonify({
+        'results': [{
+            'id': itinerary.id,
+            'name': itinerary.name,
+            'description': itinerary.description or '',
+            'is_active': itinerary.is_active,
+            'created_at': itinerary.created_at.isoformat(),
+            'stops': stats.get(itinerary.id, {}).get('stops', 0),
+            'days': stats.get(itinerary.id, {}).get('max_day') or 0,
+        } for itinerary in itineraries],
+        'next_cursor': next_cursor,
+    })
+
 @app.route('/admin/itinerary/new', methods=['GET', 'POST'])
 @login_required()
 def new_itinerary():
@@ -339,7 +1746,12 @@ def manage_itinerary(itinerary_id):
             stops_by_day[stop.day_number] = []
         stops_by_day[stop.day_number].append(stop)
     
-    return render_template('admin/manage_itinerary.html', itinerary=itinerary, stops_by_day=stops_by_day, company=company)
+    summary = get_itinerary_analytics(itinerary_id=itinerary.id).get(itinerary.id, analytics.empty_summary())
+    day_analytics = {day['day']: day for day in summary['days']}
+    outlier_ids = {stop_id for day in summary['days'] for stop_id in day['outliers']}
+    
+    return render_template('admin/manage_itinerary.html', itinerary=itinerary, stops_by_day=stops_by_day,
+                           summary=summary, day_analytics=day_analytics, outlier_ids=outlier_ids, company=company)
 
 @app.route('/admin/stop/new/<int:itinerary_id>', methods=['GET', 'POST'])
 @login_required()
@@ -358,11 +1770,11 @@ def new_stop(itinerary_id):
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename:
-                filename = secure_filename(file.filename)
-                # Add timestamp to avoid conflicts
-                filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                image_filename = filename
+                try:
+                    image_filename = save_stop_image(file, itinerary_id)
+                except images.ImageUploadError as e:
+                    flash(str(e), 'error')
+                    return render_template('admin/new_stop.html', itinerary=itinerary)
         
         stop = Stop(
             name=request.form['name'],
@@ -376,23 +1788,269 @@ def new_stop(itinerary_id):
         )
         db.session.add(stop)
         db.session.commit()
+        bump_itinerary_version(itinerary_id)
+        publish_itinerary_event(itinerary_id, 'stop', {'action': 'saved', 'stop': serialize_stop(stop)})
         flash('Stop added successfully!', 'success')
         return redirect(url_for('manage_itinerary', itinerary_id=itinerary_id))
     
     return render_template('admin/new_stop.html', itinerary=itinerary)
 
+@app.route('/admin/itinerary/<int:itinerary_id>/import', methods=['POST'])
+@login_required()
+def import_stops(itinerary_id):
+    """Bulk-import stops from a CSV, GeoJSON or GPX upload in a background job"""
+    company = get_current_company()
+    if not company:
+        return jsonify({'success': False, 'message': 'No company associated with your account.'}), 403
+    
+    Itinerary.query.filter_by(id=itinerary_id, company_id=company.id).first_or_404()
+    
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({'success': False, 'message': 'Please choose a file to import.'}), 400
+    try:
+        fmt = stop_io.detect_format(file.filename, request.form.get('format'))
+    except stop_io.StopFileError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    # The job reads the file from disk, so the request only has to store it
+    os.makedirs(app.config['IMPORT_FOLDER'], exist_ok=True)
+    path = os.path.join(app.config['IMPORT_FOLDER'], f'{secrets.token_hex(16)}.{fmt}')
+    file.save(path)
+    job_id = job_queue.enqueue('import_stops', {'itinerary_id': itinerary_id, 'path': path, 'format': fmt},
+                               owner=company.id)
+    return jsonify({
+        'success': True,
+        'message': 'Import started',
+        'job_id': job_id,
+        'status_url': url_for('get_job', job_id=job_id)
+    }), 202
+
+def delete_imported_stops(itinerary_id, job_id):
+    """Delete the stops an import job committed, one batch per transaction; returns how many"""
+    deleted = 0
+    while True:
+        stop_ids = [stop_id for (stop_id,) in db.session.query(Stop.id).filter(
+            Stop.itinerary_id == itinerary_id, Stop.import_job == job_id).limit(app.config['IMPORT_BATCH_SIZE'])]
+        if not stop_ids:
+            return deleted
+        db.session.execute(delete(Stop).where(Stop.id.in_(stop_ids)))
+        db.session.commit()
+        deleted += len(stop_ids)
+
+@job_queue.handler('import_stops')
+def import_stops_job(job):
+    itinerary_id = job.payload['itinerary_id']
+    path = job.payload['path']
+    if db.session.get(Itinerary, itinerary_id) is None:
+        os.remove(path)
+        raise jobs.JobError('The itinerary no longer exists')
+    
+    # Stops committed by an earlier attempt that was interrupted
+    if delete_imported_stops(itinerary_id, job.id):
+        bump_itinerary_version(itinerary_id)
+    
+    batch_size = app.config['IMPORT_BATCH_SIZE']
+    imported = 0
+    failed = 0
+    errors = []
+    batch = []
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # Rows are validated as they stream in and committed a batch at a
+            # time, so other writers only ever wait for one batch; the rows
+            # carry the job id, so a failed import can be taken back out
+            for row_number, values, error in stop_io.iter_import(f, job.payload['format']):
+                if error:
+                    failed += 1
+                    if len(errors) < app.config['IMPORT_MAX_REPORTED_ERRORS']:
+                        errors.append({'row': row_number, 'error': error})
+                    continue
+                
+                values['itinerary_id'] = itinerary_id
+                values['import_job'] = job.id
+                batch.append(values)
+                if len(batch) >= batch_size:
+                    db.session.execute(insert(Stop), batch)
+                    db.session.commit()
+                    imported += len(batch)
+                    batch = []
+                    job.progress(f.tell(), size, f'{imported} stops imported')
+        
+        if batch:
+            db.session.execute(insert(Stop), batch)
+            db.session.commit()
+            imported += len(batch)
+    except jobs.LeaseLost:
+        # The file and the committed rows now belong to the attempt that took over
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        last_attempt = isinstance(e, stop_io.StopFileError) or job.attempt >= job.max_attempts
+        if last_attempt:
+            os.remove(path)
+        try:
+            delete_imported_stops(itinerary_id, job.id)
+        except Exception:
+            # A retry deletes them before it starts
+            db.session.rollback()
+            app.logger.exception('Could not delete the stops of failed import job %s', job.id)
+        if imported:
+            bump_itinerary_version(itinerary_id)
+            publish_itinerary_event(itinerary_id, 'reset', {})
+        if isinstance(e, stop_io.StopFileError):
+            raise jobs.JobError(str(e))
+        raise
+    os.remove(path)
+    
+    bump_itinerary_version(itinerary_id)
+    if imported:
+        publish_itinerary_event(itinerary_id, 'reset', {})
+    return {
+        'message': f'Imported {imported} stops' + (f', {failed} rows skipped' if failed else ''),
+        'imported': imported,
+        'failed': failed,
+        'errors': errors
+    }
+
+@app.route('/api/admin/jobs/<job_id>')
+@login_required()
+def get_job(job_id):
+    """Status and progress of a background job started by the user's company"""
+    job = job_queue.get(job_id)
+    user = get_current_user()
+    if job is None or (user.role != 'super_admin' and job['owner'] != str(user.company_id)):
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({
+        'id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'progress': job['progress'],
+        'total': job['total'],
+        'message': job['message'],
+        'result': job['result'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at']
+    })
+
+@app.route('/admin/itinerary/<int:itinerary_id>/export')
+@login_required()
+def export_stops(itinerary_id):
+    """Download an itinerary's stops as CSV, GeoJSON or GPX"""
+    company = get_current_company()
+    if not company:
+        flash('No company associated with your account.', 'error')
+        return redirect(url_for('logout'))
+    
+    itinerary = Itinerary.query.filter_by(id=itinerary_id, company_id=company.id).first_or_404()
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in stop_io.FORMATS:
+        flash(f'Unsupported export format: {fmt}', 'error')
+        return redirect(url_for('manage_itinerary', itinerary_id=itinerary_id))
+    
+    stops = Stop.query.filter_by(itinerary_id=itinerary.id).order_by(
+        Stop.day_number, Stop.order_in_day
+    ).yield_per(app.config['IMPORT_BATCH_SIZE'])
+    
+    response = app.response_class(stream_with_context(stop_io.WRITERS[fmt](stops)),
+                                  mimetype=stop_io.MIMETYPES[fmt])
+    filename = secure_filename(itinerary.name) or f'itinerary-{itinerary.id}'
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
+
 @app.route('/admin/toggle_day/<int:itinerary_id>/<int:day_number>', methods=['POST'])
+@login_required()
 def toggle_day_activation(itinerary_id, day_number):
     """Toggle activation status for all stops in a specific day"""
-    data = request.get_json()
-    is_active = data.get('is_active', False)
+    company = get_current_company()
+    if not company:
+        return jsonify({'success': False, 'message': 'No company associated with your account'}), 403
     
-    stops = Stop.query.filter_by(itinerary_id=itinerary_id, day_number=day_number).all()
-    for stop in stops:
-        stop.is_day_active = is_active
+    data = request.get_json(silent=True) or {}
+    is_active = bool(data.get('is_active', False))
+    try:
+        set_day_activation(company.id, [(itinerary_id, day_number, is_active)])
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    return jsonify({'success': True, 'message': f'Day {day_number} {"activated" if is_active else "deactivated"}'})
+
+@app.route('/api/admin/days/activation', methods=['POST'])
+@login_required()
+def batch_day_activation():
+    """Activate or deactivate many days, or whole itineraries, in one transaction"""
+    company = get_current_company()
+    if not company:
+        return jsonify({'success': False, 'message': 'No company associated with your account'}), 403
     
+    try:
+        changes = parse_day_changes((request.get_json(silent=True) or {}).get('changes'))
+        days = set_day_activation(company.id, changes)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'success': False, 'message': str(e)}), 404
+    return jsonify({'success': True, 'message': f'{len(changes)} change(s) applied', 'days': days})
+
+@app.route('/admin/itinerary/<int:itinerary_id>/day/<int:day_number>/optimize', methods=['POST'])
+@login_required()
+def optimize_day(itinerary_id, day_number):
+    """Propose the shortest visiting order for the stops of a day"""
+    company = get_current_company()
+    if not company:
+        return jsonify({'success': False, 'message': 'No company associated with your account'}), 403
+    
+    itinerary = Itinerary.query.filter_by(id=itinerary_id, company_id=company.id).first_or_404()
+    stops = Stop.query.filter_by(itinerary_id=itinerary.id, day_number=day_number).order_by(Stop.order_in_day).all()
+    if not stops:
+        return jsonify({'success': False, 'message': f'Day {day_number} has no stops'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    latitudes = [stop.latitude for stop in stops]
+    longitudes = [stop.longitude for stop in stops]
+    order, method = day_planner.optimize_order(
+        latitudes, longitudes, fix_start=bool(data.get('fix_start', True)), fix_end=bool(data.get('fix_end', False))
+    )
+    matrix = day_planner.distance_matrix(latitudes, longitudes)
+    return jsonify({
+        'success': True,
+        'method': method,
+        'current_distance': round(day_planner.path_length(matrix, range(len(stops))), 1),
+        'optimized_distance': round(day_planner.path_length(matrix, order), 1),
+        'order': [{'id': stops[i].id, 'name': stops[i].name} for i in order]
+    })
+
+@app.route('/admin/itinerary/<int:itinerary_id>/day/<int:day_number>/reorder', methods=['POST'])
+@login_required()
+def reorder_day(itinerary_id, day_number):
+    """Apply a visiting order (a list of stop ids) to the stops of a day"""
+    company = get_current_company()
+    if not company:
+        return jsonify({'success': False, 'message': 'No company associated with your account'}), 403
+    
+    itinerary = Itinerary.query.filter_by(id=itinerary_id, company_id=company.id).first_or_404()
+    stop_ids = [stop_id for (stop_id,) in db.session.query(Stop.id).filter_by(
+        itinerary_id=itinerary.id, day_number=day_number)]
+    data = request.get_json(silent=True)
+    order = data.get('order') if isinstance(data, dict) else None
+    if not isinstance(order, list) or not all(isinstance(stop_id, int) and not isinstance(stop_id, bool)
+                                              for stop_id in order):
+        return jsonify({'success': False, 'message': 'order must be a list of stop ids'}), 400
+    if len(order) != len(stop_ids) or set(order) != set(stop_ids):
+        return jsonify({'success': False, 'message': 'The order must list every stop of the day exactly once'}), 400
+    
+    # One executemany UPDATE by primary key
+    db.session.execute(update(Stop), [
+        {'id': stop_id, 'order_in_day': position} for position, stop_id in enumerate(order, start=1)
+    ])
     db.session.commit()
-    return jsonify({'success': True, 'message': f'Day {day_number} {"activated" if is_active else "deactivated"}'})
+    bump_itinerary_version(itinerary.id)
+    publish_itinerary_event(itinerary.id, 'reset', {})
+    return jsonify({'success': True, 'message': f'Day {day_number} reordered'})
 
 @app.route('/admin/stop/edit/<int:stop_id>', methods=['GET', 'POST'])
 def edit_stop(stop_id):
@@ -408,21 +2066,25 @@ def edit_stop(stop_id):
         stop.order_in_day = int(request.form.get('order_in_day', 1))
         
         # Handle new image upload
+        old_image = None
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename:
-                # Delete old image if exists
-                if stop.image_filename:
-                    old_path = os.path.join(app.config['UPLOAD_FOLDER'], stop.image_filename)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                
-                filename = secure_filename(file.filename)
-                filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+                try:
+                    filename = save_stop_image(file, stop.itinerary_id)
+                except images.ImageUploadError as e:
+                    db.session.rollback()
+                    flash(str(e), 'error')
+                    return render_template('admin/edit_stop.html', stop=stop)
+                if filename != stop.image_filename:
+                    old_image = stop.image_filename
                 stop.image_filename = filename
         
         db.session.commit()
+        # Delete the replaced image if no other stop shares it
+        release_stop_image(old_image, stop.id)
+        bump_itinerary_version(stop.itinerary_id)
+        publish_itinerary_event(stop.itinerary_id, 'stop', {'action': 'saved', 'stop': serialize_stop(stop)})
         flash('Stop updated successfully!', 'success')
         return redirect(url_for('manage_itinerary', itinerary_id=stop.itinerary_id))
     
@@ -434,17 +2096,75 @@ def delete_stop(stop_id):
     stop = Stop.query.get_or_404(stop_id)
     itinerary_id = stop.itinerary_id
     
-    # Delete associated image file
-    if stop.image_filename:
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], stop.image_filename)
-        if os.path.exists(image_path):
-            os.remove(image_path)
+    image_filename = stop.image_filename
     
     db.session.delete(stop)
     db.session.commit()
+    
+    # Delete associated image file if no other stop shares it
+    release_stop_image(image_filename, stop_id)
+    bump_itinerary_version(itinerary_id)
+    publish_itinerary_event(itinerary_id, 'stop', {'action': 'deleted', 'id': stop_id})
     flash('Stop deleted successfully!', 'success')
     return redirect(url_for('manage_itinerary', itinerary_id=itinerary_id))
 
+# Production server (see server.py)
+def warm_caches(itinerary_limit):
+    """Fill per-process caches before workers fork; returns the itineraries warmed"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    # Uploads are content-addressed and never fingerprinted
+    uploads = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    for folder, dirs, files in os.walk(app.static_folder):
+        dirs[:] = [name for name in dirs if os.path.join(folder, name) != uploads]
+        for name in files:
+            static_assets.digest(os.path.relpath(os.path.join(folder, name), app.static_folder).replace(os.sep, '/'))
+    
+    itinerary_ids = [row.id for row in db.session.query(Itinerary.id).join(Company).filter(
+        Itinerary.is_active == True, Company.is_active == True
+    ).order_by(Itinerary.created_at.desc()).limit(itinerary_limit)]
+    for itinerary_id in itinerary_ids:
+        get_cached_stops_payload(itinerary_id)
+    db.session.remove()
+    return len(itinerary_ids)
+
+def after_fork():
+    """Per-worker setup in a freshly forked worker process"""
+    with app.app_context():
+        # Pooled connections were opened by the master; each worker opens its own
+        db.engine.dispose(close=False)
+    live_broker.reset()
+    # Pick up jobs queued before a restart
+    job_queue.start()
+
+@app.cli.command('serve')
+@click.option('--host', default='127.0.0.1', envvar='HOST', show_default=True)
+@click.option('--port', default=8000, envvar='PORT', show_default=True)
+@click.option('--workers', default=os.cpu_count() or 1, envvar='WEB_CONCURRENCY', show_default=True,
+              help='Worker processes (WEB_CONCURRENCY)')
+@click.option('--graceful-timeout', default=30.0, show_default=True,
+              help='Seconds workers get to finish requests when stopping')
+@click.option('--warm-itineraries', default=500, show_default=True,
+              help='Newest public itineraries whose stops are cached before forking')
+def serve_command(host, port, workers, graceful_timeout, warm_itineraries):
+    """Run the app under the multi-worker production server"""
+    if app.config['SECRET_KEY'] == DEV_SECRET_KEY:
+        raise click.ClickException('Set SECRET_KEY in the environment to a long random value')
+    if workers > 1:
+        if live_broker.name == live.LocalBroker.name:
+            raise click.ClickException('LIVE_BROKER=local only reaches maps connected to the worker that made '
+                                       'a change; use LIVE_BROKER=sqlite or --workers 1')
+        if db.engine.dialect.name == 'sqlite' and app.config['DATABASE_PROFILE'] != 'production':
+            print("⚠️  Set DATABASE_PROFILE=production so SQLite readers and writers in different workers don't block each other")
+    
+    def preload():
+        started = time.perf_counter()
+        count = warm_caches(warm_itineraries)
+        print(f"✅ Warmed caches for {count} itineraries in {time.perf_counter() - started:.1f}s")
+    
+    server.serve(app, host, port, max(workers, 1), graceful_timeout,
+                 preload=preload, post_fork=after_fork, on_shutdown=live_broker.close_all)
+
 if __name__ == '__main__':
     with app.app_context():
         # Check if database exists and has data
@@ -0,0 +1,135 @@
+"""
+Static asset serving with content fingerprints
+url_for('static', ...) URLs carry a short content hash (?v=...). Requests
+whose hash matches the file on disk are served as immutable for a year,
+precompressed .br/.gz siblings are used when the client accepts them, and
+Range requests are answered for large files such as images.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Only gzip siblings are written without it
+    brotli = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Content-addressed uploads (see images.py) never change under the same name
+CONTENT_ADDRESSED = re.compile(r'^uploads/[0-9a-f]{64}(_[a-z]+)?\.[a-z0-9]+$')
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.geojson', '.txt', '.html', '.map'}
+
+# Precompressed sibling suffixes in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+class StaticAssets:
+    """Fingerprints and serves files from a static folder"""
+
+    def __init__(self, static_folder, digest_length=12):
+        self.static_folder = static_folder
+        self.digest_length = digest_length
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def digest(self, filename):
+        """Short content hash of a static file, or None if it doesn't exist"""
+        path = safe_join(self.static_folder, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()[:self.digest_length]
+        with self._lock:
+            self._digests[path] = (key, digest)
+        return digest
+
+    def add_fingerprint(self, endpoint, values):
+        """url_defaults hook that adds ?v=<digest> to static URLs"""
+        if endpoint != 'static' or 'filename' not in values or 'v' in values:
+            return
+        digest = self.digest(values['filename'])
+        if digest:
+            values['v'] = digest
+
+    def serve(self, filename):
+        """View function replacing Flask's default static endpoint"""
+        path = safe_join(self.static_folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        has_siblings = False
+        source_mtime = os.stat(path).st_mtime
+        for name, suffix in ENCODINGS:
+            # Ignore siblings left over from an older version of the file
+            if os.path.isfile(path + suffix) and os.stat(path + suffix).st_mtime >= source_mtime:
+                has_siblings = True
+                if encoding is None and request.accept_encodings[name]:
+                    encoding = name, path + suffix
+
+        if encoding:
+            response = send_file(encoding[1], mimetype=mimetype, conditional=True)
+            response.headers['Content-Encoding'] = encoding[0]
+        else:
+            response = send_file(path, mimetype=mimetype, conditional=True)
+        if has_siblings:
+            response.vary.add('Accept-Encoding')
+
+        version = request.args.get('v')
+        if (version and version == self.digest(filename)) or CONTENT_ADDRESSED.match(filename):
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.headers['Cache-Control'] = REVALIDATE
+        return response
+
+    def precompress(self, minimum_size=256):
+        """Write .gz (and .br when available) siblings for text assets
+
+        Returns the number of files written. Uploads are skipped.
+        """
+        written = 0
+        for root, dirs, files in os.walk(self.static_folder):
+            if os.path.relpath(root, self.static_folder).split(os.sep)[0] == 'uploads':
+                dirs[:] = []
+                continue
+            for name in files:
+                if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                    continue
+                path = os.path.join(root, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if len(data) < minimum_size:
+                    continue
+
+                outputs = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+                if brotli is not None:
+                    outputs.append(('.br', brotli.compress(data, quality=11)))
+                for suffix, compressed in outputs:
+                    with open(path + suffix, 'wb') as f:
+                        f.write(compressed)
+                    written += 1
+        return written
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Time and quality of the day order optimizer for growing numbers of stops
+
+Usage:
+    python benchmarks/day_planner.py [--sizes 5,10,14,15,50,100,200] [--runs 20]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import day_planner
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='5,10,14,15,50,100,200')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'stops':>6}  {'method':<10}{'p50 ms':>10}{'max ms':>10}{'saved':>10}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        timings = []
+        savings = []
+        for _ in range(args.runs):
+            # A day of stops scattered over a city, entered in random order
+            latitudes = [random.uniform(31.4, 31.6) for _ in range(size)]
+            longitudes = [random.uniform(74.2, 74.4) for _ in range(size)]
+            start = time.perf_counter()
+            order, method = day_planner.optimize_order(latitudes, longitudes)
+            timings.append((time.perf_counter() - start) * 1000)
+
+            matrix = day_planner.distance_matrix(latitudes, longitudes)
+            before = day_planner.path_length(matrix, range(size))
+            savings.append(1 - day_planner.path_length(matrix, order) / before)
+        print(f"{size:>6}  {method:<10}{statistics.median(timings):>10.1f}{max(timings):>10.1f}"
+              f"{statistics.mean(savings):>10.0%}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Latency of listing pages near the start and deep into a large platform,
+with keyset cursors versus OFFSET paging
+
+Usage:
+    python benchmarks/pagination.py [--companies 50000] [--itineraries 200000] [--requests 200]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def seed(app_module, companies, itineraries, batch_size=50000):
+    db = app_module.db
+    db.create_all()
+    start = datetime(2020, 1, 1)
+
+    def created(n):
+        # Shuffled timestamps with ties so the id tiebreaker matters
+        return start + timedelta(seconds=random.randint(0, companies * 10) // 10 * 10)
+
+    db.session.execute(app_module.Company.__table__.insert(), [
+        {'id': i, 'name': f'Company {i}', 'email': f'company{i}@example.com', 'is_active': i % 10 != 0,
+         'subscription_plan': 'basic', 'created_at': created(i)} for i in range(1, companies + 1)
+    ])
+    db.session.execute(app_module.User.__table__.insert(), [
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': '-', 'role': 'admin',
+         'company_id': i, 'created_at': created(i)} for i in range(1, companies + 1)
+    ])
+    for first in range(1, itineraries + 1, batch_size):
+        db.session.execute(app_module.Itinerary.__table__.insert(), [
+            {'id': i, 'name': f'Itinerary {i}', 'description': '', 'company_id': i % companies + 1,
+             'is_active': True, 'created_at': created(i)}
+            for i in range(first, min(first + batch_size, itineraries + 1))
+        ])
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+
+def measure(label, client, urls):
+    timings = []
+    for url in urls:
+        start = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+    timings.sort()
+    print(f"{label:<44}{statistics.median(timings):>10.2f}{timings[int(len(timings) * 0.99) - 1]:>10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=50000)
+    parser.add_argument('--itineraries', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ['PLATFORM_STATS_TTL'] = '0'
+    import app as app_module
+
+    app = app_module.app
+    with app.app_context():
+        started = time.perf_counter()
+        seed(app_module, args.companies, args.itineraries)
+        print(f"Seeded {args.companies} companies and {args.itineraries} itineraries "
+              f"in {time.perf_counter() - started:.1f}s\n")
+
+        # Cursors for pages at every depth, collected by walking the listing
+        cursors = [None]
+        for _ in range(args.itineraries // 100):
+            cursor = app_module.keyset_page(app_module.public_itinerary_query(), app_module.Itinerary,
+                                            cursors[-1], 100, key=lambda row: row[0])[1]
+            if cursor is None:
+                break
+            cursors.append(cursor)
+        company_cursors = [None]
+        for _ in range(args.companies // 50):
+            cursor = app_module.keyset_page(app_module.Company.query, app_module.Company,
+                                            company_cursors[-1], 50)[1]
+            if cursor is None:
+                break
+            company_cursors.append(cursor)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1  # any user; the benchmark only reads super admin listings
+    with app.app_context():
+        app_module.db.session.get(app_module.User, 1).role = 'super_admin'
+        app_module.db.session.commit()
+
+    deep = cursors[-len(cursors) // 10:]
+    print(f"{'request':<44}{'p50 ms':>10}{'p99 ms':>10}")
+    measure('/api/itineraries first page', client, ['/api/itineraries?limit=100'] * args.requests)
+    measure('/api/itineraries last 10% of pages (cursor)', client,
+            [f'/api/itineraries?limit=100&cursor={random.choice(deep)}' for _ in range(args.requests)])
+
+    def offset_page(offset):
+        with app.app_context():
+            app_module.public_itinerary_query().order_by(
+                app_module.Itinerary.created_at.desc(), app_module.Itinerary.id.desc()
+            ).offset(offset).limit(100).all()
+
+    timings = []
+    for _ in range(max(args.requests // 10, 5)):
+        start = time.perf_counter()
+        offset_page(random.randint(int(args.itineraries * 0.9), args.itineraries - 100))
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{'same depth with OFFSET (query only)':<44}{statistics.median(timings):>10.2f}{max(timings):>10.2f}")
+
+    deep_companies = company_cursors[-len(company_cursors) // 10:]
+    measure('/super-admin/companies first page', client, ['/super-admin/companies'] * (args.requests // 4))
+    measure('/super-admin/companies last 10% of pages', client,
+            [f'/super-admin/companies?cursor={random.choice(deep_companies)}' for _ in range(args.requests // 4)])
+    measure('/api/super-admin/users first page', client, ['/api/super-admin/users?limit=100'] * args.requests)
+
+if __name__ == '__main__':
+    main()
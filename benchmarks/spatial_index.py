@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Latency of the "stops near me" and bounding-box lookups on a large table,
+using the R*Tree index (SQLite), the geohash index (other databases) and a
+plain latitude/longitude range scan
+
+Usage:
+    python benchmarks/spatial_index.py [--stops 1000000] [--queries 1000] [--radius 1000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Stops spread over roughly the area of Pakistan
+LAT_RANGE = (24.0, 37.0)
+LNG_RANGE = (61.0, 77.0)
+
+def seed(app_module, stops, itineraries=1000, batch_size=50000):
+    db, Stop, Itinerary, Company = app_module.db, app_module.Stop, app_module.Itinerary, app_module.Company
+    from geo import geohash_encode
+
+    db.create_all()
+    db.session.execute(Company.__table__.insert(), [{'id': 1, 'name': 'Bench', 'email': 'bench@example.com', 'is_active': True}])
+    db.session.execute(Itinerary.__table__.insert(), [
+        {'id': i, 'name': f'Itinerary {i}', 'company_id': 1, 'is_active': True} for i in range(1, itineraries + 1)
+    ])
+    for start in range(0, stops, batch_size):
+        rows = []
+        for n in range(start, min(start + batch_size, stops)):
+            lat = random.uniform(*LAT_RANGE)
+            lng = random.uniform(*LNG_RANGE)
+            rows.append({
+                'name': f'Stop {n}', 'latitude': lat, 'longitude': lng, 'geohash': geohash_encode(lat, lng),
+                'day_number': 1, 'order_in_day': 1, 'itinerary_id': n % itineraries + 1,
+            })
+        db.session.execute(Stop.__table__.insert(), rows)
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+
+def measure(label, fn, queries):
+    timings = []
+    found = 0
+    for _ in range(queries):
+        lat = random.uniform(*LAT_RANGE)
+        lng = random.uniform(*LNG_RANGE)
+        start = time.perf_counter()
+        found += len(fn(lat, lng))
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(f"{label:<28}{statistics.median(timings):>10.3f}{timings[int(len(timings) * 0.99) - 1]:>10.3f}"
+          f"{found / queries:>12.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--radius', type=float, default=1000, help='metres')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    import app as app_module
+    import geo
+    from geo import METERS_PER_DEGREE
+
+    with app_module.app.app_context():
+        started = time.perf_counter()
+        seed(app_module, args.stops)
+        print(f"Seeded {args.stops} stops in {time.perf_counter() - started:.1f}s\n")
+
+        half = args.radius / METERS_PER_DEGREE
+
+        def near(lat, lng):
+            return app_module.find_stops_near(lat, lng, args.radius, 50)
+
+        def box(lat, lng):
+            return app_module.find_stops_in_box(lat - half, lng - half, lat + half, lng + half, 500)
+
+        def box_geohash(lat, lng):
+            cells = geo.cover_box(lat - half, lng - half, lat + half, lng + half)
+            return app_module.filter_geohash_cells(app_module.public_stop_columns().filter(
+                app_module.box_filter(lat - half, lng - half, lat + half, lng + half)
+            ), cells).limit(500).all()
+
+        def box_without_index(lat, lng):
+            return app_module.public_stop_columns().filter(
+                app_module.box_filter(lat - half, lng - half, lat + half, lng + half)
+            ).limit(500).all()
+
+        print(f"{'query':<28}{'p50 ms':>10}{'p99 ms':>10}{'avg rows':>12}")
+        measure('near (R*Tree)', near, args.queries)
+        measure('bbox (R*Tree)', box, args.queries)
+        measure('bbox (geohash)', box_geohash, args.queries)
+        measure('bbox (lat/lng scan)', box_without_index, max(args.queries // 20, 5))
+
+if __name__ == '__main__':
+    main()
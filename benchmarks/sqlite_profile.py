@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Read throughput of the stops query under concurrent admin writes, comparing
+the default SQLite settings with the production pragmas
+
+Usage:
+    python benchmarks/sqlite_profile.py [--readers 8] [--seconds 5] [--stops 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, select, update
+from sqlalchemy.exc import OperationalError
+
+from app import db, Stop, Itinerary, Company, SQLITE_PRODUCTION_PRAGMAS, apply_sqlite_pragmas
+
+PROFILES = {
+    'default': {},
+    'production': SQLITE_PRODUCTION_PRAGMAS,
+}
+
+def create_database(path, pragmas, itineraries, stops):
+    engine = create_engine(f'sqlite:///{path}')
+    event.listen(engine, 'connect', lambda conn, record: apply_sqlite_pragmas(conn, pragmas))
+    db.metadata.create_all(engine)
+
+    per_itinerary = max(stops // itineraries, 1)
+    with engine.begin() as conn:
+        conn.execute(Company.__table__.insert(), [{'id': 1, 'name': 'Bench', 'email': 'bench@example.com'}])
+        conn.execute(Itinerary.__table__.insert(), [
+            {'id': i, 'name': f'Itinerary {i}', 'company_id': 1} for i in range(1, itineraries + 1)
+        ])
+        conn.execute(Stop.__table__.insert(), [
+            {
+                'name': f'Stop {n}',
+                'description': 'Benchmark stop',
+                'latitude': 31.5 + random.random(),
+                'longitude': 74.3 + random.random(),
+                'day_number': n % 10 + 1,
+                'order_in_day': n,
+                'itinerary_id': i,
+            }
+            for i in range(1, itineraries + 1) for n in range(per_itinerary)
+        ])
+    return engine
+
+def run(engine, itineraries, readers, seconds):
+    stop_at = time.monotonic() + seconds
+    reads = [0] * readers
+    errors = {'read': 0, 'write': 0}
+    writes = [0]
+
+    def reader(index):
+        while time.monotonic() < stop_at:
+            itinerary_id = random.randint(1, itineraries)
+            try:
+                with engine.connect() as conn:
+                    conn.execute(
+                        select(Stop).where(Stop.itinerary_id == itinerary_id)
+                        .order_by(Stop.day_number, Stop.order_in_day)
+                    ).all()
+                reads[index] += 1
+            except OperationalError:
+                errors['read'] += 1
+
+    def writer():
+        while time.monotonic() < stop_at:
+            itinerary_id = random.randint(1, itineraries)
+            try:
+                with engine.begin() as conn:
+                    conn.execute(
+                        update(Stop).where(Stop.itinerary_id == itinerary_id, Stop.day_number == 1)
+                        .values(is_day_active=random.random() < 0.5)
+                    )
+                writes[0] += 1
+            except OperationalError:
+                errors['write'] += 1
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sum(reads), writes[0], errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--itineraries', type=int, default=200)
+    parser.add_argument('--stops', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'reads/s':>10}{'writes/s':>10}{'read errors':>13}{'write errors':>14}")
+    for name, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_database(os.path.join(directory, 'bench.db'), pragmas, args.itineraries, args.stops)
+            reads, writes, errors = run(engine, args.itineraries, args.readers, args.seconds)
+            engine.dispose()
+        print(f"{name:<12}{reads / args.seconds:>10.0f}{writes / args.seconds:>10.0f}"
+              f"{errors['read']:>13}{errors['write']:>14}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Size and parse time of the /api/stops variants for a large itinerary: the
+full array of stop objects versus the columnar variant, each with and
+without gzip
+
+Parse time is json.loads plus, for the columnar variant, rebuilding one
+object per stop as the map does; a browser's JSON.parse scales the same way.
+
+Usage:
+    python benchmarks/stops_payload.py [--stops 1000] [--repeat 200]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def seed(app_module, stops):
+    db = app_module.db
+    db.create_all()
+    db.session.execute(app_module.Company.__table__.insert(), [
+        {'id': 1, 'name': 'Bench Tours', 'email': 'bench@example.com', 'subscription_plan': 'basic'}
+    ])
+    db.session.execute(app_module.Itinerary.__table__.insert(), [
+        {'id': 1, 'name': 'Grand Tour', 'description': '', 'company_id': 1, 'is_active': True}
+    ])
+    words = ['historic', 'mosque', 'garden', 'bazaar', 'gate', 'built', 'in', 'the', 'century', 'by', 'famous',
+             'for', 'its', 'tiles', 'and', 'view', 'over', 'old', 'city', 'walls']
+    db.session.execute(app_module.Stop.__table__.insert(), [{
+        'id': i + 1,
+        'name': f'{random.choice(words).title()} {random.choice(words).title()} {i + 1}',
+        'description': ' '.join(random.choices(words, k=40)),
+        'latitude': 31.5 + random.uniform(-0.1, 0.1),
+        'longitude': 74.3 + random.uniform(-0.1, 0.1),
+        'day_number': i // 8 + 1,
+        'order_in_day': i % 8 + 1,
+        'is_day_active': i // 8 % 3 != 0,
+        'image_filename': f'{random.getrandbits(256):064x}.jpg' if i % 2 else None,
+        'itinerary_id': 1,
+    } for i in range(stops)])
+    db.session.commit()
+
+def parse_full(body):
+    return json.loads(body)
+
+def parse_columnar(body):
+    data = json.loads(body)
+    return [{
+        'id': stop_id,
+        'name': data['name'][i],
+        'latitude': data['latitude'][i],
+        'longitude': data['longitude'][i],
+        'day_number': data['day_number'][i],
+        'order_in_day': data['order_in_day'][i],
+        'is_day_active': data['is_day_active'][i] == 1,
+    } for i, stop_id in enumerate(data['id'])]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stops', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    import app as app_module
+
+    random.seed(1)
+    with app_module.app.app_context():
+        seed(app_module, args.stops)
+
+    client = app_module.app.test_client()
+    variants = [
+        ('full', {}, parse_full),
+        ('full, gzip', {'Accept-Encoding': 'gzip'}, parse_full),
+        ('columnar', {'Accept': app_module.STOPS_FORMATS['columnar']}, parse_columnar),
+        ('columnar, gzip', {'Accept': app_module.STOPS_FORMATS['columnar'], 'Accept-Encoding': 'gzip'}, parse_columnar),
+    ]
+    print(f"{args.stops} stops\n")
+    print(f"{'variant':<18}{'bytes':>10}{'parse ms':>10}{'serve ms':>10}")
+    for label, headers, parse in variants:
+        response = client.get('/api/stops/1', headers=headers)
+        assert response.status_code == 200, response.status_code
+        body = response.data
+        text = gzip.decompress(body) if response.headers.get('Content-Encoding') == 'gzip' else body
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            parse(text)
+            timings.append((time.perf_counter() - start) * 1000)
+        serve = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            client.get('/api/stops/1', headers=headers)
+            serve.append((time.perf_counter() - start) * 1000)
+        print(f"{label:<18}{len(body):>10}{statistics.median(timings):>10.2f}{statistics.median(serve):>10.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmark suite on synthetic multi-tenant data
+
+Drives the main public, admin and super admin pages through the Flask test
+client (p50/p99 latency and SQL statements per request), then runs a
+concurrent HTTP load against a local server with the public map traffic
+(throughput and latency). Results are compared with a stored baseline;
+regressions are listed and make the script exit with status 1.
+
+Latency baselines are specific to the machine that saved them; re-save on
+your own hardware with --save-baseline. Query counts are portable.
+
+Usage:
+    python benchmarks/suite.py [--companies 200] [--itineraries 5000] [--stops 100000]
+        [--database URL] [--requests 100] [--concurrency 8] [--seconds 10]
+        [--baseline benchmarks/baselines/suite.json] [--save-baseline] [--tolerance 0.25]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_data
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'suite.json')
+
+# Latency regressions smaller than this are noise on any machine
+MIN_REGRESSION_MS = 2.0
+
+def percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def scenarios(app_module):
+    """name -> (user id to log in as or None, function returning a URL)"""
+    with app_module.app.app_context():
+        db, Itinerary, Company, User = app_module.db, app_module.Itinerary, app_module.Company, app_module.User
+        public_ids = [row.id for row in db.session.query(Itinerary.id).join(Company).filter(
+            Itinerary.is_active == True, Company.is_active == True).limit(2000)]
+        # The largest tenant's admin: the worst case for the admin dashboard
+        largest = db.session.query(Itinerary.company_id).group_by(Itinerary.company_id).order_by(
+            app_module.func.count(Itinerary.id).desc()).first()[0]
+        admin_id = db.session.query(User.id).filter_by(company_id=largest, role='admin').scalar()
+        super_admin_id = db.session.query(User.id).filter_by(role='super_admin').first()[0]
+
+    def near():
+        _, _, lat, lng = random.choice(synthetic_data.CITIES)
+        return f'/api/stops/near?lat={lat + random.uniform(-0.05, 0.05)}&lng={lng + random.uniform(-0.05, 0.05)}&radius=2000'
+
+    return {
+        'index': (None, lambda: '/'),
+        'get_stops': (None, lambda: f'/api/stops/{random.choice(public_ids)}'),
+        'list_itineraries': (None, lambda: '/api/itineraries?limit=20'),
+        'search': (None, lambda: f'/api/search?q={random.choice(synthetic_data.PLACES)}'),
+        'stops_near': (None, near),
+        'admin_dashboard': (admin_id, lambda: '/admin'),
+        'manage_companies': (super_admin_id, lambda: '/super-admin/companies'),
+        'super_admin_dashboard': (super_admin_id, lambda: '/super-admin'),
+    }
+
+def run_test_client(app_module, cases, requests):
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    app_module.event.listen(engine, 'after_cursor_execute', count)
+
+    results = {}
+    try:
+        for name, (user_id, url) in cases.items():
+            client = app_module.app.test_client()
+            if user_id:
+                with client.session_transaction() as session:
+                    session['user_id'] = user_id
+            for _ in range(3):
+                client.get(url())
+
+            timings = []
+            queries = []
+            for _ in range(requests):
+                before = statements[0]
+                start = time.perf_counter()
+                response = client.get(url())
+                timings.append((time.perf_counter() - start) * 1000)
+                queries.append(statements[0] - before)
+                if response.status_code != 200:
+                    raise SystemExit(f'{name}: {response.request.path} returned {response.status_code}')
+            results[name] = {
+                'p50_ms': round(statistics.median(timings), 2),
+                'p99_ms': round(percentile(timings, 0.99), 2),
+                'queries': round(statistics.mean(queries), 1),
+            }
+            print(f"{name:<24}{results[name]['p50_ms']:>10.2f}{results[name]['p99_ms']:>10.2f}"
+                  f"{results[name]['queries']:>10.1f}")
+    finally:
+        app_module.event.remove(engine, 'after_cursor_execute', count)
+    return results
+
+def run_load(app_module, cases, concurrency, seconds):
+    """Public map traffic from concurrent clients against a local threaded server"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    public = [url for user_id, url in cases.values() if user_id is None]
+
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=30)
+        mine = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request('GET', random.choice(public)())
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=30)
+                ok = False
+            if ok:
+                mine.append((time.perf_counter() - start) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        connection.close()
+        with lock:
+            timings.extend(mine)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    result = {
+        'requests_per_s': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings), 2) if timings else None,
+        'p99_ms': round(percentile(timings, 0.99), 2) if timings else None,
+        'errors': errors[0],
+    }
+    print(f"{'load':<24}{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+          f"{'':>10}{result['requests_per_s']:>10.1f}{result['errors']:>8}")
+    return result
+
+def compare(results, baseline, tolerance):
+    """Regressions of results against a baseline, as readable lines"""
+    regressions = []
+    if baseline['sizes'] != results['sizes']:
+        print(f"⚠️  Baseline was saved for {baseline['sizes']}; comparing anyway")
+    for name, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if not previous:
+            continue
+        if current['queries'] > previous['queries'] + 0.5:
+            regressions.append(f"{name}: {current['queries']} queries per request, was {previous['queries']}")
+        for key in ('p50_ms', 'p99_ms'):
+            if (current[key] > previous[key] * (1 + tolerance)
+                    and current[key] - previous[key] > MIN_REGRESSION_MS):
+                regressions.append(f"{name}: {key} {current[key]}, was {previous[key]}")
+    load, previous = results.get('load'), baseline.get('load')
+    if load and previous and load['requests_per_s'] < previous['requests_per_s'] * (1 - tolerance):
+        regressions.append(f"load: {load['requests_per_s']} requests/s, was {previous['requests_per_s']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--companies', type=int, default=200)
+    parser.add_argument('--itineraries', type=int, default=5000)
+    parser.add_argument('--stops', type=int, default=100000)
+    parser.add_argument('--database', help='existing database from synthetic_data.py (skips generation)')
+    parser.add_argument('--requests', type=int, default=100, help='per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10, help='length of the load phase (0 skips it)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before flagging')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    import app as app_module
+
+    if args.database:
+        with app_module.app.app_context():
+            sizes = {
+                'companies': app_module.Company.query.count(),
+                'itineraries': app_module.Itinerary.query.count(),
+                'stops': app_module.Stop.query.count(),
+            }
+    else:
+        started = time.perf_counter()
+        with app_module.app.app_context():
+            counts = synthetic_data.generate(app_module, args.companies, args.itineraries, args.stops,
+                                             log=lambda message: None)
+        sizes = {key: counts[key] for key in ('companies', 'itineraries', 'stops')}
+        print(f"Generated {sizes} in {time.perf_counter() - started:.1f}s")
+
+    random.seed(1)
+    cases = scenarios(app_module)
+    print(f"\n{'endpoint':<24}{'p50 ms':>10}{'p99 ms':>10}{'queries':>10}{'req/s':>10}{'errors':>8}")
+    results = {
+        'sizes': sizes,
+        'python': platform.python_version(),
+        'endpoints': run_test_client(app_module, cases, args.requests),
+    }
+    if args.seconds > 0:
+        results['load'] = run_load(app_module, cases, args.concurrency, args.seconds)
+        results['load']['concurrency'] = args.concurrency
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"\n✅ Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline, encoding='utf-8') as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print('\n❌ Regressions against the baseline:')
+        for line in regressions:
+            print(f'   {line}')
+        sys.exit(1)
+    print('\n✅ No regressions against the baseline')
+
+if __name__ == '__main__':
+    main()
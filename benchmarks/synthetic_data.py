@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Synthetic multi-tenant data for load tests: companies with admins,
+itineraries skewed towards a few large tenants, and stops clustered by day
+around each company's city. Rows go in with bulk INSERTs; on SQLite the
+search and spatial index triggers are paused during the load and the indexes
+are rebuilt once.
+
+Every admin's password is "bench123"; the super admin is bench-super@example.com.
+
+Usage:
+    python benchmarks/synthetic_data.py [--database sqlite:///instance/synthetic.db]
+        [--companies 5000] [--itineraries 100000] [--stops 5000000] [--reset]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import geo
+
+PASSWORD = 'bench123'
+SUPER_ADMIN_EMAIL = 'bench-super@example.com'
+BATCH_SIZE = 50000
+
+CITIES = [
+    ('Lahore', 'Pakistan', 31.5204, 74.3587), ('Karachi', 'Pakistan', 24.8607, 67.0011),
+    ('Islamabad', 'Pakistan', 33.6844, 73.0479), ('Istanbul', 'Turkey', 41.0082, 28.9784),
+    ('Dubai', 'United Arab Emirates', 25.2048, 55.2708), ('Rome', 'Italy', 41.9028, 12.4964),
+    ('Paris', 'France', 48.8566, 2.3522), ('Bangkok', 'Thailand', 13.7563, 100.5018),
+    ('Kyoto', 'Japan', 35.0116, 135.7681), ('Cairo', 'Egypt', 30.0444, 31.2357),
+    ('Marrakesh', 'Morocco', 31.6295, -7.9811), ('Lisbon', 'Portugal', 38.7223, -9.1393),
+]
+THEMES = ['Heritage', 'Food', 'Mountain', 'Desert', 'Coastal', 'Night', 'Market', 'Garden', 'Museum',
+          'Architecture', 'Pilgrimage', 'Photography', 'River', 'Old City', 'Craft']
+PLACES = ['Fort', 'Mosque', 'Bazaar', 'Museum', 'Garden', 'Gate', 'Palace', 'Tomb', 'Lake', 'Viewpoint',
+          'Cathedral', 'Temple', 'Harbour', 'Square', 'Bridge', 'Tower', 'Library', 'Market', 'Shrine', 'Park']
+WORDS = ['historic', 'famous', 'quiet', 'busy', 'ancient', 'colourful', 'local', 'traditional', 'scenic',
+         'hidden', 'grand', 'riverside', 'hilltop', 'walled', 'painted', 'carved', 'restored', 'royal']
+
+def geohash_encode_many(latitudes, longitudes, precision=geo.GEOHASH_PRECISION):
+    """Vectorized geo.geohash_encode for arrays of points"""
+    bits = 5 * precision
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    lng_cells = np.floor((np.asarray(longitudes) + 180.0) / 360.0 * (1 << lng_bits)).astype(np.int64)
+    lat_cells = np.floor((np.asarray(latitudes) + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64)
+    lng_cells = np.clip(lng_cells, 0, (1 << lng_bits) - 1)
+    lat_cells = np.clip(lat_cells, 0, (1 << lat_bits) - 1)
+
+    # Interleave the bits, longitude first, most significant first
+    code = np.zeros(len(lng_cells), dtype=np.int64)
+    for bit in range(bits):
+        if bit % 2 == 0:
+            value = (lng_cells >> (lng_bits - 1 - bit // 2)) & 1
+        else:
+            value = (lat_cells >> (lat_bits - 1 - bit // 2)) & 1
+        code = (code << 1) | value
+
+    alphabet = np.array(list(geo.BASE32))
+    chars = np.stack([alphabet[(code >> (5 * (precision - 1 - i))) & 31] for i in range(precision)], axis=1)
+    return chars.view(f'<U{precision}').ravel().tolist()
+
+def phrase(rng, words, count):
+    return ' '.join(rng.choice(words, size=count))
+
+def created_times(rng, count, start, days):
+    offsets = np.sort(rng.integers(0, days * 86400, size=count))
+    return [start + timedelta(seconds=int(seconds)) for seconds in offsets]
+
+def pause_index_triggers(connection):
+    """Drop the search and spatial index triggers for a bulk load; returns whether any were dropped"""
+    from sqlalchemy import text
+    if connection.dialect.name != 'sqlite':
+        return False
+    names = [name for (name,) in connection.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+        " AND (name LIKE 'search_%' OR name LIKE 'spatial_%')"))]
+    for name in names:
+        connection.execute(text(f'DROP TRIGGER {name}'))
+    return bool(names)
+
+def restore_indexes(connection):
+    import search
+    import spatial
+    from sqlalchemy import text
+    for statement in search.SCHEMA + spatial.SCHEMA:
+        connection.execute(text(statement))
+    search.rebuild(connection)
+    spatial.rebuild(connection)
+
+def generate(app_module, companies, itineraries, stops, seed=1, log=print):
+    """Fill an empty database through the app's models; returns row counts"""
+    from werkzeug.security import generate_password_hash
+    from sqlalchemy import text
+
+    db = app_module.db
+    rng = np.random.default_rng(seed)
+    start = datetime(2022, 1, 1)
+    password_hash = generate_password_hash(PASSWORD)
+    db.create_all()
+    engine = db.engine
+
+    with engine.begin() as conn:
+        if conn.dialect.name == 'sqlite':
+            # The load is one transaction; a crash just means running it again
+            conn.execute(text('PRAGMA synchronous=OFF'))
+        paused = pause_index_triggers(conn)
+
+        started = time.perf_counter()
+        city_of = rng.integers(0, len(CITIES), size=companies)
+        conn.execute(app_module.Company.__table__.insert(), [{
+            'id': i + 1,
+            'name': f'{CITIES[city_of[i]][0]} {THEMES[i % len(THEMES)]} Tours {i + 1}',
+            'email': f'company{i + 1}@example.com',
+            'city': CITIES[city_of[i]][0],
+            'country': CITIES[city_of[i]][1],
+            'subscription_plan': ('basic', 'premium', 'enterprise')[i % 3],
+            'is_active': bool(rng.random() < 0.95),
+            'created_at': created,
+        } for i, created in enumerate(created_times(rng, companies, start, 900))])
+
+        users = [{'id': 1, 'username': SUPER_ADMIN_EMAIL, 'email': SUPER_ADMIN_EMAIL, 'password_hash': password_hash,
+                  'role': 'super_admin', 'company_id': None, 'is_active': True, 'created_at': start}]
+        users += [{
+            'id': i + 2, 'username': f'admin{i + 1}@example.com', 'email': f'admin{i + 1}@example.com',
+            'password_hash': password_hash, 'role': 'admin', 'company_id': i + 1, 'is_active': True,
+            'created_at': created,
+        } for i, created in enumerate(created_times(rng, companies, start, 900))]
+        conn.execute(app_module.User.__table__.insert(), users)
+        log(f"  {companies} companies and {len(users)} users in {time.perf_counter() - started:.1f}s")
+
+        # A few large tenants and a long tail of small ones
+        started = time.perf_counter()
+        owner = (companies * rng.random(itineraries) ** 2).astype(np.int64) + 1
+        itinerary_created = created_times(rng, itineraries, start + timedelta(days=30), 900)
+        for first in range(0, itineraries, BATCH_SIZE):
+            conn.execute(app_module.Itinerary.__table__.insert(), [{
+                'id': i + 1,
+                'name': f'{CITIES[city_of[owner[i] - 1]][0]} {THEMES[i % len(THEMES)]} Trail {i + 1}',
+                'description': f'A {phrase(rng, WORDS, 3)} tour of {CITIES[city_of[owner[i] - 1]][0]}',
+                'company_id': int(owner[i]),
+                'is_active': bool(rng.random() < 0.9),
+                'created_at': itinerary_created[i],
+            } for i in range(first, min(first + BATCH_SIZE, itineraries))])
+        log(f"  {itineraries} itineraries in {time.perf_counter() - started:.1f}s")
+
+        # Stops per itinerary vary around the mean; each day has up to 8
+        started = time.perf_counter()
+        weights = rng.gamma(2.0, 1.0, size=itineraries)
+        counts = rng.multinomial(stops, weights / weights.sum())
+        first_stop = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        centre_lat = np.array([CITIES[c][2] for c in city_of])[owner - 1] + rng.normal(0, 0.05, itineraries)
+        centre_lng = np.array([CITIES[c][3] for c in city_of])[owner - 1] + rng.normal(0, 0.05, itineraries)
+        stop_id = 0
+        per_batch = max(BATCH_SIZE * itineraries // max(stops, 1), 1)
+        for first in range(0, itineraries, per_batch):
+            batch = slice(first, min(first + per_batch, itineraries))
+            itinerary = np.repeat(np.arange(batch.start, batch.stop), counts[batch])
+            if not len(itinerary):
+                continue
+            position = np.arange(len(itinerary)) - (first_stop[itinerary] - first_stop[batch.start])
+            day = position // 8 + 1
+            latitude = centre_lat[itinerary] + rng.normal(0, 0.02, len(itinerary))
+            longitude = centre_lng[itinerary] + rng.normal(0, 0.02, len(itinerary))
+            geohashes = geohash_encode_many(latitude, longitude)
+            places = rng.integers(0, len(PLACES), size=len(itinerary))
+            adjectives = rng.integers(0, len(WORDS), size=len(itinerary))
+            rows = []
+            for k in range(len(itinerary)):
+                stop_id += 1
+                rows.append({
+                    'id': stop_id,
+                    'name': f'{WORDS[adjectives[k]].title()} {PLACES[places[k]]} {stop_id}',
+                    'description': f'{WORDS[adjectives[k - 1]]} {PLACES[places[k - 1]].lower()} near the old town',
+                    'latitude': float(latitude[k]),
+                    'longitude': float(longitude[k]),
+                    'geohash': geohashes[k],
+                    'day_number': int(day[k]),
+                    'order_in_day': int(position[k] % 8 + 1),
+                    # Roughly 70% of days are active
+                    'is_day_active': bool((int(itinerary[k]) * 31 + int(day[k]) * 17) % 10 < 7),
+                    'itinerary_id': int(itinerary[k]) + 1,
+                    'created_at': itinerary_created[itinerary[k]],
+                })
+            conn.execute(app_module.Stop.__table__.insert(), rows)
+            if stop_id % 1000000 < len(rows):
+                log(f"  {stop_id} stops...")
+        log(f"  {stop_id} stops in {time.perf_counter() - started:.1f}s")
+
+        if paused:
+            started = time.perf_counter()
+            restore_indexes(conn)
+            log(f"  search and spatial indexes rebuilt in {time.perf_counter() - started:.1f}s")
+        conn.execute(text('ANALYZE'))
+
+    return {'companies': companies, 'users': len(users), 'itineraries': itineraries, 'stops': stop_id}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=f"sqlite:///{os.path.join(ROOT, 'instance', 'synthetic.db')}")
+    parser.add_argument('--companies', type=int, default=5000)
+    parser.add_argument('--itineraries', type=int, default=100000)
+    parser.add_argument('--stops', type=int, default=5000000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='drop every table first')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database
+    import app as app_module
+    from sqlalchemy import inspect
+
+    with app_module.app.app_context():
+        if args.reset:
+            app_module.db.drop_all()
+        elif inspect(app_module.db.engine).has_table('company') and app_module.Company.query.first():
+            parser.error(f'{args.database} already has data; pass --reset to replace it')
+        print(f"Generating data in {args.database}")
+        started = time.perf_counter()
+        counts = generate(app_module, args.companies, args.itineraries, args.stops, seed=args.seed)
+        print(f"✅ {counts} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Offline itinerary bundles
+A bundle is one zip archive with everything the map needs for a tour
+without a connection: the stops JSON, the route for every profile with all
+zoom tiers precomputed, stop image thumbnails and a manifest listing each
+file's SHA-256. Files are also kept in a content-addressed part store, so
+a client holding an older bundle compares manifests and downloads only the
+parts whose hash changed.
+
+A stored bundle is current while its source key (a hash of the inputs the
+caller cheaply knows, such as the stops payload ETag) matches; building a
+new one is left to the caller, off the request path.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+
+MANIFEST_VERSION = 1
+
+# Already-compressed formats are stored in the archive as-is
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+PART_NAME = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]+$')
+
+# Unreferenced parts younger than this may belong to a build in progress
+PRUNE_GRACE_SECONDS = 3600
+
+def write_atomic(path, data):
+    """Write bytes to a file so readers never see a partial one"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def part_name(digest, path):
+    return f'{digest}{os.path.splitext(path)[1].lower() or ".bin"}'
+
+class BundleStore:
+    """Builds bundles and keeps them with their parts on disk"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.parts_folder = os.path.join(folder, 'parts')
+        os.makedirs(self.parts_folder, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def manifest_path(self, itinerary_id):
+        return os.path.join(self.folder, f'{itinerary_id}.json')
+
+    def archive_path(self, itinerary_id):
+        return os.path.join(self.folder, f'{itinerary_id}.zip')
+
+    def part_path(self, name):
+        """Path of a stored part, or None for names that are not part names"""
+        return os.path.join(self.parts_folder, name) if PART_NAME.match(name) else None
+
+    def load_manifest(self, itinerary_id):
+        try:
+            with open(self.manifest_path(itinerary_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def current(self, itinerary_id, *source_keys):
+        """The stored manifest if it was built from one of source_keys, else None"""
+        manifest = self.load_manifest(itinerary_id)
+        if manifest and manifest['source'] in source_keys and os.path.exists(self.archive_path(itinerary_id)):
+            return manifest
+        return None
+
+    def age(self, itinerary_id):
+        """Seconds since the manifest was last written"""
+        return time.time() - os.path.getmtime(self.manifest_path(itinerary_id))
+
+    def build(self, itinerary_id, source_key, files):
+        # Parts and the manifest are written under the prune lock, so a prune
+        # in this process never sees parts whose manifest is not written yet
+        with self._lock:
+            return self._build(itinerary_id, source_key, files)
+
+    def _build(self, itinerary_id, source_key, files):
+        entries = []
+        for path in sorted(files):
+            data = files[path]
+            digest = hashlib.sha256(data).hexdigest()
+            part_path = os.path.join(self.parts_folder, part_name(digest, path))
+            # Parts are content-addressed: an unchanged file is not rewritten,
+            # only touched so a prune in another process sees it as recent
+            try:
+                os.utime(part_path)
+            except FileNotFoundError:
+                write_atomic(part_path, data)
+            entries.append({'path': path, 'sha256': digest, 'size': len(data), 'part': os.path.basename(part_path)})
+
+        # The bundle version only depends on the files it contains
+        version = hashlib.sha256(
+            ''.join(f"{entry['path']}\0{entry['sha256']}\n" for entry in entries).encode('utf-8')
+        ).hexdigest()[:16]
+        manifest = {
+            'format': MANIFEST_VERSION,
+            'itinerary_id': itinerary_id,
+            'version': version,
+            'source': source_key,
+            'built_at': int(time.time()),
+            'files': entries,
+        }
+
+        previous = self.load_manifest(itinerary_id)
+        if not (previous and previous['version'] == version and os.path.exists(self.archive_path(itinerary_id))):
+            fd, temp_path = tempfile.mkstemp(dir=self.folder, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as out, zipfile.ZipFile(out, 'w') as archive:
+                    archive.writestr('manifest.json', json.dumps(self.public_manifest(manifest), indent=1),
+                                     compress_type=zipfile.ZIP_DEFLATED)
+                    for entry in entries:
+                        stored = os.path.splitext(entry['path'])[1].lower() in STORED_EXTENSIONS
+                        archive.writestr(entry['path'], files[entry['path']],
+                                         compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+                os.replace(temp_path, self.archive_path(itinerary_id))
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        else:
+            # Same files from a new source key (e.g. an unrelated cache bump)
+            manifest['built_at'] = previous['built_at']
+        write_atomic(self.manifest_path(itinerary_id), json.dumps(manifest).encode('utf-8'))
+        return manifest
+
+    @staticmethod
+    def public_manifest(manifest):
+        """The manifest as sent to clients, without the internal source key"""
+        public = {key: value for key, value in manifest.items() if key != 'source'}
+        # Routes include straight lines standing in for a failing router
+        public['degraded'] = manifest['source'].endswith('-degraded')
+        return public
+
+    def prune(self, grace=PRUNE_GRACE_SECONDS):
+        """Delete parts no stored manifest refers to; returns how many were removed
+
+        Parts written or reused less than grace seconds ago are kept: they may
+        belong to a build in another process whose manifest is not written yet.
+        """
+        recent = time.time() - grace
+        with self._lock:
+            referenced = set()
+            for name in os.listdir(self.folder):
+                if name.endswith('.json'):
+                    with open(os.path.join(self.folder, name), encoding='utf-8') as f:
+                        referenced.update(entry['part'] for entry in json.load(f)['files'])
+            removed = 0
+            for name in os.listdir(self.parts_folder):
+                # Skip files still being written
+                if not PART_NAME.match(name) or name in referenced:
+                    continue
+                path = os.path.join(self.parts_folder, name)
+                try:
+                    if os.path.getmtime(path) < recent:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+            return removed
+
+    def remove(self, itinerary_id):
+        """Drop an itinerary's bundle; its parts go with the next prune()"""
+        for path in (self.manifest_path(itinerary_id), self.archive_path(itinerary_id)):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,164 @@
+"""
+Visiting order optimizer for the stops of one day
+Finds the shortest path through a day's stops (an open travelling salesman
+path) with the first and/or last stop optionally kept in place. Small days
+are solved exactly with Held-Karp dynamic programming; larger ones start
+from a nearest-neighbour tour improved with 2-opt and Or-opt moves.
+"""
+
+import numpy as np
+
+from analytics import haversine_m
+
+# Days with at most this many stops between the fixed ends are solved exactly
+# (about 15 ms at the limit; each extra stop roughly doubles the time)
+EXACT_LIMIT = 14
+
+# Or-opt moves relocate runs of up to this many consecutive stops
+OR_OPT_MAX_RUN = 3
+
+MAX_IMPROVEMENTS = 5000
+
+def distance_matrix(latitudes, longitudes):
+    """Pairwise great-circle distances in metres"""
+    lat = np.asarray(latitudes, dtype=np.float64)
+    lng = np.asarray(longitudes, dtype=np.float64)
+    return haversine_m(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+
+def path_length(matrix, order):
+    order = np.asarray(order)
+    return float(matrix[order[:-1], order[1:]].sum())
+
+def with_free_ends(matrix, fix_start, fix_end):
+    """Pad the matrix with zero-cost dummy ends so every problem has fixed ends
+
+    Returns the padded matrix, its start and end nodes, and the index of the
+    first real stop in it.
+    """
+    size = len(matrix)
+    pad_start = 0 if fix_start else 1
+    pad_end = 0 if fix_end else 1
+    padded = np.zeros((size + pad_start + pad_end,) * 2)
+    padded[pad_start:pad_start + size, pad_start:pad_start + size] = matrix
+    start = 0
+    end = size - 1 + pad_start + pad_end
+    return padded, start, end, pad_start
+
+def solve_exact(matrix, start, end):
+    """Held-Karp over the nodes between start and end, one subset size at a time"""
+    middle = np.array([n for n in range(len(matrix)) if n not in (start, end)], dtype=np.int64)
+    count = len(middle)
+    if count == 0:
+        return [start, end]
+    inner = matrix[np.ix_(middle, middle)]
+    full = 1 << count
+
+    # best[mask, j]: shortest path from start through the nodes in mask ending at middle[j]
+    best = np.full((full, count), np.inf)
+    parent = np.full((full, count), -1, dtype=np.int64)
+    singles = 1 << np.arange(count)
+    best[singles, np.arange(count)] = matrix[start, middle]
+
+    masks = np.arange(full)
+    sizes = np.zeros(full, dtype=np.int64)
+    for bit in range(count):
+        sizes += (masks >> bit) & 1
+    for size in range(2, count + 1):
+        layer = masks[sizes == size]
+        for j in range(count):
+            with_j = layer[(layer >> j) & 1 == 1]
+            previous = with_j ^ (1 << j)
+            candidates = best[previous] + inner[:, j]
+            chosen = candidates.argmin(axis=1)
+            best[with_j, j] = candidates[np.arange(len(with_j)), chosen]
+            parent[with_j, j] = chosen
+
+    last = int((best[full - 1] + matrix[middle, end]).argmin())
+    order = [end]
+    mask = full - 1
+    while last != -1:
+        order.append(int(middle[last]))
+        mask, last = mask ^ (1 << last), int(parent[mask, last])
+    order.append(start)
+    return order[::-1]
+
+def nearest_neighbour(matrix, start, end):
+    remaining = set(range(len(matrix))) - {start, end}
+    order = [start]
+    while remaining:
+        candidates = np.fromiter(remaining, dtype=np.int64)
+        current = candidates[matrix[order[-1], candidates].argmin()]
+        order.append(int(current))
+        remaining.discard(int(current))
+    order.append(end)
+    return np.array(order, dtype=np.int64)
+
+def best_two_opt(matrix, order):
+    """Best segment reversal as (gain, i, k); reverses order[i:k + 1]"""
+    size = len(order)
+    if size < 4:
+        return 0.0, 0, 0
+    path = matrix[np.ix_(order, order)]
+    edges = np.diagonal(path, 1)
+    # Replace edges (i-1, i) and (k, k+1) with (i-1, k) and (i, k+1), for 1 <= i < k <= size-2
+    delta = (path[:size - 2, 1:size - 1] + path[1:size - 1, 2:size]
+             - edges[:size - 2, None] - edges[None, 1:size - 1])
+    delta[np.tril_indices(size - 2)] = 0.0
+    i, k = np.unravel_index(delta.argmin(), delta.shape)
+    return -float(delta[i, k]), int(i) + 1, int(k) + 1
+
+def best_or_opt(matrix, order):
+    """Best relocation of a run of stops as (gain, i, run, j); moves order[i:i + run] after order[j]"""
+    size = len(order)
+    path = matrix[np.ix_(order, order)]
+    edges = np.diagonal(path, 1)
+    best = (0.0, 0, 0, 0)
+    positions = np.arange(size - 1)
+    for run in range(1, min(OR_OPT_MAX_RUN, size - 2) + 1):
+        first = np.arange(1, size - run)           # run covers first .. first + run - 1
+        last = first + run - 1
+        removed = edges[first - 1] + edges[last] - path[first - 1, last + 1]
+        # Insert between positions j and j + 1, outside the run and its neighbouring edges
+        added = path[positions[None, :], first[:, None]] + path[last[:, None], positions[None, :] + 1] \
+            - edges[None, positions]
+        valid = (positions[None, :] < first[:, None] - 1) | (positions[None, :] > last[:, None])
+        delta = np.where(valid, added - removed[:, None], np.inf)
+        i, j = np.unravel_index(delta.argmin(), delta.shape)
+        if -delta[i, j] > best[0]:
+            best = (-float(delta[i, j]), int(first[i]), run, int(j))
+    return best
+
+def improve(matrix, order, tolerance=1e-6):
+    """Apply the best 2-opt move, or failing that the best Or-opt move, until neither helps"""
+    order = np.array(order, dtype=np.int64)
+    for _ in range(MAX_IMPROVEMENTS):
+        gain, i, k = best_two_opt(matrix, order)
+        if gain > tolerance:
+            order[i:k + 1] = order[i:k + 1][::-1]
+            continue
+        gain, i, run, j = best_or_opt(matrix, order)
+        if gain <= tolerance:
+            break
+        moved = order[i:i + run]
+        rest = np.concatenate([order[:i], order[i + run:]])
+        at = j + 1 if j < i else j + 1 - run
+        order = np.concatenate([rest[:at], moved, rest[at:]])
+    return order
+
+def optimize_order(latitudes, longitudes, fix_start=True, fix_end=False):
+    """Shortest visiting order for a day's stops
+
+    Returns (order, method) where order is a permutation of range(len(stops))
+    and method is 'exact' or 'heuristic'.
+    """
+    size = len(latitudes)
+    if size < 3:
+        return list(range(size)), 'exact'
+
+    matrix, start, end, offset = with_free_ends(distance_matrix(latitudes, longitudes), fix_start, fix_end)
+    if len(matrix) - 2 <= EXACT_LIMIT:
+        order, method = solve_exact(matrix, start, end), 'exact'
+    else:
+        order, method = improve(matrix, nearest_neighbour(matrix, start, end)), 'heuristic'
+    # Drop the dummy ends and map back to stop positions
+    return [int(n) - offset for n in order if offset <= n < offset + size], method
@@ -0,0 +1,134 @@
+"""
+Geographic helpers: great-circle distance and geohash cells
+Stops store a geohash so spatial lookups become index range scans over
+cell prefixes instead of full table scans
+"""
+
+import math
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+GEOHASH_PRECISION = 9  # ~4.8 m x 4.8 m cells
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in metres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    """Encode a point as a geohash string"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lng_range[0] + lng_range[1]) / 2
+            if lng >= mid:
+                value = (value << 1) | 1
+                lng_range[0] = mid
+            else:
+                value <<= 1
+                lng_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                value = (value << 1) | 1
+                lat_range[0] = mid
+            else:
+                value <<= 1
+                lat_range[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+def cell_size(precision):
+    """(height, width) of a geohash cell in degrees"""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+def cells_for_box(min_lat, min_lng, max_lat, max_lng, precision):
+    """Geohash cells at a precision covering a box (min_lng <= max_lng)"""
+    height, width = cell_size(precision)
+    lat_start = math.floor((max(min_lat, -90) + 90) / height)
+    lat_end = math.floor((min(max_lat, 90) + 90) / height)
+    lng_start = math.floor((max(min_lng, -180) + 180) / width)
+    lng_end = math.floor((min(max_lng, 180) + 180) / width)
+    lat_end = min(lat_end, round(180 / height) - 1)
+    lng_end = min(lng_end, round(360 / width) - 1)
+
+    cells = set()
+    for i in range(lat_start, lat_end + 1):
+        for j in range(lng_start, lng_end + 1):
+            cells.add(geohash_encode(-90 + (i + 0.5) * height, -180 + (j + 0.5) * width, precision))
+    return cells
+
+def cover_box(min_lat, min_lng, max_lat, max_lng, max_cells=32):
+    """The finest set of geohash prefixes (at most max_cells) covering a box
+
+    Boxes crossing the antimeridian (min_lng > max_lng) are split in two.
+    Returns an empty set when the box is too large to narrow down.
+    """
+    if min_lng > max_lng:
+        boxes = [(min_lat, min_lng, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lng)]
+    else:
+        boxes = [(min_lat, min_lng, max_lat, max_lng)]
+
+    best = set()
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        height, width = cell_size(precision)
+        estimate = sum(
+            (math.floor((b[2] - b[0]) / height) + 2) * (math.floor((b[3] - b[1]) / width) + 2)
+            for b in boxes
+        )
+        if estimate > max_cells * 4:
+            break
+        cells = set()
+        for box in boxes:
+            cells |= cells_for_box(*box, precision)
+        if len(cells) > max_cells:
+            break
+        best = cells
+    return best
+
+def radius_box(lat, lng, radius_m):
+    """(min_lat, min_lng, max_lat, max_lng) bounding a circle; min_lng > max_lng across the antimeridian"""
+    dlat = radius_m / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(lat))
+    dlng = 360.0 if cos_lat < 1e-6 else min(radius_m / (METERS_PER_DEGREE * cos_lat), 180.0)
+
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    if dlng >= 180.0:
+        box = (min_lat, -180.0, max_lat, 180.0)
+    else:
+        min_lng, max_lng = lng - dlng, lng + dlng
+        # Wrap across the antimeridian
+        if min_lng < -180:
+            min_lng += 360
+        if max_lng > 180:
+            max_lng -= 360
+        box = (min_lat, min_lng, max_lat, max_lng)
+    return box
+
+def cover_radius(lat, lng, radius_m, max_cells=32):
+    """Geohash prefixes covering a circle, plus its bounding box"""
+    box = radius_box(lat, lng, radius_m)
+    return cover_box(*box, max_cells=max_cells), box
+
+def prefix_range(prefix):
+    """Half-open string range [low, high) matching every geohash with a prefix"""
+    return prefix, prefix + '~'
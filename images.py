@@ -0,0 +1,147 @@
+"""
+Stop image pipeline
+Uploads are streamed to disk under their content hash, so identical images
+uploaded by different companies are stored once. Resized thumbnail and
+medium variants in WebP and JPEG are generated in a background worker pool.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Variants are skipped without Pillow; originals still work
+    Image = None
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+
+# Variant name -> longest edge in pixels
+VARIANT_SIZES = {
+    'thumb': 160,
+    'medium': 800,
+}
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+class ImageUploadError(ValueError):
+    """Raised for uploads that are not an accepted image type"""
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+
+def variant_filename(filename, variant, fmt):
+    return f"{filename.rsplit('.', 1)[0]}_{variant}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+def variant_filenames(filename):
+    return [variant_filename(filename, variant, fmt) for variant in VARIANT_SIZES for fmt in VARIANT_FORMATS]
+
+def save_upload(file, upload_folder):
+    """Stream an uploaded file to disk and return its content-addressed filename
+
+    Returns (filename, created) where created is False if the same image was
+    already stored.
+    """
+    extension = file_extension(file.filename)
+    if extension not in ALLOWED_EXTENSIONS:
+        raise ImageUploadError(f"Images must be one of: {', '.join(sorted(ALLOWED_EXTENSIONS))}")
+    extension = 'jpg' if extension == 'jpeg' else extension
+
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+
+        filename = f'{digest.hexdigest()}.{extension}'
+        path = os.path.join(upload_folder, filename)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return filename, False
+        os.replace(temp_path, path)
+        return filename, True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def generate_variants(upload_folder, filename):
+    """Write every missing resized variant of a stored image"""
+    if Image is None:
+        return []
+    written = []
+    with Image.open(os.path.join(upload_folder, filename)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+        for variant, size in VARIANT_SIZES.items():
+            resized = source.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            for fmt, (pil_format, options) in VARIANT_FORMATS.items():
+                path = os.path.join(upload_folder, variant_filename(filename, variant, fmt))
+                if os.path.exists(path):
+                    continue
+                image = resized.convert('RGB') if pil_format == 'JPEG' else resized
+                # Write then rename so readers never see a partial file
+                fd, temp_path = tempfile.mkstemp(dir=upload_folder, suffix='.part')
+                try:
+                    with os.fdopen(fd, 'wb') as out:
+                        image.save(out, pil_format, **options)
+                    os.replace(temp_path, path)
+                except BaseException:
+                    os.remove(temp_path)
+                    raise
+                written.append(path)
+    return written
+
+def variant_srcsets(upload_folder, filename, url_prefix):
+    """srcset strings per format for the variants that exist on disk"""
+    srcsets = {}
+    for fmt in VARIANT_FORMATS:
+        entries = []
+        for variant, size in VARIANT_SIZES.items():
+            name = variant_filename(filename, variant, fmt)
+            if os.path.exists(os.path.join(upload_folder, name)):
+                entries.append(f'{url_prefix}{name} {size}w')
+        if entries:
+            srcsets[fmt] = ', '.join(entries)
+    return srcsets
+
+def remove_image(upload_folder, filename):
+    """Delete a stored image and any variants"""
+    for name in [filename] + variant_filenames(filename):
+        path = os.path.join(upload_folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+class VariantWorker:
+    """Background pool that generates variants after the request has returned"""
+
+    def __init__(self, upload_folder, max_workers=2):
+        self.upload_folder = upload_folder
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-variants')
+
+    def submit(self, filename, on_complete=None):
+        def done(future):
+            if future.exception() is not None:
+                logger.warning('Could not generate variants for %s: %s', filename, future.exception())
+            elif on_complete:
+                on_complete()
+
+        future = self.executor.submit(generate_variants, self.upload_folder, filename)
+        future.add_done_callback(done)
+        return future
@@ -2,11 +2,19 @@
 """
 Database initialization script for Tourism Platform
 Creates tables and initial super admin user
+
+Run with --upgrade to bring an existing database up to the current schema
+(new tables, columns and indexes) without dropping any data.
 """
 
 from app import app, db, User, Company, Itinerary, Stop
 from werkzeug.security import generate_password_hash
+from sqlalchemy import bindparam, inspect, text
+from geo import geohash_encode
+import search
+import spatial
 from datetime import datetime, timedelta
+import sys
 
 def init_database():
     """Initialize database with tables and super admin user"""
@@ -24,7 +32,7 @@ def init_database():
         super_admin = User(
             username='admin@tourism.com',
             email='admin@tourism.com',
-            password_hash=generate_password_hash('admin123'),
+            password_hash=generate_password_hash('admin123', app.config['PASSWORD_HASH_METHOD']),
             first_name='Super',
             last_name='Admin',
             role='super_admin',
@@ -53,7 +61,7 @@ def init_database():
         demo_admin = User(
             username='demo@company.com',
             email='demo@company.com',
-            password_hash=generate_password_hash('demo123'),
+            password_hash=generate_password_hash('demo123', app.config['PASSWORD_HASH_METHOD']),
             first_name='Demo',
             last_name='Admin',
             role='admin',
@@ -151,5 +159,94 @@ def init_database():
         print("   Company Admin: http://127.0.0.1:5000/admin")
         print("="*60)
 
+def backfill_geohashes(batch_size=1000):
+    """Fill in the spatial index key for stops created before it existed"""
+    if 'geohash' not in {column['name'] for column in inspect(db.engine).get_columns('stop')}:
+        return
+    
+    updated = 0
+    while True:
+        rows = db.session.query(Stop.id, Stop.latitude, Stop.longitude).filter(
+            Stop.geohash.is_(None)
+        ).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(
+            Stop.__table__.update().where(Stop.__table__.c.id == bindparam('stop_id')),
+            [{'stop_id': row.id, 'geohash': geohash_encode(row.latitude, row.longitude)} for row in rows]
+        )
+        db.session.commit()
+        updated += len(rows)
+    if updated:
+        print(f"   + geohash for {updated} stops")
+
+def rebuild_search_index():
+    """Index every company, itinerary and stop for full-text search"""
+    with db.engine.begin() as conn:
+        if not search.enabled(conn):
+            return
+        search.rebuild(conn)
+        count = conn.execute(text('SELECT count(*) FROM search_index')).scalar()
+    print(f"   + search index with {count} entries")
+
+def rebuild_spatial_index():
+    """Index every stop's coordinates for near and bounding-box lookups"""
+    with db.engine.begin() as conn:
+        if not spatial.enabled(conn):
+            return
+        spatial.rebuild(conn)
+        count = conn.execute(text('SELECT count(*) FROM stop_rtree')).scalar()
+    print(f"   + spatial index with {count} entries")
+
+def upgrade_database():
+    """Add missing tables, columns and indexes to an existing database"""
+    
+    with app.app_context():
+        engine = db.engine
+        
+        print("🔄 Creating missing tables...")
+        db.create_all()
+        
+        inspector = inspect(engine)
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            missing_columns = set()
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if not column.nullable and default is None:
+                    print(f"⚠️  Cannot add required column {table.name}.{column.name} without a default; skipping")
+                    missing_columns.add(column.name)
+                    continue
+                
+                column_type = column.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                if default is not None:
+                    ddl += f" DEFAULT {int(default) if isinstance(default, bool) else repr(default)}"
+                with engine.begin() as conn:
+                    conn.execute(text(ddl))
+                print(f"   + column {table.name}.{column.name}")
+            
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing_indexes:
+                    continue
+                if missing_columns & {column.name for column in index.columns}:
+                    print(f"⚠️  Skipping index {index.name} on missing columns")
+                    continue
+                index.create(bind=engine)
+                print(f"   + index {index.name}")
+        
+        backfill_geohashes()
+        rebuild_search_index()
+        rebuild_spatial_index()
+        
+        print("✅ Database upgraded successfully!")
+
 if __name__ == '__main__':
-    init_database()
+    if '--upgrade' in sys.argv[1:]:
+        upgrade_database()
+    else:
+        init_database()
@@ -0,0 +1,264 @@
+"""
+Background jobs
+Slow admin work (bulk imports, deleting image files) is queued instead of
+run in the request thread. Jobs are rows in an SQLite file, so queued work
+survives a restart, and every process may run workers: a job is claimed
+with a lease that is renewed while it reports progress, and a job whose
+worker died is picked up again once its lease runs out.
+
+A failed job is retried with exponential backoff up to max_attempts;
+raising JobError fails it at once (for errors a retry cannot fix). Outcomes
+and progress are only recorded for the job's latest attempt, so a worker
+that stalled past its lease cannot overwrite the work of the one that took
+the job over.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from contextlib import closing, nullcontext
+
+# Seconds a claimed job stays reserved without a progress update
+LEASE_SECONDS = 300
+
+# Progress is written at most this often
+PROGRESS_INTERVAL = 0.5
+
+class JobError(Exception):
+    """Raised by a handler to fail a job without retrying"""
+
+class LeaseLost(Exception):
+    """Raised by Job.progress once another worker has reclaimed the job"""
+
+class Job:
+    """A claimed job as seen by its handler"""
+
+    def __init__(self, queue, row):
+        self.queue = queue
+        self.id = row['id']
+        self.kind = row['kind']
+        self.payload = json.loads(row['payload'])
+        self.attempt = row['attempts']
+        self.max_attempts = row['max_attempts']
+        self._reported = 0.0
+
+    def progress(self, done, total=None, message=None):
+        """Report progress and renew the lease; cheap to call often
+
+        Raises LeaseLost when the lease ran out and the job was claimed
+        again, so the handler stops instead of racing the new attempt.
+        """
+        now = time.monotonic()
+        if now - self._reported < PROGRESS_INTERVAL:
+            return
+        self._reported = now
+        if not self.queue._update(self.id, self.attempt, progress=done, total=total, message=message,
+                                  locked_until=time.time() + LEASE_SECONDS):
+            raise LeaseLost(f'Job {self.id} attempt {self.attempt} was reclaimed')
+
+class JobQueue:
+    """Persistent queue of jobs run by handler functions registered per kind"""
+
+    def __init__(self, path, workers=2, max_attempts=3, retry_delay=10.0, context=None, logger=None):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.context = context or nullcontext
+        self.logger = logger
+        self.handlers = {}
+        self.wakeup = threading.Condition()
+        self.threads = []
+        self.stopping = False
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS job ('
+                ' id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, owner TEXT,'
+                ' status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL,'
+                ' run_at REAL NOT NULL, locked_until REAL, progress INTEGER, total INTEGER, message TEXT,'
+                ' result TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_job_status_run_at ON job (status, run_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_job_kind_finished ON job (kind, status, finished_at)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return closing(conn)
+
+    def handler(self, kind):
+        """Decorator registering the function that runs jobs of a kind
+
+        The function gets a Job and returns a JSON-serializable result.
+        """
+        def register(function):
+            self.handlers[kind] = function
+            return function
+        return register
+
+    def enqueue(self, kind, payload, owner=None, max_attempts=None, unique=False):
+        """Queue a job; returns its id
+
+        With unique, the id of an unfinished job of the same kind and payload
+        is returned instead of queueing another one.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f'No handler for job kind: {kind}')
+        payload = json.dumps(payload, sort_keys=True)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT id FROM job WHERE kind = ? AND payload = ? AND status IN ('queued', 'running')",
+                (kind, payload)
+            ).fetchone() if unique else None
+            if row is not None:
+                conn.execute('COMMIT')
+                return row['id']
+            conn.execute(
+                'INSERT INTO job (id, kind, payload, owner, status, max_attempts, run_at, created_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, payload, None if owner is None else str(owner), 'queued',
+                 max_attempts or self.max_attempts, now, now)
+            )
+            conn.execute('COMMIT')
+        self.start()
+        with self.wakeup:
+            self.wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """A job's status as a dict, or None"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM job WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def latest(self, kind):
+        """The most recently finished successful job of a kind as a dict, or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id FROM job WHERE kind = ? AND status = 'done' ORDER BY finished_at DESC LIMIT 1", (kind,)
+            ).fetchone()
+        return self.get(row['id']) if row else None
+
+    def _update(self, job_id, attempt, **values):
+        """Set columns of a job's running attempt; returns False if that attempt was reclaimed"""
+        values = {key: value for key, value in values.items() if value is not None}
+        with self._connect() as conn:
+            return conn.execute(
+                f"UPDATE job SET {', '.join(f'{key} = ?' for key in values)}"
+                " WHERE id = ? AND attempts = ? AND status = 'running'",
+                (*values.values(), job_id, attempt)
+            ).rowcount > 0
+
+    def claim(self):
+        """Reserve the next due job, or a running one whose lease expired; returns a Job or None"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # A worker died during the job's last allowed attempt
+            conn.execute(
+                "UPDATE job SET status = 'failed', message = 'Worker stopped while running the job', finished_at = ?"
+                " WHERE status = 'running' AND locked_until < ? AND attempts >= max_attempts", (now, now)
+            )
+            row = conn.execute(
+                "SELECT * FROM job WHERE (status = 'queued' AND run_at <= ?)"
+                " OR (status = 'running' AND locked_until < ?) ORDER BY run_at LIMIT 1", (now, now)
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE job SET status = 'running', attempts = attempts + 1, locked_until = ?,"
+                " started_at = coalesce(started_at, ?) WHERE id = ?",
+                (now + LEASE_SECONDS, now, row['id'])
+            )
+            conn.execute('COMMIT')
+            row = dict(row, attempts=row['attempts'] + 1)
+        return Job(self, row)
+
+    def run(self, job):
+        """Run a claimed job and record its outcome"""
+        try:
+            with self.context():
+                result = self.handlers[job.kind](job)
+        except LeaseLost:
+            if self.logger:
+                self.logger.warning('Job %s (%s) attempt %d stopped: another worker took it over',
+                                    job.id, job.kind, job.attempt)
+            return
+        except Exception as e:
+            retry = not isinstance(e, JobError) and job.attempt < job.max_attempts
+            if self.logger and not isinstance(e, JobError):
+                self.logger.warning('Job %s (%s) attempt %d failed: %s', job.id, job.kind, job.attempt,
+                                    traceback.format_exc())
+            if retry:
+                recorded = self._update(job.id, job.attempt, status='queued', message=str(e),
+                                        run_at=time.time() + self.retry_delay * 2 ** (job.attempt - 1))
+            else:
+                recorded = self._update(job.id, job.attempt, status='failed', message=str(e),
+                                        finished_at=time.time())
+        else:
+            recorded = self._update(job.id, job.attempt, status='done', result=json.dumps(result),
+                                    finished_at=time.time())
+        if not recorded and self.logger:
+            self.logger.warning('Job %s (%s) attempt %d finished after another worker took it over',
+                                job.id, job.kind, job.attempt)
+
+    def work(self, poll_interval=2.0, until=None):
+        """Claim and run jobs until stopped (or until() is true)"""
+        while not self.stopping and not (until and until()):
+            try:
+                job = self.claim()
+            except sqlite3.OperationalError as e:
+                # Locked by another process for longer than the timeout
+                if self.logger:
+                    self.logger.warning('Could not claim a job: %s', e)
+                job = None
+            if job is None:
+                with self.wakeup:
+                    self.wakeup.wait(poll_interval)
+                continue
+            self.run(job)
+
+    def start(self):
+        """Start the worker threads of this process, once"""
+        with self.lock:
+            if self.threads or self.workers <= 0:
+                return
+            self.stopping = False
+            self.threads = [threading.Thread(target=self.work, name=f'jobs-{i}', daemon=True)
+                            for i in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+
+    def stop(self):
+        """Let worker threads finish their current job and exit"""
+        with self.lock:
+            threads, self.threads = self.threads, []
+            self.stopping = True
+        with self.wakeup:
+            self.wakeup.notify_all()
+        for thread in threads:
+            thread.join()
+
+    def prune(self, older_than):
+        """Delete finished jobs older than older_than seconds; returns how many"""
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM job WHERE status IN ('done', 'failed') AND finished_at < ?",
+                                (time.time() - older_than,)).rowcount
@@ -0,0 +1,496 @@
+"""
+Live updates for open map clients
+Admin writes publish small change events to a per-itinerary channel; every
+map that has the itinerary open receives them over a Server-Sent Events
+stream. The local broker fans events out inside one process; the SQLite
+broker relays them between the worker processes of one host through an
+event table. Another broker (e.g. on Redis pub/sub) only needs the same
+publish(), subscribe(), connection_count(), close_all() and reset() methods.
+
+Under `flask serve` a stream does not keep a request thread: the server
+hands the client's socket to a Fanout, which writes every stream of the
+process from one thread. stream() is the fallback for other servers (the
+development server), where each open stream blocks a thread between events.
+"""
+
+import json
+import os
+import secrets
+import selectors
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import closing
+
+# Milliseconds browsers wait before reconnecting a dropped stream
+RETRY_MS = 3000
+
+# Response head written by Fanout; the body ends when the connection closes
+STREAM_HEAD = (b'HTTP/1.1 200 OK\r\n'
+               b'Content-Type: text/event-stream; charset=utf-8\r\n'
+               b'Cache-Control: no-cache\r\n'
+               b'X-Accel-Buffering: no\r\n'
+               b'Connection: close\r\n\r\n')
+
+class Subscription:
+    """A client's mailbox of (event_id, event, data) messages on one channel"""
+
+    def __init__(self, broker, channel, max_pending):
+        self.broker = broker
+        self.channel = channel
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.last_id = None
+        self.overflowed = False
+        self.closed = False
+        # Called after a message arrives or the subscription closes
+        self.on_ready = None
+
+    def put(self, message):
+        with self.condition:
+            self.last_id = message[0]
+            if len(self.pending) >= self.max_pending:
+                # Too slow to keep up; drop the backlog and tell it to reload
+                self.pending.clear()
+                self.overflowed = True
+            else:
+                self.pending.append(message)
+            self.condition.notify()
+        if self.on_ready:
+            self.on_ready()
+
+    def get(self, timeout):
+        """Wait up to timeout seconds for messages; returns a possibly empty list"""
+        with self.condition:
+            if not self.pending and not self.overflowed and not self.closed:
+                self.condition.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                self.pending.clear()
+                return [(self.last_id, 'reset', {})]
+            messages = list(self.pending)
+            self.pending.clear()
+            return messages
+
+    def close(self):
+        """Unsubscribe; a stream waiting on the subscription ends"""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.broker.unsubscribe(self)
+        if self.on_ready:
+            self.on_ready()
+
+class LocalBroker:
+    """In-process pub/sub with a short replay history per channel
+
+    Event ids are '<epoch>-<sequence>' with a per-channel sequence. A
+    reconnecting client sends its last id back and gets the events it
+    missed, or a 'reset' when they are no longer in the history (or the
+    process restarted) and it has to reload.
+    """
+    name = 'local'
+
+    def __init__(self, history=100, max_pending=100):
+        self.history_size = history
+        self.max_pending = max_pending
+        self.epoch = secrets.token_hex(4)
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.history = {}
+        self.sequences = {}
+
+    def publish(self, channel, event, data):
+        """Send an event to every subscriber of a channel; returns its id"""
+        with self.lock:
+            sequence = self.sequences.get(channel, 0) + 1
+            self.sequences[channel] = sequence
+            message = (f'{self.epoch}-{sequence}', event, data)
+            self.history.setdefault(channel, deque(maxlen=self.history_size)).append((sequence, message))
+            subscribers = list(self.subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(message)
+        return message[0]
+
+    def subscribe(self, channel, last_event_id=None):
+        """Open a subscription, queueing anything missed since last_event_id"""
+        subscription = Subscription(self, channel, self.max_pending)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+            current = self.sequences.get(channel, 0)
+            subscription.last_id = f'{self.epoch}-{current}'
+            if last_event_id:
+                missed = self._missed(channel, last_event_id, current)
+                if missed is None:
+                    subscription.overflowed = True
+                else:
+                    subscription.pending.extend(missed)
+        return subscription
+
+    def _missed(self, channel, last_event_id, current):
+        epoch, _, sequence = last_event_id.partition('-')
+        if epoch != self.epoch or not sequence.isdigit() or int(sequence) > current:
+            return None
+        sequence = int(sequence)
+        history = self.history.get(channel, ())
+        if sequence < current and (not history or history[0][0] > sequence + 1):
+            return None
+        return [message for number, message in history if number > sequence]
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.channel]
+
+    def connection_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def close_all(self):
+        """End every open stream, e.g. when the worker is shutting down"""
+        with self.lock:
+            subscriptions = [s for subscribers in self.subscribers.values() for s in subscribers]
+        for subscription in subscriptions:
+            subscription.close()
+
+    def reset(self):
+        """Forget all channels and start a new epoch
+
+        A forked worker calls this so its event ids never collide with
+        another worker's; clients reconnecting across workers get a reset.
+        """
+        with self.lock:
+            self.epoch = secrets.token_hex(4)
+            self.subscribers.clear()
+            self.history.clear()
+            self.sequences.clear()
+
+class SQLiteBroker(LocalBroker):
+    """Pub/sub between the processes of one host through an SQLite event table
+
+    publish() appends a row; a thread in every process polls for new rows
+    and fans them out to that process's subscribers, waking at once for
+    events published in the same process. Event ids are row ids, shared by
+    all workers, so a client that reconnects to another worker still gets
+    the events it missed. Rows older than retention seconds are deleted.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, history=100, max_pending=100, poll_interval=0.25, retention=3600.0, logger=None):
+        super().__init__(history, max_pending)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.logger = logger
+        self.thread = None
+        self.last_seen = 0
+        self.published = threading.Event()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS event ('
+                ' id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, event TEXT NOT NULL,'
+                ' data TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_event_channel_id ON event (channel, id)')
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    def _start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            # Only events published from now on are relayed
+            with self._connect() as conn:
+                self.last_seen = conn.execute('SELECT coalesce(max(id), 0) FROM event').fetchone()[0]
+            self.thread = threading.Thread(target=self._poll, name='live-broker', daemon=True)
+            self.thread.start()
+
+    def publish(self, channel, event, data):
+        """Send an event to every subscriber of a channel in every process; returns its id"""
+        self._start()
+        with self._connect() as conn:
+            event_id = conn.execute(
+                'INSERT INTO event (channel, event, data, created_at) VALUES (?, ?, ?, ?)',
+                (channel, event, json.dumps(data, separators=(',', ':')), time.time())
+            ).lastrowid
+        self.published.set()
+        return str(event_id)
+
+    def _poll(self):
+        pruned_at = 0.0
+        while True:
+            self.published.wait(self.poll_interval)
+            self.published.clear()
+            try:
+                with self._connect() as conn:
+                    rows = conn.execute(
+                        'SELECT id, channel, event, data FROM event WHERE id > ? ORDER BY id LIMIT 1000',
+                        (self.last_seen,)
+                    ).fetchall()
+                    if time.monotonic() - pruned_at > 60:
+                        pruned_at = time.monotonic()
+                        conn.execute('DELETE FROM event WHERE created_at < ?', (time.time() - self.retention,))
+            except sqlite3.OperationalError as e:
+                # Locked by another process for longer than the timeout
+                if self.logger:
+                    self.logger.warning('Could not read live update events: %s', e)
+                continue
+            if len(rows) == 1000:
+                self.published.set()
+            
+            deliveries = []
+            with self.lock:
+                for event_id, channel, event, data in rows:
+                    if event_id <= self.last_seen:
+                        continue
+                    self.last_seen = event_id
+                    deliveries.append((list(self.subscribers.get(channel, ())),
+                                       (str(event_id), event, json.loads(data))))
+            for subscribers, message in deliveries:
+                for subscription in subscribers:
+                    subscription.put(message)
+
+    def subscribe(self, channel, last_event_id=None):
+        """Open a subscription, queueing anything missed since last_event_id"""
+        self._start()
+        subscription = Subscription(self, channel, self.max_pending)
+        with self.lock:
+            self.subscribers.setdefault(channel, set()).add(subscription)
+            subscription.last_id = str(self.last_seen)
+            if last_event_id:
+                missed = self._missed(channel, last_event_id, self.last_seen)
+                if missed is None:
+                    subscription.overflowed = True
+                else:
+                    subscription.pending.extend(missed)
+        return subscription
+
+    def _missed(self, channel, last_event_id, current):
+        if not last_event_id.isdigit() or int(last_event_id) > current:
+            return None
+        last = int(last_event_id)
+        with self._connect() as conn:
+            oldest = conn.execute('SELECT min(id) FROM event').fetchone()[0] or current + 1
+            if last < oldest - 1:
+                # Events after it may have been deleted
+                return None
+            rows = conn.execute(
+                'SELECT id, event, data FROM event WHERE channel = ? AND id > ? AND id <= ? ORDER BY id LIMIT ?',
+                (channel, last, current, self.history_size + 1)
+            ).fetchall()
+        if len(rows) > self.history_size:
+            return None
+        return [(str(event_id), event, json.loads(data)) for event_id, event, data in rows]
+
+    def reset(self):
+        """Forget this process's subscribers; the poller is restarted on first use"""
+        super().reset()
+        self.thread = None
+        self.published = threading.Event()
+
+BROKERS = {
+    LocalBroker.name: LocalBroker,
+    SQLiteBroker.name: SQLiteBroker,
+}
+
+def create_broker(name, **options):
+    """Instantiate a broker by its configured name"""
+    if name not in BROKERS:
+        raise ValueError(f'Unknown live update broker: {name}')
+    return BROKERS[name](**options)
+
+def format_event(event_id, event, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
+
+def stream(subscription, heartbeat=15.0, lifetime=300.0):
+    """SSE text for a subscription until the client goes away or lifetime ends
+
+    Comments are sent while idle so proxies keep the connection open and a
+    closed client is noticed. Ending after lifetime makes browsers reconnect
+    (resuming from their last event id), which spreads long-lived streams
+    across workers.
+    """
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        deadline = time.monotonic() + lifetime
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            messages = subscription.get(min(heartbeat, remaining))
+            if subscription.closed:
+                return
+            if messages:
+                yield ''.join(format_event(*message) for message in messages)
+            else:
+                yield ': keepalive\n\n'
+    finally:
+        subscription.close()
+
+class Connection:
+    """A client socket streamed by a Fanout"""
+
+    def __init__(self, sock, subscription, deadline, heartbeat_at):
+        self.sock = sock
+        self.subscription = subscription
+        self.deadline = deadline
+        self.heartbeat_at = heartbeat_at
+        self.buffer = bytearray()
+        self.events = selectors.EVENT_READ
+        self.closed = False
+
+class Fanout:
+    """Writes the SSE streams of many client sockets from a single thread
+
+    An open stream costs a selector entry and a small buffer instead of a
+    thread. Events are written as they are published, comments keep idle
+    connections open, and a connection ends when the client goes away, its
+    lifetime is over or its subscription is closed. A client whose unsent
+    events exceed max_buffer is dropped; it reconnects and resumes from its
+    last event id.
+    """
+
+    def __init__(self, heartbeat=15.0, lifetime=300.0, max_buffer=64 * 1024):
+        self.heartbeat = heartbeat
+        self.lifetime = lifetime
+        self.max_buffer = max_buffer
+        self.lock = threading.Lock()
+        self.thread = None
+        self.added = []
+        self.ready = set()
+        self.signalled = False
+
+    def add(self, sock, subscription):
+        """Take over a client socket and stream a subscription's events to it"""
+        try:
+            sock.sendall(STREAM_HEAD + f'retry: {RETRY_MS}\n\n'.encode('ascii'))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            subscription.close()
+            return
+        now = time.monotonic()
+        connection = Connection(sock, subscription, now + self.lifetime, now + self.heartbeat)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                # Made in the process that streams, never inherited across fork()
+                self.selector = selectors.DefaultSelector()
+                self.waker, self.wake_socket = socket.socketpair()
+                self.waker.setblocking(False)
+                self.wake_socket.setblocking(False)
+                self.selector.register(self.waker, selectors.EVENT_READ)
+                self.connections = set()
+                self.signalled = False
+                self.thread = threading.Thread(target=self._run, name='live-fanout', daemon=True)
+                self.thread.start()
+            self.added.append(connection)
+        subscription.on_ready = lambda: self._wake(connection)
+        self._wake(connection)
+
+    def _wake(self, connection):
+        with self.lock:
+            self.ready.add(connection)
+            if self.signalled:
+                return
+            self.signalled = True
+        try:
+            self.wake_socket.send(b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        next_sweep = 0.0
+        while True:
+            for key, mask in self.selector.select(1.0):
+                connection = key.data
+                if connection is None:
+                    try:
+                        self.waker.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                if mask & selectors.EVENT_READ and not self._read(connection):
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(connection)
+            
+            with self.lock:
+                added, self.added = self.added, []
+                ready, self.ready = self.ready, set()
+                self.signalled = False
+            for connection in added:
+                self.selector.register(connection.sock, selectors.EVENT_READ, connection)
+                self.connections.add(connection)
+            for connection in ready:
+                if connection.closed:
+                    continue
+                messages = connection.subscription.get(0)
+                if connection.subscription.closed:
+                    self._close(connection)
+                elif messages:
+                    connection.buffer += ''.join(format_event(*message) for message in messages).encode('utf-8')
+                    self._flush(connection)
+            
+            now = time.monotonic()
+            if now >= next_sweep:
+                next_sweep = now + 1.0
+                for connection in list(self.connections):
+                    if now >= connection.deadline:
+                        self._close(connection)
+                    elif now >= connection.heartbeat_at:
+                        connection.buffer += b': keepalive\n\n'
+                        self._flush(connection)
+
+    def _read(self, connection):
+        """Discard anything the client sends; returns False once it has gone away"""
+        try:
+            if connection.sock.recv(4096):
+                return True
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self._close(connection)
+        return False
+
+    def _flush(self, connection):
+        try:
+            sent = connection.sock.send(connection.buffer) if connection.buffer else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close(connection)
+            return
+        del connection.buffer[:sent]
+        if sent:
+            connection.heartbeat_at = time.monotonic() + self.heartbeat
+        if len(connection.buffer) > self.max_buffer:
+            self._close(connection)
+            return
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if connection.buffer else selectors.EVENT_READ
+        if events != connection.events:
+            self.selector.modify(connection.sock, events, connection)
+            connection.events = events
+
+    def _close(self, connection):
+        if connection.closed:
+            return
+        connection.closed = True
+        self.connections.discard(connection)
+        self.selector.unregister(connection.sock)
+        connection.sock.close()
+        connection.subscription.on_ready = None
+        connection.subscription.close()
@@ -0,0 +1,146 @@
+"""
+Request and database metrics
+Per-endpoint request counts and latency histograms, SQL query counts and
+time per request, and slow-query counts, rendered in the Prometheus text
+format. Metrics are kept per process; scrape every worker, or put them
+behind a single worker when running several.
+"""
+
+import bisect
+import threading
+import time
+
+from markupsafe import escape
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Statements kept per request for the debug toolbar
+TOOLBAR_MAX_QUERIES = 200
+
+class Histogram:
+    """Cumulative-bucket histogram per label tuple"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts = self.series.get(labels)
+        if counts is None:
+            # One counter per bucket plus +Inf, then the sum and the count
+            counts = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+    def samples(self, name, label_names):
+        for labels, counts in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{name}_bucket', label_names + ('le',), labels + (str(bound),), cumulative
+            yield f'{name}_sum', label_names, labels, counts[-2]
+            yield f'{name}_count', label_names, labels, counts[-1]
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    def quote(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{quote(value)}"' for name, value in zip(names, values)) + '}'
+
+class RequestStats:
+    """Timings collected while one request is handled"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.queries = []
+
+    def add_query(self, statement, seconds):
+        self.query_count += 1
+        self.query_seconds += seconds
+        if len(self.queries) < TOOLBAR_MAX_QUERIES:
+            self.queries.append((seconds, statement))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+class Metrics:
+    """Process-wide registry of request and query metrics"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.query_counts = Histogram(QUERY_COUNT_BUCKETS)
+        self.query_seconds = {}
+        self.slow_queries = {}
+        self.gauges = []
+
+    def record_request(self, endpoint, method, status, stats):
+        seconds = stats.elapsed()
+        with self.lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.observe((endpoint,), seconds)
+            self.query_counts.observe((endpoint,), stats.query_count)
+            self.query_seconds[(endpoint,)] = self.query_seconds.get((endpoint,), 0.0) + stats.query_seconds
+
+    def record_slow_query(self, endpoint):
+        with self.lock:
+            self.slow_queries[(endpoint,)] = self.slow_queries.get((endpoint,), 0) + 1
+
+    def add_gauge(self, name, help_text, callback):
+        """Report callback()'s value at each scrape"""
+        self.gauges.append((name, help_text, callback))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        families = []
+        with self.lock:
+            families.append(('http_requests_total', 'counter', 'Requests handled, by endpoint, method and status',
+                             [('http_requests_total', ('endpoint', 'method', 'status'), key, value)
+                              for key, value in sorted(self.requests.items())]))
+            families.append(('http_request_duration_seconds', 'histogram', 'Time to build a response, by endpoint',
+                             list(self.latency.samples('http_request_duration_seconds', ('endpoint',)))))
+            families.append(('db_queries_per_request', 'histogram', 'SQL statements run per request, by endpoint',
+                             list(self.query_counts.samples('db_queries_per_request', ('endpoint',)))))
+            families.append(('db_query_seconds_total', 'counter', 'Time spent in SQL statements, by endpoint',
+                             [('db_query_seconds_total', ('endpoint',), key, value)
+                              for key, value in sorted(self.query_seconds.items())]))
+            families.append(('db_slow_queries_total', 'counter', 'SQL statements slower than the slow query threshold',
+                             [('db_slow_queries_total', ('endpoint',), key, value)
+                              for key, value in sorted(self.slow_queries.items())]))
+        for name, help_text, callback in self.gauges:
+            families.append((name, 'gauge', help_text, [(name, (), (), callback())]))
+
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample, label_names, labels, value in samples:
+                lines.append(f'{sample}{format_labels(label_names, labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+def toolbar_html(stats, endpoint, slow_seconds):
+    """A fixed bar with the request's timing and its SQL statements, slowest first"""
+    rows = ''.join(
+        f'<tr class="{"table-warning" if seconds >= slow_seconds else ""}">'
+        f'<td class="text-end text-nowrap">{seconds * 1000:.1f} ms</td>'
+        f'<td><code class="small">{escape(statement)}</code></td></tr>'
+        for seconds, statement in sorted(stats.queries, reverse=True)
+    )
+    more = stats.query_count - len(stats.queries)
+    return (
+        '<div id="debugToolbar" class="position-fixed bottom-0 end-0 m-2 small" style="z-index: 2000; max-width: 60%;">'
+        '<details class="bg-dark text-light rounded shadow p-2">'
+        f'<summary>{escape(endpoint)} &middot; {stats.elapsed() * 1000:.0f} ms &middot; '
+        f'{stats.query_count} queries ({stats.query_seconds * 1000:.0f} ms)</summary>'
+        '<div style="max-height: 50vh; overflow: auto;">'
+        f'<table class="table table-sm table-dark mb-0">{rows}</table>'
+        + (f'<div class="text-muted">{more} more not shown</div>' if more > 0 else '')
+        + '</div></details></div>'
+    )
@@ -0,0 +1,92 @@
+"""
+Password hashing and login throttling
+Hashes are computed on a small, bounded thread pool: hashlib's KDFs release
+the GIL, so the pool caps how many cores login traffic can take, and when
+its queue is full new attempts are turned away instead of piling up behind
+it. Stored hashes made with other parameters than the configured method
+are upgraded the next time their owner logs in.
+
+Attempts are throttled before any hash is computed, with token buckets per
+client address and per email. Buckets are kept per process.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full"""
+
+class PasswordHasher:
+    """Hashes and verifies passwords with a configured Werkzeug method"""
+
+    def __init__(self, method, max_workers=2, max_pending=32, timeout=10.0):
+        self.method = method
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._prefix = None
+
+    def _run(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HasherBusy('Too many password checks in progress')
+        try:
+            future = self.executor.submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda future: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise HasherBusy('Password check timed out')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with other parameters than the configured method"""
+        if self._prefix is None:
+            # Werkzeug expands defaults ('scrypt' -> 'scrypt:32768:8:1'); hash once to learn them
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+class RateLimiter:
+    """Token buckets of `burst` attempts refilled at `per_minute` per key"""
+
+    def __init__(self, per_minute, burst=None, max_keys=100000):
+        self.rate = per_minute / 60.0
+        self.burst = float(burst or per_minute)
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.pruned_at = 0.0
+
+    def take(self, key):
+        """Spend one token for key; returns 0 when allowed, else seconds until a token is available"""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self.buckets[key] = (tokens - 1, now)
+            if len(self.buckets) > self.max_keys and now - self.pruned_at > 1.0:
+                self._prune(now)
+        return 0
+
+    def _prune(self, now):
+        # A bucket that has refilled is the same as no bucket
+        self.pruned_at = now
+        full_after = self.burst / self.rate
+        for key, (tokens, updated) in list(self.buckets.items()):
+            if now - updated >= full_after:
+                del self.buckets[key]
@@ -0,0 +1,344 @@
+"""
+Route geometry service for itinerary maps
+Computes road segments between consecutive stops on the server and keeps
+them in an on-disk cache so each stop pair is only routed once. Geometries
+are stored as encoded polylines, pre-simplified for each zoom tier
+"""
+
+import json
+import math
+import os
+import sqlite3
+import time
+import urllib.request
+
+from geo import haversine_m
+
+# Average speeds (metres per second) used to estimate straight-line durations
+PROFILE_SPEEDS = {
+    'driving': 40 * 1000 / 3600,
+    'walking': 5 * 1000 / 3600,
+}
+PROFILES = tuple(PROFILE_SPEEDS)
+
+# Zoom tiers as (highest Leaflet zoom in tier, simplification tolerance in
+# degrees). Tolerances are roughly one screen pixel at the tier's top zoom;
+# the last tier keeps the full geometry.
+ZOOM_TIERS = (
+    (8, 0.005),
+    (12, 0.0003),
+    (15, 0.00002),
+    (None, 0.0),
+)
+
+def encode_polyline(coordinates, precision=5):
+    """Encode [lng, lat] pairs with the Google encoded polyline algorithm"""
+    factor = 10 ** precision
+    parts = []
+    prev_lat = prev_lng = 0
+    for lng, lat in coordinates:
+        lat = int(round(lat * factor))
+        lng = int(round(lng * factor))
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                parts.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            parts.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return ''.join(parts)
+
+def decode_polyline(encoded, precision=5):
+    """Decode a Google encoded polyline back into [lng, lat] pairs"""
+    factor = 10 ** precision
+    coordinates = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coordinates.append([lng / factor, lat / factor])
+    return coordinates
+
+def simplify(coordinates, tolerance):
+    """Douglas-Peucker simplification of a line of [lng, lat] pairs"""
+    if tolerance <= 0 or len(coordinates) < 3:
+        return list(coordinates)
+
+    keep = [False] * len(coordinates)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coordinates) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = coordinates[first]
+        x2, y2 = coordinates[last]
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+
+        max_dist = 0.0
+        max_index = first
+        for i in range(first + 1, last):
+            x, y = coordinates[i]
+            if length == 0:
+                dist = math.hypot(x - x1, y - y1)
+            else:
+                dist = abs(dy * x - dx * y + x2 * y1 - y2 * x1) / length
+            if dist > max_dist:
+                max_dist = dist
+                max_index = i
+
+        if max_dist > tolerance:
+            keep[max_index] = True
+            stack.append((first, max_index))
+            stack.append((max_index, last))
+
+    return [point for point, kept in zip(coordinates, keep) if kept]
+
+def tier_for_zoom(zoom):
+    """Index into ZOOM_TIERS for a Leaflet zoom level"""
+    for index, (max_zoom, _) in enumerate(ZOOM_TIERS):
+        if max_zoom is None or zoom <= max_zoom:
+            return index
+    return len(ZOOM_TIERS) - 1
+
+def tier_zoom_range(tier):
+    """(min_zoom, max_zoom) covered by a tier; max_zoom is None for the last"""
+    min_zoom = ZOOM_TIERS[tier - 1][0] + 1 if tier > 0 else 0
+    return min_zoom, ZOOM_TIERS[tier][0]
+
+def compact_segment(segment):
+    """Replace raw coordinates with encoded polylines for every zoom tier"""
+    if 'polylines' in segment:
+        return segment
+    coordinates = segment['coordinates']
+    compact = {key: value for key, value in segment.items() if key != 'coordinates'}
+    compact['polylines'] = [encode_polyline(simplify(coordinates, tolerance))
+                            for _, tolerance in ZOOM_TIERS]
+    return compact
+
+class RoutingError(Exception):
+    """Raised by a router backend when it cannot produce a segment"""
+
+class StraightLineRouter:
+    """Offline backend: a direct line with a speed-based duration estimate"""
+    name = 'straight'
+
+    def route(self, profile, start, end):
+        distance = haversine_m(start[0], start[1], end[0], end[1])
+        return {
+            'coordinates': [[start[1], start[0]], [end[1], end[0]]],
+            'distance': distance,
+            'duration': distance / PROFILE_SPEEDS[profile],
+            'fallback': True
+        }
+
+class OSRMRouter:
+    """Road routing through an OSRM HTTP server"""
+    name = 'osrm'
+
+    def __init__(self, base_url='https://router.project-osrm.org', timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def route(self, profile, start, end):
+        url = (f"{self.base_url}/route/v1/{profile}/"
+               f"{start[1]},{start[0]};{end[1]},{end[0]}?overview=full&geometries=geojson")
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                data = json.load(response)
+        except (OSError, ValueError) as e:
+            raise RoutingError(str(e))
+
+        if not data.get('routes'):
+            raise RoutingError(data.get('message', 'No route found'))
+
+        route = data['routes'][0]
+        return {
+            'coordinates': route['geometry']['coordinates'],
+            'distance': route['distance'],
+            'duration': route['duration'],
+            'fallback': False
+        }
+
+ROUTERS = {
+    StraightLineRouter.name: StraightLineRouter,
+    OSRMRouter.name: OSRMRouter,
+}
+
+def create_router(name, **options):
+    """Instantiate a router backend by its configured name"""
+    if name not in ROUTERS:
+        raise ValueError(f'Unknown router backend: {name}')
+    return ROUTERS[name](**options)
+
+class SegmentCache:
+    """SQLite-backed store of routed segments keyed by (router, profile, start, end)"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS segment ('
+                ' router TEXT NOT NULL, profile TEXT NOT NULL,'
+                ' start_lat REAL NOT NULL, start_lng REAL NOT NULL,'
+                ' end_lat REAL NOT NULL, end_lng REAL NOT NULL,'
+                ' data TEXT NOT NULL,'
+                ' PRIMARY KEY (router, profile, start_lat, start_lng, end_lat, end_lng))'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def key(router, profile, start, end):
+        # Round to ~10 cm so float noise from forms doesn't defeat the cache
+        return (router, profile,
+                round(start[0], 6), round(start[1], 6),
+                round(end[0], 6), round(end[1], 6))
+
+    def get_many(self, keys):
+        """Return a dict of the cached segments for the given keys"""
+        found = {}
+        with self._connect() as conn:
+            for key in keys:
+                row = conn.execute(
+                    'SELECT data FROM segment WHERE router = ? AND profile = ? AND start_lat = ?'
+                    ' AND start_lng = ? AND end_lat = ? AND end_lng = ?', key
+                ).fetchone()
+                if row:
+                    found[key] = json.loads(row[0])
+        return found
+
+    def put_many(self, items):
+        """Store (key, segment) pairs"""
+        if not items:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO segment VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [key + (json.dumps(segment),) for key, segment in items]
+            )
+
+class RouteService:
+    """Builds whole-itinerary routes from cached or freshly routed segments
+
+    When the router fails, it is skipped for retry_after seconds and
+    straight lines are served in its place, so an unreachable router costs
+    one timeout per period instead of one per uncached segment. Fallback
+    segments are never cached.
+    """
+
+    def __init__(self, router, cache, retry_after=60.0):
+        self.router = router
+        self.cache = cache
+        self.fallback = StraightLineRouter()
+        self.retry_after = retry_after
+        self.unavailable_until = 0.0
+
+    def router_available(self):
+        return time.monotonic() >= self.unavailable_until
+
+    def _route(self, profile, start, end):
+        """A segment from the router, or a fallback one while it is failing"""
+        if self.router_available():
+            try:
+                return compact_segment(self.router.route(profile, start, end)), True
+            except RoutingError:
+                self.unavailable_until = time.monotonic() + self.retry_after
+        return compact_segment(self.fallback.route(profile, start, end)), False
+
+    def segments(self, profile, points, progress=None):
+        """Route every consecutive pair of (lat, lng) points
+
+        progress(done, total) is called after each pair, so a caller routing
+        long itineraries can show it and keep its job's lease.
+        """
+        pairs = list(zip(points, points[1:]))
+        keys = [SegmentCache.key(self.router.name, profile, start, end) for start, end in pairs]
+        cached = self.cache.get_many(set(keys))
+
+        result = []
+        fresh = []
+        for key, (start, end) in zip(keys, pairs):
+            segment = cached.get(key)
+            if segment is None:
+                segment, routed = self._route(profile, start, end)
+                if routed:
+                    fresh.append((key, segment))
+                cached[key] = segment
+            elif 'polylines' not in segment:
+                # Entry written before geometries were stored encoded
+                segment = compact_segment(segment)
+                fresh.append((key, segment))
+                cached[key] = segment
+            result.append(segment)
+            if progress:
+                progress(len(result), len(pairs))
+
+        self.cache.put_many(fresh)
+        return result
+
+    def build_route(self, profile, points, tier=None):
+        """Return the route through the points as a GeoJSON FeatureCollection
+
+        Geometries are the full-detail line unless a zoom tier is given.
+        """
+        tier = len(ZOOM_TIERS) - 1 if tier is None else tier
+        features = []
+        for index, segment in enumerate(self.segments(profile, points)):
+            features.append({
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'LineString',
+                    'coordinates': decode_polyline(segment['polylines'][tier])
+                },
+                'properties': {
+                    'segment': index,
+                    'distance': segment['distance'],
+                    'duration': segment['duration'],
+                    'fallback': segment['fallback']
+                }
+            })
+        return {
+            'type': 'FeatureCollection',
+            'features': features,
+            'properties': {
+                'profile': profile,
+                'distance': sum(f['properties']['distance'] for f in features),
+                'duration': sum(f['properties']['duration'] for f in features)
+            }
+        }
+
+    def build_encoded_route(self, profile, points, tier):
+        """Return the route with each segment as an encoded polyline for one zoom tier"""
+        segments = []
+        for segment in self.segments(profile, points):
+            segments.append({
+                'polyline': segment['polylines'][tier],
+                'distance': segment['distance'],
+                'duration': segment['duration'],
+                'fallback': segment['fallback']
+            })
+        min_zoom, max_zoom = tier_zoom_range(tier)
+        return {
+            'profile': profile,
+            'tier': tier,
+            'min_zoom': min_zoom,
+            'max_zoom': max_zoom,
+            'segments': segments,
+            'distance': sum(s['distance'] for s in segments),
+            'duration': sum(s['duration'] for s in segments)
+        }
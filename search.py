@@ -0,0 +1,223 @@
+"""
+Full-text search over companies, itineraries and stops
+An SQLite FTS5 table holds one row per searchable record. Triggers on the
+source tables keep it in sync on every write, including bulk imports that
+bypass the ORM. Rows are keyed by rowid = id * 4 + kind, so a changed
+record is replaced by rowid instead of scanning the index.
+"""
+
+import re
+import weakref
+
+from markupsafe import escape
+from sqlalchemy import DDL, event, text
+
+COMPANY = 1
+ITINERARY = 2
+STOP = 3
+
+# Column weights for bm25(): title, body, context
+WEIGHTS = (10.0, 3.0, 1.0)
+
+MAX_TERMS = 8
+
+# Snippet highlight markers, replaced by <mark> after HTML escaping
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+# Title is the record's name, body its description (company email for
+# companies) and context the names of its parents: the company for an
+# itinerary, the itinerary and company for a stop
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body, context,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )""",
+
+    """CREATE TRIGGER IF NOT EXISTS search_company_insert AFTER INSERT ON company BEGIN
+        INSERT INTO search_index(rowid, title, body, context)
+        VALUES (NEW.id * 4 + 1, NEW.name, NEW.email, coalesce(NEW.city, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_company_update AFTER UPDATE OF name, email, city ON company BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 1;
+        INSERT INTO search_index(rowid, title, body, context)
+        VALUES (NEW.id * 4 + 1, NEW.name, NEW.email, coalesce(NEW.city, ''));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_company_rename AFTER UPDATE OF name ON company
+    WHEN OLD.name IS NOT NEW.name BEGIN
+        UPDATE search_index SET context = NEW.name
+        WHERE rowid IN (SELECT id * 4 + 2 FROM itinerary WHERE company_id = NEW.id);
+        UPDATE search_index SET context = (
+            SELECT itinerary.name || ' ' || NEW.name FROM stop JOIN itinerary ON itinerary.id = stop.itinerary_id
+            WHERE stop.id = search_index.rowid / 4
+        )
+        WHERE rowid IN (
+            SELECT stop.id * 4 + 3 FROM stop JOIN itinerary ON itinerary.id = stop.itinerary_id
+            WHERE itinerary.company_id = NEW.id
+        );
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_company_delete AFTER DELETE ON company BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 1;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS search_itinerary_insert AFTER INSERT ON itinerary BEGIN
+        INSERT INTO search_index(rowid, title, body, context)
+        SELECT NEW.id * 4 + 2, NEW.name, coalesce(NEW.description, ''), company.name
+        FROM company WHERE company.id = NEW.company_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_itinerary_update AFTER UPDATE OF name, description, company_id ON itinerary BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 2;
+        INSERT INTO search_index(rowid, title, body, context)
+        SELECT NEW.id * 4 + 2, NEW.name, coalesce(NEW.description, ''), company.name
+        FROM company WHERE company.id = NEW.company_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_itinerary_rename AFTER UPDATE OF name, company_id ON itinerary
+    WHEN OLD.name IS NOT NEW.name OR OLD.company_id IS NOT NEW.company_id BEGIN
+        UPDATE search_index SET context = (
+            SELECT NEW.name || ' ' || company.name FROM company WHERE company.id = NEW.company_id
+        )
+        WHERE rowid IN (SELECT id * 4 + 3 FROM stop WHERE itinerary_id = NEW.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_itinerary_delete AFTER DELETE ON itinerary BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 2;
+    END""",
+
+    """CREATE TRIGGER IF NOT EXISTS search_stop_insert AFTER INSERT ON stop BEGIN
+        INSERT INTO search_index(rowid, title, body, context)
+        SELECT NEW.id * 4 + 3, NEW.name, coalesce(NEW.description, ''), itinerary.name || ' ' || company.name
+        FROM itinerary JOIN company ON company.id = itinerary.company_id
+        WHERE itinerary.id = NEW.itinerary_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_stop_update AFTER UPDATE OF name, description, itinerary_id ON stop BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 3;
+        INSERT INTO search_index(rowid, title, body, context)
+        SELECT NEW.id * 4 + 3, NEW.name, coalesce(NEW.description, ''), itinerary.name || ' ' || company.name
+        FROM itinerary JOIN company ON company.id = itinerary.company_id
+        WHERE itinerary.id = NEW.itinerary_id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS search_stop_delete AFTER DELETE ON stop BEGIN
+        DELETE FROM search_index WHERE rowid = OLD.id * 4 + 3;
+    END""",
+]
+
+REBUILD = [
+    "DELETE FROM search_index",
+    """INSERT INTO search_index(rowid, title, body, context)
+       SELECT id * 4 + 1, name, email, coalesce(city, '') FROM company""",
+    """INSERT INTO search_index(rowid, title, body, context)
+       SELECT itinerary.id * 4 + 2, itinerary.name, coalesce(itinerary.description, ''), company.name
+       FROM itinerary JOIN company ON company.id = itinerary.company_id""",
+    """INSERT INTO search_index(rowid, title, body, context)
+       SELECT stop.id * 4 + 3, stop.name, coalesce(stop.description, ''), itinerary.name || ' ' || company.name
+       FROM stop JOIN itinerary ON itinerary.id = stop.itinerary_id JOIN company ON company.id = itinerary.company_id""",
+    "INSERT INTO search_index(search_index) VALUES ('optimize')",
+]
+
+def register(metadata):
+    """Create the index and triggers with create_all() and drop them with drop_all() on SQLite"""
+    for statement in SCHEMA:
+        event.listen(metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(metadata, 'before_drop', DDL('DROP TABLE IF EXISTS search_index').execute_if(dialect='sqlite'))
+
+# Engines whose database is known to have the FTS5 index
+indexed_engines = weakref.WeakSet()
+
+def enabled(connection):
+    """Whether the FTS5 index can be queried
+
+    False on other databases and on SQLite files that have not been through
+    create_all() or init_db.py --upgrade since it was added, so callers fall
+    back instead of failing. A missing table is looked up again on each call.
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    if connection.engine in indexed_engines:
+        return True
+    if connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+    )).first() is None:
+        return False
+    indexed_engines.add(connection.engine)
+    return True
+
+def rebuild(connection):
+    """Repopulate the whole index from the source tables"""
+    for statement in REBUILD:
+        connection.execute(text(statement))
+
+def query_words(query):
+    # Single characters would match most of the index
+    return [word for word in re.findall(r'\w+', query.lower()) if len(word) > 1][:MAX_TERMS]
+
+def match_expression(query):
+    """Turn free text into an FTS5 query matching every word as a prefix
+
+    Returns an empty string when the text has no searchable words.
+    """
+    return ' '.join(f'"{word}"*' for word in query_words(query))
+
+def own_text_expression(expression):
+    """FTS5 query for records with at least one of the words in their own name or description"""
+    return '{title body} : (' + ' OR '.join(expression.split(' ')) + ')'
+
+def highlight(snippet):
+    """HTML-escape an FTS snippet and turn its match markers into <mark> tags"""
+    return str(escape(snippet)).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+def search_public(connection, query, limit, offset=0):
+    """Ranked itinerary and stop matches from active itineraries of active companies
+
+    Returns rows with kind, ref, snippet and the itinerary, company and stop
+    columns needed to render a result.
+    """
+    return connection.execute(text(f"""
+        SELECT search_index.rowid % 4 AS kind,
+               search_index.rowid / 4 AS ref,
+               snippet(search_index, -1, :mark_start, :mark_end, '…', 12) AS snippet,
+               itinerary.id AS itinerary_id,
+               itinerary.name AS itinerary_name,
+               itinerary.description AS itinerary_description,
+               company.name AS company_name,
+               stop.name AS stop_name,
+               stop.latitude AS latitude,
+               stop.longitude AS longitude,
+               stop.day_number AS day_number
+        FROM search_index
+        LEFT JOIN stop ON search_index.rowid % 4 = {STOP} AND stop.id = search_index.rowid / 4
+        JOIN itinerary ON itinerary.id = CASE search_index.rowid % 4
+            WHEN {ITINERARY} THEN search_index.rowid / 4 ELSE stop.itinerary_id END
+        JOIN company ON company.id = itinerary.company_id
+        WHERE search_index MATCH :query
+          AND (search_index.rowid % 4 = {ITINERARY} OR (
+              -- Stops must match in their own text, not only through their itinerary's name
+              search_index.rowid % 4 = {STOP} AND search_index.rowid IN (
+                  SELECT rowid FROM search_index WHERE search_index MATCH :own_text
+              )
+          ))
+          AND itinerary.is_active = 1 AND company.is_active = 1
+        ORDER BY bm25(search_index, {', '.join(map(str, WEIGHTS))})
+        LIMIT :limit OFFSET :offset
+    """), {
+        'query': query, 'own_text': own_text_expression(query), 'limit': limit, 'offset': offset,
+        'mark_start': MARK_START, 'mark_end': MARK_END,
+    }).all()
+
+def search_companies(connection, query, limit, offset=0, is_active=None, plan=None):
+    """Ids of companies matching a query, best match first
+
+    is_active and plan filter the matches before the page is cut, so every
+    page is full until the matches run out.
+    """
+    filters = ''
+    if is_active is not None:
+        filters += ' AND company.is_active = :is_active'
+    if plan:
+        filters += ' AND company.subscription_plan = :plan'
+    return [row.ref for row in connection.execute(text(f"""
+        SELECT search_index.rowid / 4 AS ref FROM search_index
+        JOIN company ON company.id = search_index.rowid / 4
+        WHERE search_index MATCH :query AND search_index.rowid % 4 = {COMPANY}{filters}
+        ORDER BY bm25(search_index, {', '.join(map(str, WEIGHTS))})
+        LIMIT :limit OFFSET :offset
+    """), {'query': query, 'limit': limit, 'offset': offset, 'is_active': is_active, 'plan': plan})]
@@ -0,0 +1,235 @@
+"""
+Production server
+Runs the app in several pre-forked worker processes that share one
+listening socket, so a host uses all its cores. The app is imported and its
+caches are warmed once in the master before forking; workers start with
+those pages already in memory and only reopen what must not be shared
+(database connections) in a post-fork hook. Each worker serves requests on
+threads with the Werkzeug server, so no extra dependency is needed.
+
+SIGTERM or SIGINT stops the server gracefully: workers stop accepting,
+finish the requests in flight and exit; any still busy after the graceful
+timeout are killed. Workers that die are replaced.
+
+Long-lived responses need not hold a request thread: the app may take a
+connection over with environ[DETACH]() and serve it elsewhere (live map
+streams are written by one thread per worker this way).
+
+On platforms without fork() (Windows) a single threaded process is run.
+"""
+
+import io
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import ClosingIterator
+
+# A worker that dies sooner than this after starting counts as crashing;
+# respawns are then slowed down instead of forking in a tight loop
+MIN_WORKER_LIFETIME = 5.0
+MAX_RESPAWN_DELAY = 30.0
+
+# WSGI environ key of a callable handing the client socket over to the app
+DETACH = 'server.detach'
+
+class Discard(io.RawIOBase):
+    """Output of a request whose connection was detached"""
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return len(data)
+
+class RequestHandler(WSGIRequestHandler):
+    """Werkzeug's request handler, plus environ[DETACH]
+
+    Once the app calls it, it owns the returned socket and must write the
+    whole response itself: whatever the app returns is discarded, and the
+    server neither shuts the socket down nor closes it.
+    """
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ[DETACH] = self.detach
+        return environ
+
+    def detach(self):
+        self.server.detached.add(self.connection)
+        self.close_connection = True
+        self.wfile = Discard()
+        return self.connection
+
+class Server(ThreadedWSGIServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.detached = set()
+
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            return
+        super().shutdown_request(request)
+
+class InFlight:
+    """WSGI middleware counting the requests a worker is still handling"""
+
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self.condition:
+            self.count += 1
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self.done()
+            raise
+        return ClosingIterator(body, self.done)
+
+    def done(self):
+        with self.condition:
+            self.count -= 1
+            self.condition.notify_all()
+
+    def wait_idle(self, timeout):
+        """Wait until no request is in flight; returns whether that happened in time"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.count > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+def listen(host, port, backlog=2048):
+    sock = socket.create_server((host, port), family=socket.AF_INET6 if ':' in host else socket.AF_INET,
+                                backlog=backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock, graceful_timeout, on_shutdown=None):
+    """Serve requests from an already listening socket until SIGTERM/SIGINT"""
+    in_flight = InFlight(app)
+    host, port = sock.getsockname()[:2]
+    server = Server(host, port, in_flight, RequestHandler, fd=sock.fileno())
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever() to return, so not from its thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+        if on_shutdown:
+            on_shutdown()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    server.serve_forever()
+    # Request threads are daemons: idle keep-alive connections die with the
+    # process, requests still running get until the graceful timeout
+    in_flight.wait_idle(graceful_timeout)
+
+def serve(app, host='127.0.0.1', port=8000, workers=2, graceful_timeout=30.0,
+          preload=None, post_fork=None, on_shutdown=None, log=print):
+    """Run app in pre-forked workers until SIGTERM or SIGINT
+
+    preload() runs once in the master before forking, post_fork() in each
+    new worker before it accepts requests, and on_shutdown() in a worker
+    when it is asked to stop (e.g. to end long-lived streams).
+    """
+    sock = listen(host, port)
+    if preload:
+        preload()
+
+    if not hasattr(os, 'fork'):
+        log(f"Serving on http://{host}:{port} in a single process (no fork() on this platform)")
+        if post_fork:
+            post_fork()
+        run_worker(app, sock, graceful_timeout, on_shutdown)
+        return
+
+    children = {}
+    stopping = threading.Event()
+    crashes = 0
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                if post_fork:
+                    post_fork()
+                run_worker(app, sock, graceful_timeout, on_shutdown)
+            except BaseException as e:
+                if not isinstance(e, (SystemExit, KeyboardInterrupt)):
+                    import traceback
+                    traceback.print_exc()
+                    code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # Wake the loop below as soon as a worker exits
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    log(f"Serving on http://{host}:{port} with {workers} workers (master pid {os.getpid()})")
+    for _ in range(workers):
+        spawn()
+
+    while not stopping.is_set():
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid == 0:
+            stopping.wait(1.0)
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping.is_set():
+            continue
+        crashes = crashes + 1 if time.monotonic() - started < MIN_WORKER_LIFETIME else 0
+        log(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; starting a new one")
+        if crashes:
+            stopping.wait(min(2 ** crashes, MAX_RESPAWN_DELAY))
+        if not stopping.is_set():
+            spawn()
+
+    log(f"Stopping {len(children)} workers...")
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + graceful_timeout + 1
+    while children and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            children.pop(pid, None)
+        else:
+            time.sleep(0.1)
+    for pid in children:
+        log(f"Worker {pid} did not stop in time; killing it")
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+    sock.close()
+    log("Server stopped")
@@ -0,0 +1,106 @@
+"""
+R*Tree index over stop coordinates
+An SQLite R*Tree table holds one point-sized box per stop, kept in sync by
+triggers like the full-text index. Near and bounding-box lookups run as one
+fixed statement against it instead of an OR of geohash prefix ranges, whose
+SQL costs more to build than the index scan itself. Other databases use the
+geohash column.
+"""
+
+import weakref
+
+from sqlalchemy import Boolean, DDL, event, text
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS stop_rtree USING rtree(
+        id, min_lat, max_lat, min_lng, max_lng
+    )""",
+
+    """CREATE TRIGGER IF NOT EXISTS spatial_stop_insert AFTER INSERT ON stop BEGIN
+        INSERT INTO stop_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS spatial_stop_update AFTER UPDATE OF latitude, longitude ON stop BEGIN
+        UPDATE stop_rtree SET min_lat = NEW.latitude, max_lat = NEW.latitude,
+                              min_lng = NEW.longitude, max_lng = NEW.longitude
+        WHERE id = NEW.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS spatial_stop_delete AFTER DELETE ON stop BEGIN
+        DELETE FROM stop_rtree WHERE id = OLD.id;
+    END""",
+]
+
+REBUILD = [
+    "DELETE FROM stop_rtree",
+    "INSERT INTO stop_rtree SELECT id, latitude, latitude, longitude, longitude FROM stop",
+]
+
+# The R*Tree stores 32-bit floats rounded outwards, so the stop's own
+# columns are checked as well for an exact box
+PUBLIC_STOPS_IN_BOX = text("""
+    SELECT stop.id, stop.name, stop.latitude, stop.longitude, stop.day_number,
+           stop.order_in_day, stop.is_day_active, stop.itinerary_id,
+           itinerary.name AS itinerary_name, company.name AS company_name
+    FROM stop_rtree
+    JOIN stop ON stop.id = stop_rtree.id
+    JOIN itinerary ON itinerary.id = stop.itinerary_id
+    JOIN company ON company.id = itinerary.company_id
+    WHERE stop_rtree.max_lat >= :min_lat AND stop_rtree.min_lat <= :max_lat
+      AND stop_rtree.max_lng >= :min_lng AND stop_rtree.min_lng <= :max_lng
+      AND stop.latitude BETWEEN :min_lat AND :max_lat
+      AND stop.longitude BETWEEN :min_lng AND :max_lng
+      AND itinerary.is_active = 1 AND company.is_active = 1
+    LIMIT :limit
+""").columns(is_day_active=Boolean)
+
+def register(metadata):
+    """Create the index and triggers with create_all() and drop them with drop_all() on SQLite"""
+    for statement in SCHEMA:
+        event.listen(metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(metadata, 'before_drop', DDL('DROP TABLE IF EXISTS stop_rtree').execute_if(dialect='sqlite'))
+
+# Engines whose database is known to have the R*Tree
+indexed_engines = weakref.WeakSet()
+
+def enabled(connection):
+    """Whether the R*Tree can be queried
+
+    False on other databases and on SQLite files that have not been through
+    create_all() or init_db.py --upgrade since it was added, so callers fall
+    back instead of failing. A missing table is looked up again on each call.
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    if connection.engine in indexed_engines:
+        return True
+    if connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stop_rtree'"
+    )).first() is None:
+        return False
+    indexed_engines.add(connection.engine)
+    return True
+
+def rebuild(connection):
+    """Repopulate the whole index from the stop table"""
+    for statement in REBUILD:
+        connection.execute(text(statement))
+
+def public_stops_in_box(connection, min_lat, min_lng, max_lat, max_lng, limit=None):
+    """Stops of active itineraries of active companies inside a box, at most limit of them
+
+    Boxes crossing the antimeridian (min_lng > max_lng) are split in two.
+    Rows have the columns of app.public_stop_columns().
+    """
+    if min_lng > max_lng:
+        boxes = [(min_lng, 180.0), (-180.0, max_lng)]
+    else:
+        boxes = [(min_lng, max_lng)]
+
+    rows = []
+    for low, high in boxes:
+        rows += connection.execute(PUBLIC_STOPS_IN_BOX, {
+            'min_lat': min_lat, 'max_lat': max_lat, 'min_lng': low, 'max_lng': high,
+            'limit': -1 if limit is None else limit - len(rows)
+        }).all()
+        if limit is not None and len(rows) >= limit:
+            break
+    return rows
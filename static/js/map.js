@@ -5,16 +5,26 @@ let markersGroup;
 let routeGroup;
 let currentItinerary = null;
 let stops = [];
+let routeTier = null; // { min_zoom, max_zoom } of the route geometry on the map
+let routeRequest = 0;
+let shownStop = null; // Stop whose details the modal is showing or loading
+let searchRequest = 0;
+let searchState = { query: '', page: 1, cursor: null };
+let searchTimer = null;
+let liveUpdates = null; // EventSource pushing changes to the loaded itinerary
 
-// Map layer options
+// Map layer options, served through the app's tile cache (/tiles/<layer>/...)
 const mapLayers = {
-    street: L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+    street: L.tileLayer('/tiles/street/{z}/{x}/{y}', {
+        maxZoom: 19,
         attribution: '© OpenStreetMap contributors'
     }),
-    satellite: L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', {
+    satellite: L.tileLayer('/tiles/satellite/{z}/{x}/{y}', {
+        maxZoom: 19,
         attribution: '© Esri, Maxar, GeoEye, Earthstar Geographics, CNES/Airbus DS, USDA, USGS, AeroGRID, IGN, and the GIS User Community'
     }),
-    topo: L.tileLayer('https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png', {
+    topo: L.tileLayer('/tiles/topo/{z}/{x}/{y}', {
+        maxZoom: 17,
         attribution: '© OpenTopoMap (CC-BY-SA)'
     })
 };
@@ -41,14 +51,30 @@ function initializeMap() {
     // Add scale control
     L.control.scale().addTo(map);
     
+    // Swap route geometry for the matching detail tier when zooming
+    map.on('zoomend', handleZoomEnd);
+    
     console.log('Map initialized successfully');
 }
 
 function setupEventListeners() {
-    // Itinerary selection
-    const itinerarySelect = document.getElementById('itinerarySelect');
-    if (itinerarySelect) {
-        itinerarySelect.addEventListener('change', handleItineraryChange);
+    // Itinerary search
+    const itinerarySearch = document.getElementById('itinerarySearch');
+    if (itinerarySearch) {
+        itinerarySearch.addEventListener('input', function() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => runSearch(this.value.trim(), 1), 250);
+        });
+        document.getElementById('searchMoreBtn').addEventListener('click', function() {
+            runSearch(searchState.query, searchState.page + 1, searchState.cursor);
+        });
+        runSearch('', 1);
+    }
+    
+    // Dashboard preview links open a specific itinerary (/?itinerary=<id>)
+    const requestedItinerary = new URLSearchParams(window.location.search).get('itinerary');
+    if (requestedItinerary) {
+        loadItinerary(requestedItinerary, null);
     }
     
     // Map type controls
@@ -74,39 +100,127 @@ function setupEventListeners() {
     if (resetViewBtn) {
         resetViewBtn.addEventListener('click', handleResetView);
     }
+    
+    // Offline bundles are built in the background; wait for one before downloading
+    const offlineBundleLink = document.getElementById('offlineBundleLink');
+    if (offlineBundleLink) {
+        offlineBundleLink.addEventListener('click', handleOfflineDownload);
+    }
+    
+    // Details still loading for a closed modal must not reopen it
+    const stopModal = document.getElementById('stopModal');
+    if (stopModal) {
+        stopModal.addEventListener('hidden.bs.modal', () => { shownStop = null; });
+    }
 }
 
-async function handleItineraryChange(event) {
-    const itineraryId = event.target.value;
+async function runSearch(query, page, cursor = null) {
+    const requestId = ++searchRequest;
+    // Without a query, browse the newest itineraries page by page
+    const url = query
+        ? `/api/search?${new URLSearchParams({ q: query, page: page })}`
+        : `/api/itineraries${cursor ? `?${new URLSearchParams({ cursor: cursor })}` : ''}`;
     
-    if (!itineraryId) {
-        clearMap();
-        hideItineraryInfo();
+    try {
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error('Search failed');
+        }
+        const data = await response.json();
+        // Ignore responses for a query the user has already changed
+        if (requestId !== searchRequest) return;
+        
+        searchState = { query: query, page: page, cursor: data.next_cursor || null };
+        renderSearchResults(data.results, page > 1);
+        const hasMore = query ? data.has_more : Boolean(data.next_cursor);
+        document.getElementById('searchMoreBtn').style.display = hasMore ? 'block' : 'none';
+    } catch (error) {
+        console.error('Error searching itineraries:', error);
+        window.TourismApp.showAlert('Error searching itineraries. Please try again.', 'danger');
+    }
+}
+
+function renderSearchResults(results, append) {
+    const container = document.getElementById('searchResults');
+    if (!append) {
+        container.innerHTML = '';
+    }
+    if (!append && results.length === 0) {
+        container.innerHTML = '<div class="list-group-item text-muted small">No matching tours or places</div>';
         return;
     }
     
+    results.forEach(result => {
+        const item = document.createElement('button');
+        item.type = 'button';
+        item.className = 'list-group-item list-group-item-action';
+        item.dataset.itinerary = result.itinerary_id;
+        if (String(result.itinerary_id) === String(currentItinerary)) {
+            item.classList.add('active');
+        }
+        
+        const title = document.createElement('div');
+        title.className = 'fw-semibold';
+        const icon = document.createElement('i');
+        icon.className = `fas ${result.type === 'stop' ? 'fa-map-marker-alt' : 'fa-route'} me-1`;
+        title.appendChild(icon);
+        title.appendChild(document.createTextNode(result.type === 'stop' ? result.name : result.itinerary_name));
+        
+        const subtitle = document.createElement('small');
+        subtitle.className = 'd-block text-muted';
+        subtitle.textContent = result.type === 'stop'
+            ? `Day ${result.day_number} of ${result.itinerary_name} - ${result.company_name}`
+            : result.company_name;
+        
+        item.appendChild(title);
+        item.appendChild(subtitle);
+        if (result.snippet) {
+            // Snippets are HTML-escaped on the server with <mark> around matches
+            const snippet = document.createElement('small');
+            snippet.className = 'd-block';
+            snippet.innerHTML = result.snippet;
+            item.appendChild(snippet);
+        }
+        
+        item.addEventListener('click', () => handleSearchResultClick(result));
+        container.appendChild(item);
+    });
+}
+
+async function handleSearchResultClick(result) {
+    if (String(result.itinerary_id) !== String(currentItinerary)) {
+        await loadItinerary(result.itinerary_id, result);
+    }
+    if (result.type === 'stop') {
+        map.setView([result.latitude, result.longitude], 16);
+    }
+}
+
+async function loadItinerary(itineraryId, info) {
     try {
         // Show loading
         window.TourismApp.showLoading();
         
         // Fetch stops data
-        const response = await fetch(`/api/stops/${itineraryId}`);
-        if (!response.ok) {
-            throw new Error('Failed to fetch stops');
-        }
-        
-        stops = await response.json();
+        stops = await fetchStops(itineraryId);
         currentItinerary = itineraryId;
         
         // Display stops on map
         displayStops(stops);
         
         // Show itinerary info
-        showItineraryInfo(itineraryId);
+        showItineraryInfo(info);
+        document.getElementById('offlineBundleLink').href = `/api/bundle/${itineraryId}.zip`;
+        document.querySelectorAll('#searchResults .list-group-item').forEach(item => {
+            item.classList.toggle('active', item.dataset.itinerary === String(itineraryId));
+        });
         
         // Update day progress
         updateDayProgress(stops);
         
+        // Follow day activation and stop edits while the itinerary is open
+        subscribeToItinerary(itineraryId);
+        
         // Add small delay to ensure map is fully rendered, then hide loading
         setTimeout(() => {
             window.TourismApp.hideLoading();
@@ -120,7 +234,58 @@ async function handleItineraryChange(event) {
     }
 }
 
-function displayStops(stopsData) {
+async function handleOfflineDownload(event) {
+    event.preventDefault();
+    const itineraryId = currentItinerary;
+    let notified = false;
+    try {
+        while (itineraryId === currentItinerary) {
+            const response = await fetch(`/api/bundle/${itineraryId}`);
+            if (response.status === 202) {
+                if (!notified) {
+                    window.TourismApp.showAlert('Preparing the offline bundle...', 'info');
+                    notified = true;
+                }
+                const wait = parseInt(response.headers.get('Retry-After') || '2', 10);
+                await new Promise(resolve => setTimeout(resolve, wait * 1000));
+                continue;
+            }
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            const manifest = await response.json();
+            window.location.href = manifest.archive_url;
+            return;
+        }
+    } catch (error) {
+        console.error('Error downloading offline bundle:', error);
+        window.TourismApp.showAlert('Error preparing the offline bundle. Please try again.', 'danger');
+    }
+}
+
+async function fetchStops(itineraryId) {
+    // The compact columnar variant: parallel arrays, no descriptions or images
+    const response = await fetch(`/api/stops/${itineraryId}`, {
+        headers: { 'Accept': 'application/vnd.tourism.stops+json' }
+    });
+    if (!response.ok) {
+        throw new Error('Failed to fetch stops');
+    }
+    
+    const data = await response.json();
+    if (data.format !== 'columnar') return data;
+    return data.id.map((id, i) => ({
+        id: id,
+        name: data.name[i],
+        latitude: data.latitude[i],
+        longitude: data.longitude[i],
+        day_number: data.day_number[i],
+        order_in_day: data.order_in_day[i],
+        is_day_active: data.is_day_active[i] === 1
+    }));
+}
+
+function displayStops(stopsData, fitView = true) {
     // Clear existing markers and routes
     clearMap();
     
@@ -148,11 +313,61 @@ function displayStops(stopsData) {
     }
     
     // Fit map to show all stops
-    if (bounds.isValid()) {
+    if (fitView && bounds.isValid()) {
         map.fitBounds(bounds, { padding: [20, 20] });
     }
 }
 
+function subscribeToItinerary(itineraryId) {
+    if (liveUpdates) {
+        liveUpdates.close();
+        liveUpdates = null;
+    }
+    if (!window.EventSource) return;
+    
+    // The browser reconnects on its own and resumes from the last event it saw
+    liveUpdates = new EventSource(`/api/live/itinerary/${itineraryId}`);
+    
+    liveUpdates.addEventListener('days', event => {
+        const states = new Map(JSON.parse(event.data).days.map(day => [day.day_number, day.is_active]));
+        stops.forEach(stop => {
+            if (states.has(stop.day_number)) {
+                stop.is_day_active = states.get(stop.day_number);
+            }
+        });
+        refreshStops();
+    });
+    
+    liveUpdates.addEventListener('stop', event => {
+        const change = JSON.parse(event.data);
+        const changedId = change.action === 'deleted' ? change.id : change.stop.id;
+        stops = stops.filter(stop => stop.id !== changedId);
+        if (change.action === 'saved') {
+            stops.push(change.stop);
+            stops.sort((a, b) => a.day_number - b.day_number || a.order_in_day - b.order_in_day);
+        }
+        refreshStops();
+    });
+    
+    // Bulk changes, or updates missed while disconnected: fetch the stops again
+    liveUpdates.addEventListener('reset', async () => {
+        try {
+            const reloaded = await fetchStops(itineraryId);
+            if (currentItinerary !== itineraryId) return;
+            stops = reloaded;
+            refreshStops();
+        } catch (error) {
+            console.warn('Could not reload stops:', error);
+        }
+    });
+}
+
+function refreshStops() {
+    // Redraw in place without moving the map
+    displayStops(stops, false);
+    updateDayProgress(stops);
+}
+
 function createStopMarker(stop) {
     const isActive = stop.is_day_active;
     const markerColor = isActive ? '#28a745' : '#6c757d';
@@ -181,13 +396,13 @@ function createStopMarker(stop) {
     // Add click event only for active stops
     if (isActive) {
         numberMarker.on('click', () => showStopModal(stop));
-        numberMarker.bindTooltip(`Day ${stop.day_number}: ${stop.name}`, {
+        numberMarker.bindTooltip(`Day ${stop.day_number}: ${window.TourismApp.sanitizeHtml(stop.name)}`, {
             permanent: false,
             direction: 'top',
             offset: [0, -15]
         });
     } else {
-        numberMarker.bindTooltip(`Day ${stop.day_number}: ${stop.name} (Inactive)`, {
+        numberMarker.bindTooltip(`Day ${stop.day_number}: ${window.TourismApp.sanitizeHtml(stop.name)} (Inactive)`, {
             permanent: false,
             direction: 'top',
             offset: [0, -15]
@@ -200,93 +415,71 @@ function createStopMarker(stop) {
 async function createRoute(coordinates) {
     if (coordinates.length < 2) return;
     
+    const request = ++routeRequest;
+    
     try {
-        console.log('Creating route with actual roads...');
+        // Get selected route type
+        const routeType = document.querySelector('input[name="routeType"]:checked')?.value || 'driving';
         
-        // Create route segments between consecutive stops
-        for (let i = 0; i < coordinates.length - 1; i++) {
-            const start = coordinates[i];
-            const end = coordinates[i + 1];
-            
-            await createRouteSegment(start, end, i);
-            
-            // Add a small delay between requests to avoid rate limiting
-            if (i < coordinates.length - 2) {
-                await new Promise(resolve => setTimeout(resolve, 200));
-            }
+        // The server routes and caches every segment, so the whole tour is one
+        // request; geometry comes back simplified for the current zoom level
+        const response = await fetch(`/api/route/${currentItinerary}?profile=${routeType}&zoom=${map.getZoom()}`);
+        
+        if (!response.ok) {
+            throw new Error(`Route API error: ${response.status}`);
         }
         
+        const route = await response.json();
+        
+        // A newer request (zoom, route type or itinerary change) superseded this one
+        if (request !== routeRequest) return;
+        
+        routeGroup.clearLayers();
+        routeTier = { min_zoom: route.min_zoom, max_zoom: route.max_zoom };
+        route.segments.forEach((segment, index) => createRouteSegment(segment, index, routeType));
+        
+        // The map may have zoomed (e.g. fitBounds) while the request was in flight
+        handleZoomEnd();
+        
     } catch (error) {
         console.error('Error creating route:', error);
+        if (request !== routeRequest) return;
         // Fallback to straight line if routing fails
+        routeGroup.clearLayers();
+        routeTier = null;
         createStraightLineRoute(coordinates);
     }
 }
 
-async function createRouteSegment(start, end, segmentIndex) {
-    try {
-        // Get selected route type
-        const routeType = document.querySelector('input[name="routeType"]:checked')?.value || 'driving';
-        
-        // Using OSRM (Open Source Routing Machine) - completely free, no API key required
-        const osrmUrl = `https://router.project-osrm.org/route/v1/${routeType}/${start.lng},${start.lat};${end.lng},${end.lat}?overview=full&geometries=geojson&steps=true`;
-        
-        console.log(`Fetching route segment ${segmentIndex + 1}...`);
-        
-        const response = await fetch(osrmUrl);
-        
-        if (!response.ok) {
-            throw new Error(`OSRM API error: ${response.status}`);
-        }
-        
-        const data = await response.json();
-        
-        if (data.routes && data.routes.length > 0) {
-            const route = data.routes[0];
-            const routeGeometry = route.geometry;
-            
-            // Convert coordinates from [lng, lat] to [lat, lng] for Leaflet
-            const routeCoordinates = routeGeometry.coordinates.map(coord => [coord[1], coord[0]]);
-            
-            // Create the route polyline with a unique color for each segment
-            const routePolyline = L.polyline(routeCoordinates, {
-                color: getRouteColor(segmentIndex),
-                weight: 5,
-                opacity: 0.8,
-                className: `route-segment-${segmentIndex}`
-            });
-            
-            // Add route information
-            const distance = (route.distance / 1000).toFixed(1); // Convert to km
-            const duration = Math.round(route.duration / 60); // Convert to minutes
-            
-            // Get route type for display
-            const routeType = document.querySelector('input[name="routeType"]:checked')?.value || 'driving';
-            const routeIcon = routeType === 'walking' ? 'fas fa-walking' : 'fas fa-car';
-            const routeText = routeType === 'walking' ? 'Walking route' : 'Driving route';
-            
-            routePolyline.bindPopup(`
-                <div class="route-info">
-                    <strong>Route Segment ${segmentIndex + 1}</strong><br>
-                    <i class="fas fa-road me-1"></i> Distance: ${distance} km<br>
-                    <i class="fas fa-clock me-1"></i> Duration: ${duration} min<br>
-                    <i class="${routeIcon} me-1"></i> ${routeText}
-                </div>
-            `);
-            
-            routeGroup.addLayer(routePolyline);
-            
-            console.log(`✅ Route segment ${segmentIndex + 1} created: ${distance}km, ${duration}min`);
-            
-        } else {
-            throw new Error('No route found in API response');
+function decodePolyline(encoded) {
+    // Google encoded polyline algorithm, returns [lat, lng] pairs for Leaflet
+    const coordinates = [];
+    let index = 0, lat = 0, lng = 0;
+    
+    while (index < encoded.length) {
+        const deltas = [];
+        for (let i = 0; i < 2; i++) {
+            let shift = 0, result = 0, byte;
+            do {
+                byte = encoded.charCodeAt(index++) - 63;
+                result |= (byte & 0x1f) << shift;
+                shift += 5;
+            } while (byte >= 0x20);
+            deltas.push(result & 1 ? ~(result >> 1) : result >> 1);
         }
-        
-    } catch (error) {
-        console.warn(`⚠️ Failed to create route segment ${segmentIndex + 1}, using straight line:`, error.message);
-        
-        // Fallback to straight line for this segment
-        const straightLine = L.polyline([start, end], {
+        lat += deltas[0];
+        lng += deltas[1];
+        coordinates.push([lat / 1e5, lng / 1e5]);
+    }
+    return coordinates;
+}
+
+function createRouteSegment(segment, segmentIndex, routeType) {
+    const routeCoordinates = decodePolyline(segment.polyline);
+    
+    if (segment.fallback) {
+        // Direct line when no road route is available for this segment
+        const straightLine = L.polyline(routeCoordinates, {
             color: '#dc3545', // Red color to indicate fallback
             weight: 3,
             opacity: 0.7,
@@ -302,7 +495,34 @@ async function createRouteSegment(start, end, segmentIndex) {
         `);
         
         routeGroup.addLayer(straightLine);
+        return;
     }
+    
+    // Create the route polyline with a unique color for each segment
+    const routePolyline = L.polyline(routeCoordinates, {
+        color: getRouteColor(segmentIndex),
+        weight: 5,
+        opacity: 0.8,
+        className: `route-segment-${segmentIndex}`
+    });
+    
+    // Add route information
+    const distance = (segment.distance / 1000).toFixed(1); // Convert to km
+    const duration = Math.round(segment.duration / 60); // Convert to minutes
+    
+    const routeIcon = routeType === 'walking' ? 'fas fa-walking' : 'fas fa-car';
+    const routeText = routeType === 'walking' ? 'Walking route' : 'Driving route';
+    
+    routePolyline.bindPopup(`
+        <div class="route-info">
+            <strong>Route Segment ${segmentIndex + 1}</strong><br>
+            <i class="fas fa-road me-1"></i> Distance: ${distance} km<br>
+            <i class="fas fa-clock me-1"></i> Duration: ${duration} min<br>
+            <i class="${routeIcon} me-1"></i> ${routeText}
+        </div>
+    `);
+    
+    routeGroup.addLayer(routePolyline);
 }
 
 function createStraightLineRoute(coordinates) {
@@ -340,17 +560,41 @@ function getRouteColor(segmentIndex) {
     return colors[segmentIndex % colors.length];
 }
 
-function showStopModal(stop) {
-    // Populate modal with stop data
+async function showStopModal(stop) {
+    shownStop = stop;
     document.getElementById('stopModalTitle').textContent = stop.name;
-    document.getElementById('stopDescription').textContent = stop.description || 'No description available.';
     document.getElementById('stopDayBadge').textContent = `Day ${stop.day_number}`;
+    const modal = bootstrap.Modal.getOrCreateInstance(document.getElementById('stopModal'));
+    
+    // Descriptions and images are not in the columnar stops list; load them on first open
+    if (stop.description === undefined) {
+        document.getElementById('stopDescription').textContent = 'Loading...';
+        document.getElementById('stopImage').style.display = 'none';
+        document.getElementById('noImagePlaceholder').style.display = 'none';
+        modal.show();
+        try {
+            const response = await fetch(`/api/stop/${stop.id}`);
+            if (!response.ok) throw new Error('Failed to fetch stop');
+            Object.assign(stop, await response.json());
+        } catch (error) {
+            console.warn('Could not load stop details:', error);
+        }
+        // Another stop was opened, or the modal closed, while this one loaded
+        if (shownStop !== stop) return;
+    }
+    
+    // Populate modal with stop data
+    document.getElementById('stopDescription').textContent = stop.description || 'No description available.';
     
     // Handle image
     const stopImage = document.getElementById('stopImage');
     const noImagePlaceholder = document.getElementById('noImagePlaceholder');
     
     if (stop.image_filename) {
+        // Prefer the resized variants; the original is only used until they exist
+        const srcset = stop.image_srcset || {};
+        stopImage.srcset = srcset.webp || srcset.jpeg || '';
+        stopImage.sizes = '(max-width: 768px) 100vw, 400px';
         stopImage.src = `/static/uploads/${stop.image_filename}`;
         stopImage.style.display = 'block';
         noImagePlaceholder.style.display = 'none';
@@ -360,31 +604,24 @@ function showStopModal(stop) {
     }
     
     // Show modal
-    const modal = new bootstrap.Modal(document.getElementById('stopModal'));
     modal.show();
 }
 
-function showItineraryInfo(itineraryId) {
-    // Find the selected itinerary
-    const select = document.getElementById('itinerarySelect');
-    const selectedOption = select.querySelector(`option[value="${itineraryId}"]`);
-    
-    if (selectedOption) {
-        const descriptionDiv = document.getElementById('itineraryDescription');
-        const descriptionText = document.getElementById('descriptionText');
-        
-        // You might want to fetch full itinerary details here
-        descriptionText.textContent = `Selected: ${selectedOption.textContent}`;
-        descriptionDiv.style.display = 'block';
-    }
-}
-
-function hideItineraryInfo() {
+function showItineraryInfo(info) {
+    const companyInfo = document.getElementById('companyInfo');
     const descriptionDiv = document.getElementById('itineraryDescription');
-    const dayProgress = document.getElementById('dayProgress');
+    if (!info) {
+        companyInfo.style.display = 'none';
+        descriptionDiv.style.display = 'none';
+        return;
+    }
+    
+    document.getElementById('companyName').textContent = info.company_name;
+    document.getElementById('companyDetails').textContent = info.itinerary_name;
+    companyInfo.style.display = 'block';
     
-    descriptionDiv.style.display = 'none';
-    dayProgress.style.display = 'none';
+    document.getElementById('descriptionText').textContent = info.description || 'No description available';
+    descriptionDiv.style.display = 'block';
 }
 
 function updateDayProgress(stopsData) {
@@ -464,6 +701,16 @@ function handleRouteTypeChange(event) {
     }
 }
 
+function handleZoomEnd() {
+    if (!routeTier || !currentItinerary || !stops || stops.length < 2) return;
+    
+    const zoom = map.getZoom();
+    const inTier = zoom >= routeTier.min_zoom && (routeTier.max_zoom === null || zoom <= routeTier.max_zoom);
+    if (!inTier) {
+        createRoute(stops.map(stop => L.latLng(stop.latitude, stop.longitude)));
+    }
+}
+
 function handleLocateUser() {
     if ('geolocation' in navigator) {
         window.TourismApp.showLoading();
@@ -488,6 +735,8 @@ function handleLocateUser() {
                 
                 window.TourismApp.showAlert('Location found!', 'success');
                 window.TourismApp.hideLoading();
+                
+                showNearbyStops(lat, lng);
             },
             function(error) {
                 let message = 'Unable to get your location. ';
@@ -512,6 +761,39 @@ function handleLocateUser() {
     }
 }
 
+async function showNearbyStops(lat, lng) {
+    // Stops from other tours around the user, served from the spatial index
+    try {
+        const response = await fetch(`/api/stops/near?lat=${lat}&lng=${lng}&radius=5000&limit=50`);
+        if (!response.ok) return;
+        
+        const nearby = await response.json();
+        nearby
+            .filter(stop => String(stop.itinerary_id) !== String(currentItinerary))
+            .forEach(stop => {
+                const marker = L.circleMarker([stop.latitude, stop.longitude], {
+                    radius: 6,
+                    fillColor: '#17a2b8',
+                    color: '#fff',
+                    weight: 2,
+                    fillOpacity: 0.8
+                });
+                // Names come from every company's tours; escape them before they become HTML
+                const escape = window.TourismApp.sanitizeHtml;
+                marker.bindPopup(`
+                    <div class="route-info">
+                        <strong>${escape(stop.name)}</strong><br>
+                        <small class="text-muted">${escape(stop.itinerary_name)} - ${escape(stop.company_name)}</small><br>
+                        <i class="fas fa-location-arrow me-1"></i> ${(stop.distance / 1000).toFixed(1)} km away
+                    </div>
+                `);
+                markersGroup.addLayer(marker);
+            });
+    } catch (error) {
+        console.warn('Could not load nearby stops:', error);
+    }
+}
+
 function handleResetView() {
     if (stops && stops.length > 0) {
         // Reset to show all stops
@@ -526,4 +808,6 @@ function handleResetView() {
 function clearMap() {
     markersGroup.clearLayers();
     routeGroup.clearLayers();
+    routeTier = null;
+    routeRequest++;
 }
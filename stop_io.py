@@ -0,0 +1,330 @@
+"""
+Bulk stop import and export
+Streaming readers and writers for CSV, GeoJSON and GPX so large tour files
+are processed row by row instead of being loaded into memory
+"""
+
+import codecs
+import csv
+import io
+import json
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+FORMATS = ('csv', 'geojson', 'gpx')
+
+CSV_FIELDS = ['name', 'description', 'latitude', 'longitude', 'day_number', 'order_in_day', 'is_day_active']
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'geojson': 'application/geo+json',
+    'gpx': 'application/gpx+xml',
+}
+
+GPX_NAMESPACE = 'http://www.topografix.com/GPX/1/1'
+TOUR_NAMESPACE = 'urn:tourism-platform:gpx'
+
+class StopFileError(ValueError):
+    """Raised when a file cannot be read at all (as opposed to a bad row)"""
+
+def detect_format(filename, requested=None):
+    """Pick an import format from an explicit choice or the file extension"""
+    if requested:
+        fmt = requested.lower()
+    else:
+        fmt = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        fmt = 'geojson' if fmt == 'json' else fmt
+    if fmt not in FORMATS:
+        raise StopFileError(f'Unsupported format: {fmt or filename}')
+    return fmt
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'on')
+
+def text_value(raw, field):
+    """A text column from a record; numbers are converted, anything else is a ValueError"""
+    value = raw.get(field)
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f'{field} must be text')
+    return str(value)
+
+def validate_row(raw):
+    """Convert a raw record into Stop column values, raising ValueError on bad data"""
+    name = text_value(raw, 'name').strip()
+    if not name:
+        raise ValueError('name is required')
+    if len(name) > 100:
+        raise ValueError('name is longer than 100 characters')
+
+    try:
+        latitude = float(raw.get('latitude'))
+        longitude = float(raw.get('longitude'))
+    except (TypeError, ValueError):
+        raise ValueError('latitude and longitude must be numbers')
+    if not -90 <= latitude <= 90:
+        raise ValueError('latitude must be between -90 and 90')
+    if not -180 <= longitude <= 180:
+        raise ValueError('longitude must be between -180 and 180')
+
+    try:
+        day_number = int(raw.get('day_number') or 1)
+        order_in_day = int(raw.get('order_in_day') or 1)
+    except (TypeError, ValueError):
+        raise ValueError('day_number and order_in_day must be whole numbers')
+    if day_number < 1 or order_in_day < 1:
+        raise ValueError('day_number and order_in_day must be at least 1')
+
+    return {
+        'name': name,
+        'description': text_value(raw, 'description'),
+        'latitude': latitude,
+        'longitude': longitude,
+        'day_number': day_number,
+        'order_in_day': order_in_day,
+        'is_day_active': parse_bool(raw.get('is_day_active')),
+    }
+
+# Readers yield (row_number, raw_dict) pairs, or (row_number, ValueError) for
+# a record that could not be parsed
+
+def read_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    missing = {'name', 'latitude', 'longitude'} - set(reader.fieldnames or [])
+    if missing:
+        raise StopFileError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+    for row in reader:
+        # Header is line 1
+        yield reader.line_num, row
+
+def json_value_end(text, start):
+    """Index just past the JSON value starting at text[start], or -1 if it is cut off
+
+    Only brackets and strings are tracked, so the value need not be valid.
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in '{[':
+            depth += 1
+        elif char in '}]':
+            if depth == 0:
+                return index
+            depth -= 1
+            if depth == 0:
+                return index + 1
+        elif char == ',' and depth == 0:
+            return index
+    return -1
+
+def read_geojson(stream, chunk_size=64 * 1024, max_feature_size=1024 * 1024):
+    """Yield features of a FeatureCollection one at a time
+
+    A feature that is not valid JSON is yielded as a ValueError and skipped.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            buffer = buffer[position:] + text.decode(b'', final=True)
+        else:
+            buffer = buffer[position:] + text.decode(chunk)
+        position = 0
+
+    # Find the opening bracket of the features array
+    while True:
+        key = buffer.find('"features"', position)
+        if key != -1:
+            bracket = buffer.find('[', key)
+            if bracket != -1:
+                position = bracket + 1
+                break
+        if eof:
+            raise StopFileError('GeoJSON must be a FeatureCollection with a "features" array')
+        fill()
+
+    index = 0
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position >= len(buffer):
+            if eof:
+                raise StopFileError('GeoJSON ended before the features array was closed')
+            fill()
+            continue
+        if buffer[position] == ']':
+            return
+
+        try:
+            feature, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            end = json_value_end(buffer, position)
+            if end == -1:
+                # Cut off at the end of the buffer: read more, within reason
+                if eof:
+                    raise StopFileError(f'Invalid JSON in feature {index + 1}')
+                if len(buffer) - position > max_feature_size:
+                    raise StopFileError(f'Feature {index + 1} is larger than {max_feature_size} characters')
+                fill()
+                continue
+            position = max(end, position + 1)
+            index += 1
+            yield index, ValueError('feature is not valid JSON')
+            continue
+        position = end
+        index += 1
+
+        if not isinstance(feature, dict):
+            yield index, ValueError('feature must be an object')
+            continue
+        properties = feature.get('properties')
+        geometry = feature.get('geometry')
+        if not isinstance(properties, (dict, type(None))):
+            yield index, ValueError('properties must be an object')
+            continue
+        if not isinstance(geometry, (dict, type(None))):
+            yield index, ValueError('geometry must be an object')
+            continue
+        properties = dict(properties or {})
+        if geometry and geometry.get('type') == 'Point':
+            coordinates = geometry.get('coordinates')
+            if not isinstance(coordinates, list) or len(coordinates) < 2:
+                yield index, ValueError('Point coordinates must be [longitude, latitude]')
+                continue
+            properties['longitude'], properties['latitude'] = coordinates[:2]
+        yield index, properties
+
+def read_gpx(stream):
+    """Yield waypoints of a GPX file; day/order come from tour extensions if present
+
+    Every element is cleared once read (a waypoint's children when the
+    waypoint ends), so tracks and routes in the file are not kept either.
+    """
+    index = 0
+    depth = 0
+    waypoint_depth = 0
+    root = None
+    try:
+        for event, element in ET.iterparse(stream, events=('start', 'end')):
+            tag = element.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                if root is None:
+                    root = element
+                depth += 1
+                waypoint_depth += tag == 'wpt'
+                continue
+            depth -= 1
+
+            raw = None
+            if tag == 'wpt':
+                waypoint_depth -= 1
+                index += 1
+                raw = {'latitude': element.get('lat'), 'longitude': element.get('lon')}
+                for child in element.iter():
+                    child_tag = child.tag.rsplit('}', 1)[-1]
+                    if child_tag == 'desc':
+                        raw['description'] = child.text
+                    elif child_tag in ('name', 'day_number', 'order_in_day', 'is_day_active'):
+                        raw[child_tag] = child.text
+            elif waypoint_depth:
+                # Read when its waypoint ends
+                continue
+
+            element.clear()
+            if depth == 1:
+                # Drop the emptied top-level elements from the document root
+                root.clear()
+            if raw is not None:
+                yield index, raw
+    except ET.ParseError as e:
+        raise StopFileError(f'Invalid GPX: {e}')
+
+READERS = {
+    'csv': read_csv,
+    'geojson': read_geojson,
+    'gpx': read_gpx,
+}
+
+def iter_import(stream, fmt):
+    """Yield (row_number, values, error) for every record in an upload"""
+    for row_number, raw in READERS[fmt](stream):
+        if isinstance(raw, ValueError):
+            yield row_number, None, str(raw)
+            continue
+        try:
+            yield row_number, validate_row(raw), None
+        except ValueError as e:
+            yield row_number, None, str(e)
+
+# Writers take an iterable of Stop objects and yield text chunks
+
+def write_csv(stops):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for stop in stops:
+        writer.writerow([getattr(stop, field) for field in CSV_FIELDS])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def write_geojson(stops):
+    yield '{"type": "FeatureCollection", "features": ['
+    separator = ''
+    for stop in stops:
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [stop.longitude, stop.latitude]},
+            'properties': {field: getattr(stop, field) for field in CSV_FIELDS
+                           if field not in ('latitude', 'longitude')}
+        }
+        yield separator + json.dumps(feature)
+        separator = ',\n'
+    yield ']}\n'
+
+def write_gpx(stops):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           f'<gpx version="1.1" creator="Tourism Platform" xmlns="{GPX_NAMESPACE}" '
+           f'xmlns:tour="{TOUR_NAMESPACE}">\n')
+    for stop in stops:
+        yield (f'  <wpt lat="{stop.latitude}" lon="{stop.longitude}">'
+               f'<name>{escape(stop.name)}</name>'
+               f'<desc>{escape(stop.description or "")}</desc>'
+               '<extensions>'
+               f'<tour:day_number>{stop.day_number}</tour:day_number>'
+               f'<tour:order_in_day>{stop.order_in_day}</tour:order_in_day>'
+               f'<tour:is_day_active>{str(bool(stop.is_day_active)).lower()}</tour:is_day_active>'
+               '</extensions></wpt>\n')
+    yield '</gpx>\n'
+
+WRITERS = {
+    'csv': write_csv,
+    'geojson': write_geojson,
+    'gpx': write_gpx,
+}
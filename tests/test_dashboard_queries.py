@@ -0,0 +1,125 @@
+"""
+SQL statements per dashboard render must not grow with the number of
+itineraries (or companies) shown, so a lazy load added to a template shows
+up here instead of in production.
+
+Run with: python -m pytest tests
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+
+import app as app_module
+
+db = app_module.db
+
+@pytest.fixture
+def platform():
+    """An empty platform with a super admin; returns (add_company, super admin id)
+
+    Nothing stays in an app context between calls, so every request loads
+    its objects from the database as it would in production.
+    """
+    app = app_module.app
+    app.config['PLATFORM_STATS_TTL'] = 0
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        super_admin = app_module.User(username='root', email='root@example.com', password_hash='x',
+                                      first_name='Super', last_name='Admin', role='super_admin')
+        db.session.add(super_admin)
+        db.session.commit()
+        super_admin_id = super_admin.id
+
+    def add_company(number, itineraries):
+        """A company with an admin and itineraries of three stops each; returns the admin's id"""
+        with app.app_context():
+            company = app_module.Company(name=f'Company {number}', email=f'company{number}@example.com',
+                                         subscription_plan='basic')
+            db.session.add(company)
+            db.session.flush()
+            admin = app_module.User(username=f'admin{number}', email=f'admin{number}@example.com',
+                                    password_hash='x', first_name='Company', last_name='Admin',
+                                    role='admin', company_id=company.id)
+            db.session.add(admin)
+            for i in range(itineraries):
+                itinerary = app_module.Itinerary(name=f'Tour {number}-{i}', description='', company_id=company.id)
+                db.session.add(itinerary)
+                db.session.flush()
+                for order in range(3):
+                    db.session.add(app_module.Stop(name=f'Stop {order}', latitude=31.5 + order * 0.01,
+                                                   longitude=74.3, day_number=1, order_in_day=order + 1,
+                                                   itinerary_id=itinerary.id))
+            db.session.commit()
+            return admin.id
+
+    return add_company, super_admin_id
+
+def count_statements(user_id, path):
+    """Render a page as a user; returns the number of SQL statements it ran"""
+    client = app_module.app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['user_id'] = user_id
+    statements = []
+    # Background jobs (e.g. platform totals) use the same engine from their own threads
+    request_thread = threading.get_ident()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == request_thread:
+            statements.append(statement)
+
+    with app_module.app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    assert response.status_code == 200
+    return len(statements)
+
+@pytest.mark.parametrize('itineraries', [1, 10, 40])
+def test_admin_dashboard_query_count(platform, itineraries):
+    add_company, _ = platform
+    baseline = count_statements(add_company(0, 1), '/admin')
+    assert count_statements(add_company(1, itineraries), '/admin') == baseline
+
+@pytest.mark.parametrize('companies', [1, 5, 20])
+def test_super_admin_dashboard_query_count(platform, companies):
+    add_company, super_admin_id = platform
+    add_company(0, 1)
+    baseline = count_statements(super_admin_id, '/super-admin')
+    for number in range(1, companies + 1):
+        add_company(number, 3)
+    assert count_statements(super_admin_id, '/super-admin') == baseline
+
+def test_platform_stats_only_resummarise_changed_itineraries(platform, monkeypatch):
+    add_company, _ = platform
+    add_company(0, 5)
+    add_company(1, 5)
+    summarised = []
+    analytics = app_module.get_itinerary_analytics
+
+    def record(itinerary_ids):
+        summarised.append(sorted(itinerary_ids))
+        return analytics(itinerary_ids=itinerary_ids)
+
+    monkeypatch.setattr(app_module, 'get_itinerary_analytics', record)
+    app_module.itinerary_summaries.clear()
+    with app_module.app.app_context():
+        stats = app_module.compute_platform_stats()
+        assert stats['total_itineraries'] == 10 and stats['total_stops'] == 30
+        assert summarised == [list(range(1, 11))]
+
+        app_module.bump_itinerary_version(3)
+        assert app_module.compute_platform_stats() == stats
+        assert summarised[1:] == [[3]]
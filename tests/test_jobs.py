@@ -0,0 +1,56 @@
+"""
+Job leases: a worker that stalls past its lease must not record anything
+over the attempt that took the job over.
+
+Run with: python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import jobs
+
+@pytest.fixture
+def queue(tmp_path):
+    return jobs.JobQueue(str(tmp_path / 'jobs.db'), workers=0)
+
+def expire_lease(queue, job_id):
+    with queue._connect() as conn:
+        conn.execute('UPDATE job SET locked_until = 0 WHERE id = ?', (job_id,))
+
+def test_stale_attempt_result_is_ignored(queue):
+    @queue.handler('build')
+    def build(job):
+        if job.attempt == 1:
+            expire_lease(queue, job.id)
+            queue.run(queue.claim())
+            return 'stale'
+        return 'fresh'
+
+    job_id = queue.enqueue('build', {})
+    queue.run(queue.claim())
+    job = queue.get(job_id)
+    assert (job['status'], job['result'], job['attempts']) == ('done', 'fresh', 2)
+
+def test_progress_stops_a_reclaimed_attempt(queue):
+    reached = []
+
+    @queue.handler('build')
+    def build(job):
+        expire_lease(queue, job.id)
+        assert queue.claim().attempt == 2
+        with pytest.raises(jobs.LeaseLost):
+            job.progress(1, 2)
+        reached.append(job.attempt)
+        raise jobs.LeaseLost()
+
+    job_id = queue.enqueue('build', {})
+    queue.run(queue.claim())
+    job = queue.get(job_id)
+    assert reached == [1]
+    assert (job['status'], job['attempts'], job['progress']) == ('running', 2, None)
@@ -0,0 +1,86 @@
+"""
+Bulk import readers: a bad record becomes a row error and the records
+after it are still read.
+
+Run with: python -m pytest tests
+"""
+
+import io
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import stop_io
+
+def feature(name, **extra):
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [74.3, 31.5]},
+            'properties': {'name': name}, **extra}
+
+def import_geojson(features, chunk_size=64 * 1024):
+    """(row_number, values, error) for a FeatureCollection of JSON texts"""
+    document = '{"type": "FeatureCollection", "features": [' + ',\n'.join(features) + ']}'
+    stream = io.BytesIO(document.encode('utf-8'))
+    rows = []
+    for row_number, raw in stop_io.read_geojson(stream, chunk_size=chunk_size):
+        if isinstance(raw, ValueError):
+            rows.append((row_number, None, str(raw)))
+            continue
+        try:
+            rows.append((row_number, stop_io.validate_row(raw), None))
+        except ValueError as e:
+            rows.append((row_number, None, str(e)))
+    return rows
+
+@pytest.mark.parametrize('chunk_size', [7, 100, 64 * 1024])
+def test_invalid_json_feature_is_skipped(chunk_size):
+    rows = import_geojson([
+        json.dumps(feature('First ]}[{ "quoted"')),
+        '{"type": "Feature", "properties": {"name": "bad", oops}}',
+        'nonsense',
+        json.dumps(feature('Last')),
+    ], chunk_size=chunk_size)
+    assert [(row_number, error) for row_number, _, error in rows] == [
+        (1, None), (2, 'feature is not valid JSON'), (3, 'feature is not valid JSON'), (4, None)
+    ]
+    assert rows[0][1]['name'] == 'First ]}[{ "quoted"'
+    assert rows[3][1]['latitude'] == 31.5
+
+@pytest.mark.parametrize('bad, error', [
+    ('[1, 2]', 'feature must be an object'),
+    (json.dumps(feature('x', properties=[1, 2, 3])), 'properties must be an object'),
+    (json.dumps(feature('x', geometry='POINT (74 31)')), 'geometry must be an object'),
+    (json.dumps(feature('x', geometry={'type': 'Point', 'coordinates': '74,31'})),
+     'Point coordinates must be [longitude, latitude]'),
+    (json.dumps(feature('x', geometry={'type': 'Point', 'coordinates': [[74, 31], [75, 32]]})),
+     'latitude and longitude must be numbers'),
+    (json.dumps(feature('x', properties={'name': {'en': 'Fort'}})), 'name must be text'),
+    (json.dumps(feature('x', properties={'name': True})), 'name must be text'),
+    (json.dumps(feature('x', properties={'name': 'Fort', 'description': {'en': 'Old'}})),
+     'description must be text'),
+])
+def test_badly_shaped_feature_is_a_row_error(bad, error):
+    rows = import_geojson([json.dumps(feature('First')), bad, json.dumps(feature('Last'))])
+    assert [(row_number, error) for row_number, _, error in rows] == [(1, None), (2, error), (3, None)]
+
+def test_numeric_name_is_converted():
+    rows = import_geojson([json.dumps(feature(42))])
+    assert rows[0][1]['name'] == '42'
+
+def test_gpx_waypoints_between_tracks():
+    gpx = (
+        '<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1" xmlns:tour="urn:tourism-platform:gpx">'
+        '<wpt lat="31.5" lon="74.3"><name>Fort</name><desc>Old</desc>'
+        '<extensions><tour:day_number>2</tour:day_number></extensions></wpt>'
+        '<trk><trkseg><trkpt lat="1" lon="2"><name>not a stop</name></trkpt></trkseg></trk>'
+        '<wpt lat="31.6" lon="74.4"><name>Gate</name></wpt>'
+        '</gpx>'
+    )
+    rows = list(stop_io.iter_import(io.BytesIO(gpx.encode('utf-8')), 'gpx'))
+    assert [(values['name'], values['description'], values['day_number']) for _, values, _ in rows] == [
+        ('Fort', 'Old', 2), ('Gate', '', 1)
+    ]
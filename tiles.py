@@ -0,0 +1,268 @@
+"""
+Map tile proxy
+Serves the map's street, satellite and topo tiles from the app so visitors
+in the same region share one copy instead of each fetching from OSM, Esri
+and OpenTopoMap. Tiles come from, in order: an MBTiles file for the layer
+(for fully offline serving), a size-bounded LRU cache in an SQLite file,
+and finally the upstream server. Cached tiles past their max age are
+revalidated upstream with If-None-Match / If-Modified-Since, and served
+stale if the upstream cannot be reached.
+"""
+
+import hashlib
+import math
+import os
+import random
+import sqlite3
+import time
+import urllib.error
+import urllib.request
+from contextlib import closing
+
+LAYERS = {
+    'street': {
+        'url': 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',
+        'subdomains': 'abc',
+        'max_zoom': 19,
+    },
+    'satellite': {
+        'url': 'https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+        'subdomains': '',
+        'max_zoom': 19,
+    },
+    'topo': {
+        'url': 'https://{s}.tile.opentopomap.org/{z}/{x}/{y}.png',
+        'subdomains': 'abc',
+        'max_zoom': 17,
+    },
+}
+
+# Seconds a cached tile is used without asking upstream (OSM asks for at
+# least 7 days)
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+# Last-access times are only written back once they are this stale, so
+# cache hits rarely turn into writes
+TOUCH_INTERVAL = 3600
+
+class TileError(Exception):
+    """Raised when a tile is not available from any source"""
+
+def tile_range(min_lat, min_lng, max_lat, max_lng, zoom):
+    """(min_x, min_y, max_x, max_y) of the Web Mercator tiles covering a box"""
+    def tile_xy(lat, lng):
+        lat = max(min(lat, 85.0511), -85.0511)
+        n = 2 ** zoom
+        x = int((lng + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    min_x, min_y = tile_xy(max_lat, min_lng)
+    max_x, max_y = tile_xy(min_lat, max_lng)
+    return min_x, min_y, max_x, max_y
+
+def valid_tile(layer, z, x, y):
+    return layer in LAYERS and 0 <= z <= LAYERS[layer]['max_zoom'] and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def content_type(data):
+    if data.startswith(b'\x89PNG'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8'):
+        return 'image/jpeg'
+    if data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+class MBTilesSource:
+    """Read-only tiles from MBTiles files named <layer>.mbtiles in a folder"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, layer):
+        path = os.path.join(self.folder, f'{layer}.mbtiles') if self.folder else None
+        return path if path and os.path.isfile(path) else None
+
+    def get(self, layer, z, x, y):
+        path = self.path(layer)
+        if path is None:
+            return None
+        with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as conn:
+            # MBTiles rows count from the bottom (TMS); the map counts from the top
+            row = conn.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                (z, x, 2 ** z - 1 - y)
+            ).fetchone()
+        return row[0] if row else None
+
+class TileCache:
+    """SQLite-backed tile store that evicts least recently used tiles over max_bytes"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tile ('
+                ' layer TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL,'
+                ' data BLOB NOT NULL, size INTEGER NOT NULL, etag TEXT, last_modified TEXT,'
+                ' fetched_at REAL NOT NULL, accessed_at REAL NOT NULL,'
+                ' PRIMARY KEY (layer, z, x, y))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_tile_accessed ON tile (accessed_at)')
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=10, isolation_level=None))
+
+    def get(self, layer, z, x, y):
+        """Cached (data, etag, last_modified, fetched_at) or None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT data, etag, last_modified, fetched_at, accessed_at FROM tile'
+                ' WHERE layer = ? AND z = ? AND x = ? AND y = ?', (layer, z, x, y)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[4] > TOUCH_INTERVAL:
+                conn.execute('UPDATE tile SET accessed_at = ? WHERE layer = ? AND z = ? AND x = ? AND y = ?',
+                             (now, layer, z, x, y))
+        return row[:4]
+
+    def put(self, layer, z, x, y, data, etag, last_modified):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO tile VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         (layer, z, x, y, data, len(data), etag, last_modified, now, now))
+        # Checking the total on every write would scan the table; sample instead
+        if random.random() < 0.05:
+            self.evict()
+
+    def refresh(self, layer, z, x, y):
+        """Mark a cached tile as just revalidated"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('UPDATE tile SET fetched_at = ?, accessed_at = ? WHERE layer = ? AND z = ? AND x = ? AND y = ?',
+                         (now, now, layer, z, x, y))
+
+    def size(self):
+        with self._connect() as conn:
+            return conn.execute('SELECT coalesce(sum(size), 0) FROM tile').fetchone()[0]
+
+    def evict(self):
+        """Delete least recently used tiles until the cache fits; returns how many were removed"""
+        with self._connect() as conn:
+            total = conn.execute('SELECT coalesce(sum(size), 0) FROM tile').fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+            # Trim to 90% so eviction doesn't run again on the next write
+            excess = total - int(self.max_bytes * 0.9)
+            victims = []
+            freed = 0
+            for layer, z, x, y, size in conn.execute('SELECT layer, z, x, y, size FROM tile ORDER BY accessed_at'):
+                victims.append((layer, z, x, y))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.execute('BEGIN')
+            conn.executemany('DELETE FROM tile WHERE layer = ? AND z = ? AND x = ? AND y = ?', victims)
+            conn.execute('COMMIT')
+        return len(victims)
+
+class TileService:
+    """Looks tiles up in MBTiles, then the cache, then upstream"""
+
+    def __init__(self, cache, mbtiles, user_agent, max_age=DEFAULT_MAX_AGE, offline=False, timeout=10):
+        self.cache = cache
+        self.mbtiles = mbtiles
+        self.user_agent = user_agent
+        self.max_age = max_age
+        self.offline = offline
+        self.timeout = timeout
+
+    def upstream_url(self, layer, z, x, y):
+        config = LAYERS[layer]
+        subdomain = random.choice(config['subdomains']) if config['subdomains'] else ''
+        return config['url'].format(s=subdomain, z=z, x=x, y=y)
+
+    def fetch(self, layer, z, x, y, etag=None, last_modified=None):
+        """Upstream (status, data, etag, last_modified); status 304 means the cached copy is current"""
+        request = urllib.request.Request(self.upstream_url(layer, z, x, y), headers={'User-Agent': self.user_agent})
+        if etag:
+            request.add_header('If-None-Match', etag)
+        if last_modified:
+            request.add_header('If-Modified-Since', last_modified)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers.get('ETag'), response.headers.get('Last-Modified')
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, None, etag, last_modified
+            raise TileError(f'Upstream returned {e.code}')
+        except OSError as e:
+            raise TileError(str(e))
+
+    def get(self, layer, z, x, y):
+        """(data, etag, max_age) for a tile; raises TileError when it cannot be had"""
+        data = self.mbtiles.get(layer, z, x, y)
+        if data is not None:
+            return data, hashlib.sha1(data).hexdigest(), self.max_age
+
+        cached = self.cache.get(layer, z, x, y)
+        if cached is not None:
+            data, etag, last_modified, fetched_at = cached
+            age = time.time() - fetched_at
+            if age < self.max_age or self.offline:
+                return data, hashlib.sha1(data).hexdigest(), max(int(self.max_age - age), 0)
+            try:
+                status, fresh, etag, last_modified = self.fetch(layer, z, x, y, etag, last_modified)
+            except TileError:
+                # Stale is better than a hole in the map
+                return data, hashlib.sha1(data).hexdigest(), 0
+            if status == 304:
+                self.cache.refresh(layer, z, x, y)
+                return data, hashlib.sha1(data).hexdigest(), self.max_age
+            self.cache.put(layer, z, x, y, fresh, etag, last_modified)
+            return fresh, hashlib.sha1(fresh).hexdigest(), self.max_age
+
+        if self.offline:
+            raise TileError('Tile not available offline')
+        _, data, etag, last_modified = self.fetch(layer, z, x, y)
+        self.cache.put(layer, z, x, y, data, etag, last_modified)
+        return data, hashlib.sha1(data).hexdigest(), self.max_age
+
+    def prefetch(self, layer, boxes, zooms, max_tiles, progress=None):
+        """Warm the cache with the tiles covering (min_lat, min_lng, max_lat, max_lng) boxes
+
+        Returns (fetched, skipped, failed). Raises ValueError before fetching
+        anything if more than max_tiles tiles would be needed.
+        """
+        wanted = set()
+        for zoom in zooms:
+            if zoom > LAYERS[layer]['max_zoom']:
+                continue
+            for box in boxes:
+                min_x, min_y, max_x, max_y = tile_range(*box, zoom)
+                wanted.update((zoom, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1))
+        if len(wanted) > max_tiles:
+            raise ValueError(f'{len(wanted)} tiles needed, more than the limit of {max_tiles}')
+
+        fetched = skipped = failed = 0
+        for z, x, y in sorted(wanted):
+            if self.mbtiles.get(layer, z, x, y) is not None or self.cache.get(layer, z, x, y) is not None:
+                skipped += 1
+                continue
+            try:
+                _, data, etag, last_modified = self.fetch(layer, z, x, y)
+                self.cache.put(layer, z, x, y, data, etag, last_modified)
+                fetched += 1
+            except TileError:
+                failed += 1
+            if progress:
+                progress(fetched + skipped + failed, len(wanted))
+        self.cache.evict()
+        return fetched, skipped, failed